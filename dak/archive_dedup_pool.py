@@ -25,13 +25,18 @@
 
 import apt_pkg
 import errno
+import filecmp
 import os
+import sqlalchemy.sql as sql
 import stat
 import sys
+from multiprocessing import Pool
 
 from daklib.dbconn import DBConn
 from daklib import daklog
+from daklib import utils
 from daklib.config import Config
+from daklib.hashcache import hash_fileobj
 
 Options = None
 Logger = None
@@ -44,72 +49,140 @@ def usage (exit_code=0):
     print """Usage: dak archive-dedup-pool [OPTION]...
   -h, --help                show this help and exit.
   -V, --version             display the version number and exit
+  -j, --jobs=NUMBER         deduplicate NUMBER groups of files in parallel
+  -v, --verify=METHOD       verify the content of files before linking them:
+                            "hash" compares their sha256sum with the database,
+                            "compare" compares them with the reference file
 """
     sys.exit(exit_code)
 
 ################################################################################
 
-def dedup_one(size, reference, *filenames):
-    stat_reference = os.stat(reference)
-
-    # safety net
-    if stat_reference.st_size != size:
-        raise RuntimeError('Size of {} does not match database: {} != {}'.format(
-            reference, size, stat_reference.st_size))
-
-    for filename in filenames:
-        stat_filename = os.stat(filename)
-
-        # if file is already a hard-linked, ignore
-        if stat_reference == stat_filename:
-            continue
+def verify_content(method, sha256sum, reference, filename):
+    if method == 'hash':
+        with open(filename, 'rb') as fh:
+            return hash_fileobj(fh)['sha256'] == sha256sum
+    elif method == 'compare':
+        return filecmp.cmp(reference, filename, shallow=False)
+    return True
+
+def dedup_one(size, sha256sum, verify, reference, *filenames):
+    """
+    Replace files by hardlinks to C{reference}.
+
+    Processing stops at the first file that cannot be deduplicated; the
+    files replaced up to then are still returned.
+
+    @rtype: tuple
+    @return: (deduplicated, reclaimed, error) where deduplicated is a list
+             of the replaced files, reclaimed the number of bytes freed and
+             error a message describing the failure or C{None}
+    """
+    deduplicated = []
+    reclaimed = 0
+    try:
+        stat_reference = os.stat(reference)
 
         # safety net
-        if stat_filename.st_size != size:
+        if stat_reference.st_size != size:
             raise RuntimeError('Size of {} does not match database: {} != {}'.format(
-                filename, size, stat_filename.st_size))
-
-        tempfile = filename + '.new'
-        os.link(reference, tempfile)
-        try:
-            Logger.log(["deduplicate", filename, reference])
-            os.rename(tempfile, filename)
-        finally:
+                reference, size, stat_reference.st_size))
+        if verify == 'hash' and not verify_content(verify, sha256sum, reference, reference):
+            raise RuntimeError('Content of {} does not match database'.format(reference))
+
+        for filename in filenames:
+            stat_filename = os.stat(filename)
+
+            # if file is already a hard-linked, ignore
+            if stat_reference == stat_filename:
+                continue
+
+            # safety net
+            if stat_filename.st_size != size:
+                raise RuntimeError('Size of {} does not match database: {} != {}'.format(
+                    filename, size, stat_filename.st_size))
+            if not verify_content(verify, sha256sum, reference, filename):
+                raise RuntimeError('Content of {} does not match {}'.format(filename, reference))
+
+            tempfile = filename + '.new'
+            os.link(reference, tempfile)
             try:
-                os.unlink(tempfile)
-            except OSError as e:
-                if e.errno != errno.ENOENT:
-                    raise
+                os.rename(tempfile, filename)
+            finally:
+                try:
+                    os.unlink(tempfile)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+            deduplicated.append(filename)
+            if stat_filename.st_nlink == 1:
+                reclaimed += size
+    except (RuntimeError, IOError, OSError) as e:
+        return deduplicated, reclaimed, str(e)
+
+    return deduplicated, reclaimed, None
+
+def dedup_helper(job):
+    """
+    Deduplicate one group of files.  This function runs in a subprocess.
+
+    @type job: tuple
+    @param job: (size, sha256sum, verify, filenames) where the first
+                filename is used as reference
+
+    @rtype: tuple
+    @return: (reference, deduplicated, reclaimed, error)
+    """
+    size, sha256sum, verify, filenames = job
+    deduplicated, reclaimed, error = dedup_one(size, sha256sum, verify, *filenames)
+    return (filenames[0], deduplicated, reclaimed, error)
 
 ################################################################################
 
-def dedup(session):
-    results = session.execute("""
-SELECT DISTINCT *
-    FROM (
-        SELECT
-            f.size,
-            array_agg(a.path || '/pool/' || c.name || '/' || f.filename) OVER (
-                -- we aggregate all files with the same size, sha256sum and archive
-                PARTITION BY f.size, f.sha256sum, a.id
-                -- the oldest should be first
-                ORDER by f.created
-                -- we always want to see all rows
-                ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
-            )
-            AS filenames
-            FROM
-                files AS f INNER JOIN
-                files_archive_map AS fa ON f.id = fa.file_id INNER JOIN
-                component c ON fa.component_id = c.id INNER JOIN
-                archive a ON fa.archive_id = a.id
-    ) AS f
+def dedup(session, pool, verify=None, chunk_size=1000):
+    # The groups are read through a server-side cursor and handed to the
+    # workers in chunks, so neither the database nor dak needs to hold all
+    # of them at once.
+    connection = session.connection().execution_options(stream_results=True)
+    results = connection.execute(sql.text("""
+SELECT
+    f.size,
+    f.sha256sum,
+    -- the oldest should be first
+    array_agg(a.path || '/pool/' || c.name || '/' || f.filename ORDER BY f.created)
+    AS filenames
+    FROM
+        files AS f INNER JOIN
+        files_archive_map AS fa ON f.id = fa.file_id INNER JOIN
+        component c ON fa.component_id = c.id INNER JOIN
+        archive a ON fa.archive_id = a.id
+    -- we aggregate all files with the same size, sha256sum and archive
+    GROUP BY a.id, f.size, f.sha256sum
     -- we only care about entries with more than one filename
-    WHERE array_length(filenames, 1) > 1
-    """)
-
-    for i in results:
-        dedup_one(i['size'], *i['filenames'])
+    HAVING COUNT(*) > 1
+    """))
+
+    count = 0
+    reclaimed = 0
+    errors = 0
+    while True:
+        rows = results.fetchmany(chunk_size)
+        if not rows:
+            break
+        jobs = [(row['size'], row['sha256sum'], verify, row['filenames']) for row in rows]
+        for reference, deduplicated, group_reclaimed, error in pool.imap_unordered(dedup_helper, jobs):
+            for filename in deduplicated:
+                Logger.log(["deduplicate", filename, reference])
+            if error is not None:
+                Logger.log(["E: could not deduplicate", reference, error])
+                errors += 1
+            count += len(deduplicated)
+            reclaimed += group_reclaimed
+    results.close()
+
+    Logger.log(["total", count, utils.size_type(reclaimed)])
+    if errors:
+        utils.warn("Could not deduplicate {0} groups of files, see the log for details.".format(errors))
 
 ################################################################################
 
@@ -117,13 +190,14 @@ def main():
     global Options, Logger
 
     cnf = Config()
-    session = DBConn().session()
 
-    Arguments = [('h',"help","Archive-Dedup-Pool::Options::Help")]
+    Arguments = [('h',"help","Archive-Dedup-Pool::Options::Help"),
+                 ('j',"jobs","Archive-Dedup-Pool::Options::Jobs","HasArg"),
+                 ('v',"verify","Archive-Dedup-Pool::Options::Verify","HasArg")]
 
     apt_pkg.parse_commandline(cnf.Cnf,Arguments,sys.argv)
 
-    for i in ["help"]:
+    for i in ["help", "jobs", "verify"]:
         key = "Archive-Dedup-Pool::Options::%s" % i
         if key not in cnf:
             cnf[key] = ""
@@ -133,10 +207,23 @@ def main():
     if Options["Help"]:
         usage()
 
+    verify = Options["Verify"] or None
+    if verify not in (None, 'hash', 'compare'):
+        utils.fubar("Unknown verification method: {0}".format(verify))
+
+    processes = None
+    if Options["Jobs"]:
+        processes = int(Options["Jobs"])
+    pool = Pool(processes)
+
+    session = DBConn().session()
+
     Logger = daklog.Logger("archive-dedup-pool")
 
-    dedup(session)
+    dedup(session, pool, verify)
 
+    pool.close()
+    pool.join()
     Logger.close()
 
 ################################################################################
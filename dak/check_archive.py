@@ -32,13 +32,17 @@
 
 import commands
 import os
+import random
 import stat
 import sys
 import time
 import apt_pkg
 import apt_inst
+from multiprocessing import Pool
 
 from daklib.dbconn import *
+from daklib.hashcache import hash_fileobj
+from daklib.poolstate import list_pool, record_file_states, stat_key
 from daklib import utils
 from daklib.config import Config
 from daklib.dak_exceptions import InvalidDscError, ChangesUnicodeError, CantOpenError
@@ -60,6 +64,15 @@ Run various sanity checks of the archive and/or database.
 
   -h, --help                show this help and exit.
 
+Options for the checksums mode:
+
+  -j, --jobs=NUMBER         check NUMBER files in parallel
+  -s, --sample=PERCENT      only check PERCENT of the files, chosen at random
+  -r, --resume              continue after the last file checked by an
+                            interrupted run
+  -m, --max-age=DAYS        only hash files verified within the last DAYS
+                            days again if their size, mtime or inode changed
+
 The following MODEs are available:
 
   checksums          - validate the checksums stored in the database
@@ -143,27 +156,34 @@ def check_files():
     for row in session.execute(query):
         print "MISSING-ARCHIVE-FILE {0} {1} {2}".vformat(row)
 
-    archive_files = session.query(ArchiveFile) \
-        .join(ArchiveFile.archive).join(ArchiveFile.file) \
-        .order_by(Archive.archive_name, PoolFile.filename)
+    # Directories whose mtime did not change since the last run are not
+    # listed again, see daklib.poolstate.
+    archives = session.query(Archive).order_by(Archive.archive_name)
+    existing_files = {}
+    for a in archives:
+        existing_files[a.archive_name] = list_pool(session, os.path.join(a.path, 'pool'))
+    session.commit()
 
+    query = """
+        SELECT archive.name, archive.path, c.name, f.filename
+          FROM files_archive_map af
+          JOIN archive ON af.archive_id = archive.id
+          JOIN component c ON af.component_id = c.id
+          JOIN files f ON af.file_id = f.id
+         ORDER BY archive.name, f.filename
+        """
     expected_files = set()
-    for af in archive_files:
-        path = af.path
-        expected_files.add(af.path)
+    for archive_name, archive_path, component_name, filename in session.execute(query):
+        path = os.path.join(archive_path, 'pool', component_name, filename)
+        expected_files.add(path)
+        if path in existing_files[archive_name]:
+            continue
         if not os.path.exists(path):
-            print "MISSING-FILE {0} {1} {2}".format(af.archive.archive_name, af.file.filename, path)
+            print "MISSING-FILE {0} {1} {2}".format(archive_name, filename, path)
 
-    archives = session.query(Archive).order_by(Archive.archive_name)
-
-    for a in archives:
-        top = os.path.join(a.path, 'pool')
-        for dirpath, dirnames, filenames in os.walk(top):
-            for fn in filenames:
-                path = os.path.join(dirpath, fn)
-                if path in expected_files:
-                    continue
-                print "UNEXPECTED-FILE {0} {1}".format(a.archive_name, path)
+    for archive_name in sorted(existing_files):
+        for path in sorted(existing_files[archive_name] - expected_files):
+            print "UNEXPECTED-FILE {0} {1}".format(archive_name, path)
 
 ################################################################################
 
@@ -265,41 +285,131 @@ def check_source_in_one_dir():
     print "Found %d source packages where the source is not all in one directory." % (broken_count)
 
 ################################################################################
-def check_checksums():
+
+_checksums_query = """
+SELECT DISTINCT ON (f.id)
+       f.id, a.path || '/pool/' || c.name || '/' || f.filename,
+       f.size, f.md5sum, f.sha1sum, f.sha256sum,
+       ps.path, ps.size, ps.mtime, ps.inode,
+       COALESCE(ps.last_verified > now() - :max_age * INTERVAL '1 day', FALSE)
+  FROM files f
+  JOIN files_archive_map af ON af.file_id = f.id
+  JOIN archive a ON a.id = af.archive_id
+  JOIN component c ON c.id = af.component_id
+  LEFT JOIN pool_file_state ps ON ps.file_id = f.id
+ WHERE f.id > :after
+ ORDER BY f.id, a.tainted DESC
+ LIMIT :limit
+"""
+
+def check_checksums_helper(job):
     """
-    Validate all files
+    Check size and checksums of a single file.  This function runs in a
+    subprocess.  Files that were verified recently are skipped if their
+    stat did not change since.
+
+    @type job: tuple
+    @param job: row of C{_checksums_query}
+
+    @rtype: tuple
+    @return: (state, warnings) where state is a (file_id, path, size,
+             mtime, inode) tuple for files that were verified and C{None}
+             otherwise
+    """
+    file_id, filename, size, md5sum, sha1sum, sha256sum = job[:6]
+    known_state, recent = job[6:10], job[10]
+    try:
+        state = (filename, ) + stat_key(os.stat(filename))
+        if recent and state == known_state:
+            return None, []
+        with open(filename, 'rb') as fh:
+            hashes = hash_fileobj(fh)
+    except (IOError, OSError):
+        return None, ["can't open '%s'." % (filename)]
+
+    warnings = []
+    for name, current, db in (('size', hashes['size'], size),
+                              ('md5sum', hashes['md5sum'], md5sum),
+                              ('sha1sum', hashes['sha1'], sha1sum),
+                              ('sha256sum', hashes['sha256'], sha256sum)):
+        if current != db:
+            warnings.append("**WARNING** %s mismatch for '%s' ('%s' [current] vs. '%s' [db])." % (name, filename, current, db))
+    if warnings:
+        return None, warnings
+    return (file_id, ) + state, warnings
+
+def read_checkpoint(filename):
+    try:
+        with open(filename) as fh:
+            return int(fh.read())
+    except (IOError, ValueError):
+        return 0
+
+def write_checkpoint(filename, file_id):
+    with open(filename + '.new', 'w') as fh:
+        fh.write("%d\n" % (file_id))
+    os.rename(filename + '.new', filename)
+
+def check_checksums(processes=None, sample=None, resume=False, max_age=0, batch_size=10000):
     """
-    print "Getting file information from database..."
-    q = DBConn().session().query(PoolFile)
+    Validate all files
 
-    print "Checking file checksums & sizes..."
-    for f in q:
-        filename = f.fullpath
+    Files are read from the database in batches ordered by id and are
+    hashed in parallel by C{processes} workers.  After each batch the id
+    of the last file is recorded in C{Dir::Cache}, so an interrupted run
+    can be continued with C{resume}.
 
-        try:
-            fi = utils.open_file(filename)
-        except:
-            utils.warn("can't open '%s'." % (filename))
-            continue
+    Files verified less than C{max_age} days ago are only hashed again if
+    their size, mtime or inode changed.
 
-        size = os.stat(filename)[stat.ST_SIZE]
-        if size != f.filesize:
-            utils.warn("**WARNING** size mismatch for '%s' ('%s' [current] vs. '%s' [db])." % (filename, size, f.filesize))
+    @type processes: int
+    @param processes: number of files to check in parallel
 
-        md5sum = apt_pkg.md5sum(fi)
-        if md5sum != f.md5sum:
-            utils.warn("**WARNING** md5sum mismatch for '%s' ('%s' [current] vs. '%s' [db])." % (filename, md5sum, f.md5sum))
+    @type sample: float
+    @param sample: only check this percentage of the files, chosen at random
 
-        fi.seek(0)
-        sha1sum = apt_pkg.sha1sum(fi)
-        if sha1sum != f.sha1sum:
-            utils.warn("**WARNING** sha1sum mismatch for '%s' ('%s' [current] vs. '%s' [db])." % (filename, sha1sum, f.sha1sum))
+    @type resume: bool
+    @param resume: continue after the last file checked by an interrupted run
 
-        fi.seek(0)
-        sha256sum = apt_pkg.sha256sum(fi)
-        if sha256sum != f.sha256sum:
-            utils.warn("**WARNING** sha256sum mismatch for '%s' ('%s' [current] vs. '%s' [db])." % (filename, sha256sum, f.sha256sum))
+    @type max_age: int
+    @param max_age: number of days after which files are always hashed again
+    """
+    cnf = Config()
+    checkpoint = os.path.join(cnf['Dir::Cache'], 'check-archive.checksums')
+    after = read_checkpoint(checkpoint) if resume else 0
 
+    pool = Pool(processes)
+    session = DBConn().session()
+
+    print "Checking file checksums & sizes..."
+    checked = 0
+    hashed = 0
+    params = {'after': after, 'limit': batch_size, 'max_age': max_age}
+    while True:
+        rows = session.execute(_checksums_query, params).fetchall()
+        session.rollback()
+        if not rows:
+            break
+        params['after'] = rows[-1][0]
+        jobs = [tuple(row) for row in rows if sample is None or random.random() * 100 < sample]
+        states = []
+        for state, warnings in pool.imap_unordered(check_checksums_helper, jobs, chunksize=16):
+            for warning in warnings:
+                utils.warn(warning)
+            if state is not None:
+                states.append(state)
+        record_file_states(session, states)
+        session.commit()
+        checked += len(jobs)
+        hashed += len(states)
+        write_checkpoint(checkpoint, params['after'])
+        print "Checked %d files, hashed %d." % (checked, hashed)
+
+    pool.close()
+    pool.join()
+    session.close()
+    if os.path.exists(checkpoint):
+        os.unlink(checkpoint)
     print "Done."
 
 ################################################################################
@@ -530,8 +640,12 @@ def main ():
 
     cnf = Config()
 
-    Arguments = [('h',"help","Check-Archive::Options::Help")]
-    for i in [ "help" ]:
+    Arguments = [('h',"help","Check-Archive::Options::Help"),
+                 ('j',"jobs","Check-Archive::Options::Jobs","HasArg"),
+                 ('s',"sample","Check-Archive::Options::Sample","HasArg"),
+                 ('r',"resume","Check-Archive::Options::Resume"),
+                 ('m',"max-age","Check-Archive::Options::Max-Age","HasArg")]
+    for i in [ "help", "jobs", "sample", "resume", "max-age" ]:
         key = "Check-Archive::Options::%s" % i
         if key not in cnf:
             cnf[key] = ""
@@ -554,7 +668,16 @@ def main ():
     DBConn()
 
     if mode == "checksums":
-        check_checksums()
+        processes = None
+        if Options["Jobs"]:
+            processes = int(Options["Jobs"])
+        sample = None
+        if Options["Sample"]:
+            sample = float(Options["Sample"])
+        max_age = 0
+        if Options["Max-Age"]:
+            max_age = int(Options["Max-Age"])
+        check_checksums(processes, sample, bool(Options["Resume"]), max_age)
     elif mode == "files":
         check_files()
     elif mode == "dsc-syntax":
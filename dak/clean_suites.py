@@ -36,12 +36,14 @@
 
 import errno
 import os
-import sqlalchemy.sql as sql
+import shutil
 import stat
 import sys
 import time
 import apt_pkg
 from datetime import datetime, timedelta
+from collections import defaultdict
+from multiprocessing import Pool
 
 from daklib.config import Config
 from daklib.dbconn import *
@@ -61,7 +63,10 @@ Clean old packages from suites.
 
   -n, --no-action            don't do anything
   -h, --help                 show this help and exit
-  -m, --maximum              maximum number of files to remove"""
+  -m, --maximum              maximum number of files to remove
+  -j, --jobs=NUMBER          remove NUMBER files in parallel
+  -r, --removed-dirs         only remove empty directories files were
+                             removed from in this run"""
     sys.exit(exit_code)
 
 ################################################################################
@@ -217,7 +222,71 @@ def clean_binaries(now_date, session):
 
 ########################################
 
-def clean(now_date, archives, max_delete, session):
+def clean_file_helper(job):
+    """
+    Remove a file from the pool or move it to the morgue.  This function
+    runs in a subprocess.
+
+    @type job: tuple
+    @param job: (filename, dest_filename, no_action) where dest_filename
+                is the name in the morgue or C{None} to delete the file
+
+    @rtype: tuple
+    @return: (result, size, error) where result is one of C{'missing'},
+             C{'invalid'}, C{'symlink'}, C{'file'} or C{'error'}
+    """
+    filename, dest_filename, no_action = job
+    try:
+        if not os.path.exists(filename):
+            return ('missing', 0, None)
+        if not os.path.isfile(filename):
+            return ('invalid', 0, None)
+        if os.path.islink(filename):
+            if not no_action:
+                os.unlink(filename)
+            return ('symlink', 0, None)
+        size = os.stat(filename)[stat.ST_SIZE]
+        if not no_action:
+            if dest_filename is None:
+                os.unlink(filename)
+            else:
+                move_to_morgue(filename, dest_filename)
+        return ('file', size, None)
+    except (IOError, OSError) as e:
+        return ('error', 0, str(e))
+
+def move_to_morgue(filename, dest_filename):
+    """
+    Move a file to the morgue.  Files are hardlinked and unlinked if the
+    morgue is on the same filesystem as the pool; otherwise they are
+    copied.  Files with several links, for example twins made by
+    archive-dedup-pool, are always copied: the morgue must neither share
+    an inode with a published file nor change its permissions.  Existing
+    files in the morgue are never overwritten.
+    """
+    if os.stat(filename).st_nlink == 1:
+        try:
+            os.link(filename, dest_filename)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        else:
+            os.chmod(dest_filename, 0o664)
+            os.unlink(filename)
+            return
+
+    fd = os.open(dest_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o664)
+    try:
+        with os.fdopen(fd, 'wb') as dest, open(filename, 'rb') as src:
+            shutil.copyfileobj(src, dest)
+    except:
+        os.unlink(dest_filename)
+        raise
+    shutil.copystat(filename, dest_filename)
+    os.chmod(dest_filename, 0o664)
+    os.unlink(filename)
+
+def clean(now_date, archives, max_delete, session, pool, batch_size=1000):
     cnf = Config()
 
     count = 0
@@ -270,51 +339,93 @@ def clean(now_date, archives, max_delete, session):
         session.commit()
 
     # Delete files from the pool
-    old_files = session.query(ArchiveFile).filter(sql.text('files_archive_map.last_used <= (SELECT delete_date FROM archive_delete_date ad WHERE ad.archive_id = files_archive_map.archive_id)')).join(Archive)
+    query = """
+        SELECT af.archive_id, af.file_id, af.component_id,
+               archive.path, c.name, f.filename, archive.use_morgue
+          FROM files_archive_map af
+          JOIN archive ON af.archive_id = archive.id
+          JOIN component c ON af.component_id = c.id
+          JOIN files f ON af.file_id = f.id
+          JOIN archive_delete_date ad ON af.archive_id = ad.archive_id
+         WHERE af.last_used <= ad.delete_date"""
+    params = {}
+    if archives is not None:
+        query += " AND af.archive_id = ANY(:archive_ids)"
+        params['archive_ids'] = [ a.archive_id for a in archives ]
     if max_delete is not None:
-        old_files = old_files.limit(max_delete)
+        query += " LIMIT :limit"
+        params['limit'] = max_delete
         Logger.log(["Limiting removals to %d" % max_delete])
-
-    if archives is not None:
-        archive_ids = [ a.archive_id for a in archives ]
-        old_files = old_files.filter(ArchiveFile.archive_id.in_(archive_ids))
-
-    for af in old_files:
-        filename = af.path
-        if not os.path.exists(filename):
-            Logger.log(["database referred to non-existing file", af.path])
-            session.delete(af)
-            continue
-        Logger.log(["delete archive file", filename])
-        if os.path.isfile(filename):
-            if os.path.islink(filename):
-                count += 1
+    old_files = session.execute(query, params).fetchall()
+
+    # Pick the names in the morgue up front, the workers must not race for them
+    morgue_names = set()
+    if os.path.isdir(dest):
+        morgue_names.update(os.listdir(dest))
+
+    jobs = []
+    for archive_id, file_id, component_id, archive_path, component_name, filename, use_morgue in old_files:
+        filename = os.path.join(archive_path, 'pool', component_name, filename)
+        dest_filename = None
+        if use_morgue:
+            basename = os.path.basename(filename)
+            candidate = basename
+            extra = 0
+            while candidate in morgue_names:
+                candidate = basename + '.' + repr(extra)
+                extra += 1
+            morgue_names.add(candidate)
+            dest_filename = os.path.join(dest, candidate)
+        jobs.append(((archive_id, file_id, component_id), archive_path,
+                     (filename, dest_filename, bool(Options["No-Action"]))))
+
+    invalid = []
+    removed_from = defaultdict(set)
+    for start in range(0, len(jobs), batch_size):
+        batch = jobs[start:start + batch_size]
+        results = pool.map(clean_file_helper, [job for key, archive_path, job in batch], chunksize=16)
+        deleted = []
+        for (key, archive_path, (filename, dest_filename, no_action)), (result, file_size, error) in zip(batch, results):
+            if result == 'missing':
+                Logger.log(["database referred to non-existing file", filename])
+                deleted.append(key)
+                continue
+            if result == 'invalid':
+                invalid.append(filename)
+                continue
+            Logger.log(["delete archive file", filename])
+            if result == 'error':
+                Logger.log(["E: could not remove", filename, error])
+                continue
+            count += 1
+            removed_from[archive_path].add(os.path.dirname(filename))
+            if result == 'symlink':
                 Logger.log(["delete symlink", filename])
-                if not Options["No-Action"]:
-                    os.unlink(filename)
             else:
-                size += os.stat(filename)[stat.ST_SIZE]
-                count += 1
-
-                dest_filename = dest + '/' + os.path.basename(filename)
-                # If the destination file exists; try to find another filename to use
-                if os.path.lexists(dest_filename):
-                    dest_filename = utils.find_next_free(dest_filename)
-
-                if not Options["No-Action"]:
-                    if af.archive.use_morgue:
+                size += file_size
+                if not no_action:
+                    if dest_filename is not None:
                         Logger.log(["move to morgue", filename, dest_filename])
-                        utils.move(filename, dest_filename)
                     else:
                         Logger.log(["removed file", filename])
-                        os.unlink(filename)
-
-            if not Options["No-Action"]:
-                session.delete(af)
-                session.commit()
-
-        else:
-            utils.fubar("%s is neither symlink nor file?!" % (filename))
+            deleted.append(key)
+
+        if deleted and not Options["No-Action"]:
+            session.execute("""
+                DELETE FROM files_archive_map af
+                 USING (SELECT UNNEST(CAST(:archive_ids AS INTEGER[])) AS archive_id,
+                               UNNEST(CAST(:file_ids AS INTEGER[])) AS file_id,
+                               UNNEST(CAST(:component_ids AS INTEGER[])) AS component_id) d
+                 WHERE af.archive_id = d.archive_id
+                   AND af.file_id = d.file_id
+                   AND af.component_id = d.component_id""",
+                {'archive_ids': [key[0] for key in deleted],
+                 'file_ids': [key[1] for key in deleted],
+                 'component_ids': [key[2] for key in deleted]})
+            session.commit()
+
+        if invalid:
+            utils.fubar("%s is neither symlink nor file?!" % (invalid[0]))
 
     if count > 0:
         Logger.log(["total", count, utils.size_type(size)])
@@ -329,6 +440,8 @@ def clean(now_date, archives, max_delete, session):
     if not Options["No-Action"]:
         session.commit()
 
+    return removed_from
+
 ################################################################################
 
 def clean_maintainers(now_date, session):
@@ -386,7 +499,32 @@ SELECT f.id, f.fingerprint FROM fingerprint f
 
 ################################################################################
 
-def clean_byhash(now_date, session):
+def remove_byhash_files_helper(files):
+    """
+    Remove unused by-hash files of one archive.  This function runs in a
+    subprocess.
+
+    @type files: list
+    @param files: list of (filename, suite, path) tuples
+
+    @rtype: list
+    @return: list of (result, filename, suite, path, error) tuples where
+             result is one of C{'deleted'}, C{'missing'} or C{'error'}
+    """
+    results = []
+    for filename, suite, path in files:
+        try:
+            os.unlink(filename)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                results.append(('error', filename, suite, path, str(exc)))
+            else:
+                results.append(('missing', filename, suite, path, None))
+        else:
+            results.append(('deleted', filename, suite, path, None))
+    return results
+
+def clean_byhash(now_date, session, pool, removed_from):
     cnf = Config()
     suite_suffix = cnf.find("Dinstall::SuiteSuffix", "")
 
@@ -402,16 +540,24 @@ def clean_byhash(now_date, session):
     count = q.rowcount
 
     if not Options["No-Action"]:
+        # Archives are handled concurrently
+        files = defaultdict(list)
         for base, suite, path in q:
             filename = os.path.join(base, 'dists', suite, suite_suffix, path)
-            try:
-                os.unlink(filename)
-            except OSError as exc:
-                if exc.errno != errno.ENOENT:
-                    raise
-                Logger.log(['database referred to non-existing file', filename])
-            else:
-                Logger.log(['delete hashfile', suite, path])
+            files[base].append((filename, suite, path))
+        bases = sorted(files)
+        errors = []
+        for base, results in zip(bases, pool.map(remove_byhash_files_helper, [files[base] for base in bases])):
+            for result, filename, suite, path, error in results:
+                if result == 'error':
+                    errors.append("%s: %s" % (filename, error))
+                elif result == 'missing':
+                    Logger.log(['database referred to non-existing file', filename])
+                else:
+                    Logger.log(['delete hashfile', suite, path])
+                    removed_from[base].add(os.path.dirname(filename))
+        if errors:
+            utils.fubar("Could not delete hashfile %s" % (errors[0]))
         session.commit()
 
     if count > 0:
@@ -419,9 +565,55 @@ def clean_byhash(now_date, session):
 
 ################################################################################
 
-def clean_empty_directories(session):
+def remove_empty_directories_helper(job):
+    """
+    Remove empty directories below an archive.  This function runs in a
+    subprocess.
+
+    @type job: tuple
+    @param job: (base, directories, no_action) where directories is a list
+                of the directories to check or C{None} to check all of them
+
+    @rtype: list
+    @return: removed directories
+    """
+    base, directories, no_action = job
+    removed = []
+    if directories is None:
+        for dirpath, dirnames, filenames in os.walk(base, topdown=False):
+            if not filenames and not dirnames:
+                to_remove = os.path.join(base, dirpath)
+                if not no_action:
+                    os.removedirs(to_remove)
+                removed.append(to_remove)
+        return removed
+
+    # Children sort after their parents
+    for directory in sorted(directories, reverse=True):
+        while directory.startswith(base + '/'):
+            try:
+                if os.listdir(directory):
+                    break
+                if not no_action:
+                    os.rmdir(directory)
+            except OSError:
+                break
+            removed.append(directory)
+            if no_action:
+                break
+            directory = os.path.dirname(directory)
+    return removed
+
+def clean_empty_directories(session, pool, removed_from=None):
     """
     Removes empty directories from pool directories.
+
+    If C{removed_from} is given, only the directories files were removed
+    from and their parents are checked instead of walking the archives.
+
+    @type removed_from: dict
+    @param removed_from: maps archive paths to directories files were
+                         removed from
     """
 
     Logger.log(["Cleaning out empty directories..."])
@@ -433,14 +625,18 @@ def clean_empty_directories(session):
     )
     bases = [x[0] for x in cursor.fetchall()]
 
-    for base in bases:
-        for dirpath, dirnames, filenames in os.walk(base, topdown=False):
-            if not filenames and not dirnames:
-                to_remove = os.path.join(base, dirpath)
-                if not Options["No-Action"]:
-                    Logger.log(["removing directory", to_remove])
-                    os.removedirs(to_remove)
-                count += 1
+    if removed_from is None:
+        jobs = [(base, None, bool(Options["No-Action"])) for base in bases]
+    else:
+        jobs = [(base, sorted(removed_from[base]), bool(Options["No-Action"]))
+                for base in bases if removed_from.get(base)]
+
+    # Archives are handled concurrently
+    for removed in pool.map(remove_empty_directories_helper, jobs):
+        for to_remove in removed:
+            if not Options["No-Action"]:
+                Logger.log(["removing directory", to_remove])
+            count += 1
 
     if count:
         Logger.log(["total removed directories", count])
@@ -470,7 +666,7 @@ def main():
 
     cnf = Config()
 
-    for i in ["Help", "No-Action", "Maximum" ]:
+    for i in ["Help", "No-Action", "Maximum", "Jobs", "Removed-Dirs" ]:
         key = "Clean-Suites::Options::%s" % i
         if key not in cnf:
             cnf[key] = ""
@@ -478,7 +674,9 @@ def main():
     Arguments = [('h',"help","Clean-Suites::Options::Help"),
                  ('a','archive','Clean-Suites::Options::Archive','HasArg'),
                  ('n',"no-action","Clean-Suites::Options::No-Action"),
-                 ('m',"maximum","Clean-Suites::Options::Maximum", "HasArg")]
+                 ('m',"maximum","Clean-Suites::Options::Maximum", "HasArg"),
+                 ('j',"jobs","Clean-Suites::Options::Jobs", "HasArg"),
+                 ('r',"removed-dirs","Clean-Suites::Options::Removed-Dirs")]
 
     apt_pkg.parse_commandline(cnf.Cnf, Arguments, sys.argv)
     Options = cnf.subtree("Clean-Suites::Options")
@@ -502,6 +700,11 @@ def main():
         program = "clean-suites (no action)"
     Logger = daklog.Logger(program, debug=Options["No-Action"])
 
+    processes = None
+    if Options["Jobs"]:
+        processes = int(Options["Jobs"])
+    pool = Pool(processes)
+
     session = DBConn().session()
 
     archives = None
@@ -519,11 +722,16 @@ def main():
     clean_binaries(now_date, session)
     check_sources(now_date, session)
     check_files(now_date, session)
-    clean(now_date, archives, max_delete, session)
+    removed_from = clean(now_date, archives, max_delete, session, pool)
     clean_maintainers(now_date, session)
     clean_fingerprints(now_date, session)
-    clean_byhash(now_date, session)
-    clean_empty_directories(session)
+    clean_byhash(now_date, session, pool, removed_from)
+    if Options["Removed-Dirs"]:
+        clean_empty_directories(session, pool, removed_from)
+    else:
+        clean_empty_directories(session, pool)
+    pool.close()
+    pool.join()
 
     session.rollback()
 
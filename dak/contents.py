@@ -84,6 +84,9 @@ OPTIONS for generate
 OPTIONS for scan-source and scan-binary
      -l, --limit=NUMBER
         maximum number of packages to scan
+
+     -j, --jobs=NUMBER
+        number of packages to scan in parallel (default: number of CPUs)
 """)
     sys.exit(exit_code)
 
@@ -96,22 +99,32 @@ def write_all(cnf, archive_names = [], suite_names = [], component_names = [], f
 
 ################################################################################
 
-def binary_scan_all(cnf, limit):
+def binary_scan_all(cnf, limit, processes):
     Logger = daklog.Logger('contents scan-binary')
-    result = BinaryContentsScanner.scan_all(limit)
+    def progress(scanned, total):
+        Logger.log(['%d of %d packages scanned' % (scanned, total)])
+    result = BinaryContentsScanner.scan_all(limit, processes, progress = progress)
+    for error in result['errors']:
+        Logger.log(['error', error])
     processed = '%(processed)d packages processed' % result
+    failed = '%(failed)d packages failed' % result
     remaining = '%(remaining)d packages remaining' % result
-    Logger.log([processed, remaining])
+    Logger.log([processed, failed, remaining])
     Logger.close()
 
 ################################################################################
 
-def source_scan_all(cnf, limit):
+def source_scan_all(cnf, limit, processes):
     Logger = daklog.Logger('contents scan-source')
-    result = SourceContentsScanner.scan_all(limit)
+    def progress(scanned, total):
+        Logger.log(['%d of %d packages scanned' % (scanned, total)])
+    result = SourceContentsScanner.scan_all(limit, processes, progress = progress)
+    for error in result['errors']:
+        Logger.log(['error', error])
     processed = '%(processed)d packages processed' % result
+    failed = '%(failed)d packages failed' % result
     remaining = '%(remaining)d packages remaining' % result
-    Logger.log([processed, remaining])
+    Logger.log([processed, failed, remaining])
     Logger.close()
 
 ################################################################################
@@ -122,12 +135,14 @@ def main():
     cnf['Contents::Options::Suite'] = ''
     cnf['Contents::Options::Component'] = ''
     cnf['Contents::Options::Limit'] = ''
+    cnf['Contents::Options::Jobs'] = ''
     cnf['Contents::Options::Force'] = ''
     arguments = [('h', "help",      'Contents::Options::Help'),
                  ('a', 'archive',   'Contents::Options::Archive',   'HasArg'),
                  ('s', "suite",     'Contents::Options::Suite',     "HasArg"),
                  ('c', "component", 'Contents::Options::Component', "HasArg"),
                  ('l', "limit",     'Contents::Options::Limit',     "HasArg"),
+                 ('j', "jobs",      'Contents::Options::Jobs',      "HasArg"),
                  ('f', "force",     'Contents::Options::Force'),
                 ]
     args = apt_pkg.parse_commandline(cnf.Cnf, arguments, sys.argv)
@@ -140,12 +155,16 @@ def main():
     if len(options['Limit']) > 0:
         limit = int(options['Limit'])
 
+    processes = None
+    if len(options['Jobs']) > 0:
+        processes = int(options['Jobs'])
+
     if args[0] == 'scan-source':
-        source_scan_all(cnf, limit)
+        source_scan_all(cnf, limit, processes)
         return
 
     if args[0] == 'scan-binary':
-        binary_scan_all(cnf, limit)
+        binary_scan_all(cnf, limit, processes)
         return
 
     archive_names   = utils.split_args(options['Archive'])
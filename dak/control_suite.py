@@ -170,10 +170,10 @@ def version_checks(package, architecture, target_suite, new_version, session, fo
 
     for suite, version in suite_version_list:
         cmp = apt_pkg.version_compare(new_version, version)
-        if suite in must_be_newer_than and cmp < 1:
+        if suite in must_be_newer_than and cmp <= 0:
             utils.warn("%s (%s): version check violated: %s targeted at %s is *not* newer than %s in %s" % (package, architecture, new_version, target_suite, version, suite))
             violations = True
-        if suite in must_be_older_than and cmp > 1:
+        if suite in must_be_older_than and cmp > 0:
             utils.warn("%s (%s): version check violated: %s targeted at %s is *not* older than %s in %s" % (package, architecture, new_version, target_suite, version, suite))
             violations = True
 
@@ -185,6 +185,62 @@ def version_checks(package, architecture, target_suite, new_version, session, fo
 
 #######################################################################################
 
+def version_checks_bulk(suite, session, force=False):
+    """
+    Run the version checks for all packages in C{control_suite_add}.
+
+    This does the same checks as L{version_checks} with one query for all
+    packages instead of several queries for each of them.
+    """
+    q = session.execute("""
+        WITH checks AS (
+            SELECT vc.reference AS suite, vc."check"
+              FROM version_check vc
+             WHERE vc.suite = :suite_id AND vc."check" IN ('MustBeNewerThan', 'MustBeOlderThan')
+            UNION
+            -- Must be newer than an existing version in the target suite
+            SELECT :suite_id, 'MustBeNewerThan'
+        ),
+        other AS (
+            SELECT sa.suite, s.source AS package, 'source' AS architecture, s.version
+              FROM src_associations sa
+              JOIN source s ON sa.source = s.id
+             WHERE s.source IN (SELECT package FROM control_suite_add WHERE architecture = 'source')
+            UNION ALL
+            SELECT ba.suite, b.package, a.arch_string, b.version
+              FROM bin_associations ba
+              JOIN binaries b ON ba.bin = b.id
+              JOIN architecture a ON b.architecture = a.id
+             WHERE b.package IN (SELECT package FROM control_suite_add WHERE architecture <> 'source')
+        )
+        SELECT d.package, d.architecture, d.version, s.suite_name, o.version, c."check"
+          FROM control_suite_add d
+          JOIN other o
+            ON o.package = d.package
+           AND (o.architecture = d.architecture
+                OR (o.architecture = 'all' AND d.architecture <> 'source'))
+          JOIN checks c ON c.suite = o.suite
+          JOIN suite s ON s.id = o.suite
+         WHERE (c."check" = 'MustBeNewerThan' AND d.version <= o.version)
+            OR (c."check" = 'MustBeOlderThan' AND d.version > o.version)
+         ORDER BY d.package, d.architecture, s.suite_name""", {'suite_id': suite.suite_id})
+
+    violations = False
+    for package, architecture, new_version, other_suite, version, check in q:
+        if check == 'MustBeNewerThan':
+            utils.warn("%s (%s): version check violated: %s targeted at %s is *not* newer than %s in %s" % (package, architecture, new_version, suite.suite_name, version, other_suite))
+        else:
+            utils.warn("%s (%s): version check violated: %s targeted at %s is *not* older than %s in %s" % (package, architecture, new_version, suite.suite_name, version, other_suite))
+        violations = True
+
+    if violations:
+        if force:
+            utils.warn("Continuing anyway (forced)...")
+        else:
+            utils.fubar("Aborting. Version checks violated and not forced.")
+
+#######################################################################################
+
 def cmp_package_version(a, b):
     """
     comparison function for tuples of the form (package-name, version, arch, ...)
@@ -202,9 +258,59 @@ def cmp_package_version(a, b):
 
 #######################################################################################
 
+def add_to_suite(transaction, suite, packages, table, column):
+    """
+    Add packages to a suite.
+
+    Packages whose files are all present in the suite's archive are
+    associated with a single INSERT, the others are copied one by one.
+
+    @type  packages: dict
+    @param packages: maps (package, version, architecture) to (id, present)
+                     where present tells if all files of the package are
+                     already in the suite's archive
+
+    @type  table: str
+    @param table: association table, C{src_associations} or C{bin_associations}
+
+    @type  column: str
+    @param column: column of C{table} referencing the package
+    """
+    session = transaction.session
+    bulk = []
+    for key in sorted(packages, cmp=cmp_package_version):
+        pkid, present = packages[key]
+        if present:
+            bulk.append(key)
+            continue
+        if table == 'src_associations':
+            pkg = session.query(DBSource).get(pkid)
+            transaction.copy_source(pkg, suite, pkg.poolfile.component)
+        else:
+            pkg = session.query(DBBinary).get(pkid)
+            transaction.copy_binary(pkg, suite, pkg.poolfile.component)
+        Logger.log(["added", suite.suite_name, " ".join(key)])
+
+    if not bulk:
+        return
+    # Several desired entries can resolve to the same Architecture: all
+    # package, which might also already be in the suite.
+    session.execute("""
+        INSERT INTO {0} (suite, {1})
+        SELECT DISTINCT :suite_id, pkid
+          FROM UNNEST(CAST(:ids AS INTEGER[])) AS pkid
+         WHERE NOT EXISTS (SELECT 1 FROM {0} x WHERE x.suite = :suite_id AND x.{1} = pkid)
+        """.format(table, column),
+        {'suite_id': suite.suite_id, 'ids': [packages[key][0] for key in bulk]})
+    for key in bulk:
+        Logger.log(["added", suite.suite_name, " ".join(key)])
+
+#######################################################################################
+
 def set_suite(file, suite, transaction, britney=False, force=False):
     session = transaction.session
     suite_id = suite.suite_id
+    archive_id = suite.archive.archive_id
     lines = file.readlines()
 
     # Our session is already in a transaction
@@ -236,32 +342,78 @@ def set_suite(file, suite, transaction, britney=False, force=False):
             continue
         desired.add(tuple(split_line))
 
-    # Check to see which packages need added and add them
-    for key in sorted(desired, cmp=cmp_package_version):
-        if key not in current:
-            (package, version, architecture) = key
-            version_checks(package, architecture, suite.suite_name, version, session, force)
-            pkg = get_pkg(package, version, architecture, session)
-            if pkg is None:
-                continue
-
-            component = pkg.poolfile.component
-            if architecture == "source":
-                transaction.copy_source(pkg, suite, component)
-            else:
-                transaction.copy_binary(pkg, suite, component)
+    # The packages to add are looked up and checked with a few queries on
+    # a temporary table instead of several queries for each of them.
+    added = [key for key in desired if key not in current]
+    session.execute("""
+        CREATE TEMPORARY TABLE control_suite_add (
+          package TEXT NOT NULL,
+          version DEBVERSION NOT NULL,
+          architecture TEXT NOT NULL
+        ) ON COMMIT DROP""")
+    if added:
+        packages, versions, architectures = zip(*added)
+        session.execute("""
+            INSERT INTO control_suite_add (package, version, architecture)
+            SELECT package, CAST(version AS DEBVERSION), architecture
+              FROM UNNEST(CAST(:packages AS TEXT[]), CAST(:versions AS TEXT[]), CAST(:architectures AS TEXT[]))
+                AS t(package, version, architecture)""",
+            {'packages': list(packages), 'versions': list(versions), 'architectures': list(architectures)})
+    session.execute("ANALYZE control_suite_add")
+
+    version_checks_bulk(suite, session, force)
 
-            Logger.log(["added", suite.suite_name, " ".join(key)])
+    # Check to see which packages need added and add them
+    q = session.execute("""
+        SELECT d.package, d.version, d.architecture, s.id,
+               NOT EXISTS (SELECT 1 FROM dsc_files df
+                            WHERE df.source = s.id
+                              AND NOT EXISTS (SELECT 1 FROM files_archive_map af
+                                               WHERE af.file_id = df.file AND af.archive_id = :archive_id))
+          FROM control_suite_add d
+          JOIN source s ON s.source = d.package AND s.version = d.version
+         WHERE d.architecture = 'source'""", {'archive_id': archive_id})
+    sources = dict((tuple(row[:3]), tuple(row[3:])) for row in q)
+    add_to_suite(transaction, suite, sources, 'src_associations', 'source')
+
+    # Binaries are looked up after the sources were added: they need their
+    # source in the target archive.
+    q = session.execute("""
+        SELECT DISTINCT ON (d.package, d.version, d.architecture)
+               d.package, d.version, d.architecture, b.id,
+               EXISTS (SELECT 1 FROM files_archive_map af
+                        WHERE af.file_id = b.file AND af.archive_id = :archive_id)
+               AND EXISTS (SELECT 1 FROM source s
+                             JOIN files_archive_map af ON af.file_id = s.file
+                            WHERE s.id = b.source AND af.archive_id = :archive_id)
+               AND NOT EXISTS (SELECT 1 FROM extra_src_references esr
+                                 JOIN source s ON esr.src_id = s.id
+                                WHERE esr.bin_id = b.id
+                                  AND NOT EXISTS (SELECT 1 FROM files_archive_map af
+                                                   WHERE af.file_id = s.file AND af.archive_id = :archive_id))
+          FROM control_suite_add d
+          JOIN binaries b ON b.package = d.package AND b.version = d.version
+          JOIN architecture a ON b.architecture = a.id AND a.arch_string IN (d.architecture, 'all')
+         WHERE d.architecture <> 'source'
+         ORDER BY d.package, d.version, d.architecture, a.arch_string = 'all'""", {'archive_id': archive_id})
+    binaries = dict((tuple(row[:3]), tuple(row[3:])) for row in q)
+
+    for key in sorted(added, cmp=cmp_package_version):
+        if key not in sources and key not in binaries:
+            utils.warn("Could not find {0}_{1}_{2}.".format(*key))
+
+    add_to_suite(transaction, suite, binaries, 'bin_associations', 'bin')
 
     # Check to see which packages need removed and remove them
-    for key, pkid in current.iteritems():
-        if key not in desired:
-            (package, version, architecture) = key
-            if architecture == "source":
-                session.execute("""DELETE FROM src_associations WHERE id = :pkid""", {'pkid': pkid})
-            else:
-                session.execute("""DELETE FROM bin_associations WHERE id = :pkid""", {'pkid': pkid})
-            Logger.log(["removed", suite.suite_name, " ".join(key), pkid])
+    removed = [(key, pkid) for key, pkid in current.iteritems() if key not in desired]
+    src_ids = [pkid for key, pkid in removed if key[2] == "source"]
+    if src_ids:
+        session.execute("DELETE FROM src_associations WHERE id = ANY(:ids)", {'ids': src_ids})
+    bin_ids = [pkid for key, pkid in removed if key[2] != "source"]
+    if bin_ids:
+        session.execute("DELETE FROM bin_associations WHERE id = ANY(:ids)", {'ids': bin_ids})
+    for key, pkid in removed:
+        Logger.log(["removed", suite.suite_name, " ".join(key), pkid])
 
     session.commit()
 
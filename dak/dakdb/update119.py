@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding=utf8
+
+"""
+Add file_hash_cache table to remember sizes and hashes of index files
+
+@contact: Debian FTP Master <ftpmaster@debian.org>
+@copyright: 2026, Debian FTP Master <ftpmaster@debian.org>
+@license: GNU General Public License version 2 or later
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+################################################################################
+
+import psycopg2
+from daklib.dak_exceptions import DBUpdateError
+from daklib.config import Config
+
+statements = [
+"""
+CREATE TABLE file_hash_cache (
+  path TEXT PRIMARY KEY,
+  stat_path TEXT NOT NULL,
+  inode BIGINT NOT NULL,
+  stat_size BIGINT NOT NULL,
+  mtime BIGINT NOT NULL,
+  size BIGINT NOT NULL,
+  md5sum TEXT NOT NULL,
+  sha1 TEXT NOT NULL,
+  sha256 TEXT NOT NULL
+)
+""",
+"""
+COMMENT ON TABLE file_hash_cache
+  IS 'Size and hashes of index files, valid while inode, size and mtime of stat_path are unchanged'
+""",
+"""
+COMMENT ON COLUMN file_hash_cache.mtime
+  IS 'modification time of stat_path in microseconds since the epoch'
+""",
+]
+
+################################################################################
+def do_update(self):
+    print __doc__
+    try:
+        cnf = Config()
+
+        c = self.db.cursor()
+
+        for stmt in statements:
+            c.execute(stmt)
+
+        c.execute("UPDATE config SET value = '119' WHERE name = 'db_revision'")
+        self.db.commit()
+
+    except psycopg2.ProgrammingError as msg:
+        self.db.rollback()
+        raise DBUpdateError('Unable to apply sick update 119, rollback issued. Error message: {0}'.format(msg))
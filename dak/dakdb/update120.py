@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# coding=utf8
+
+"""
+Add binary_stanza_cache table to keep rendered Packages metadata
+
+@contact: Debian FTP Master <ftpmaster@debian.org>
+@copyright: 2026, Debian FTP Master <ftpmaster@debian.org>
+@license: GNU General Public License version 2 or later
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+################################################################################
+
+import psycopg2
+from daklib.dak_exceptions import DBUpdateError
+from daklib.config import Config
+
+statements = [
+"""
+CREATE TABLE binary_stanza_cache (
+  bin_id INTEGER NOT NULL REFERENCES binaries(id) ON DELETE CASCADE,
+  include_long_description BOOLEAN NOT NULL,
+  metadata TEXT,
+  fallback_section TEXT,
+  fallback_priority TEXT,
+  PRIMARY KEY (bin_id, include_long_description)
+)
+""",
+"""
+COMMENT ON TABLE binary_stanza_cache
+  IS 'Rendered binaries_metadata part of Packages stanzas, removed when the metadata changes'
+""",
+"""
+CREATE OR REPLACE FUNCTION trigger_binaries_metadata_invalidate_stanza() RETURNS TRIGGER
+SET search_path = public, pg_temp
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    DELETE FROM binary_stanza_cache WHERE bin_id = OLD.bin_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    DELETE FROM binary_stanza_cache WHERE bin_id = NEW.bin_id;
+  END IF;
+  RETURN NULL;
+END;
+$$
+""",
+"""
+CREATE TRIGGER binaries_metadata_invalidate_stanza
+  AFTER INSERT OR UPDATE OR DELETE
+  ON binaries_metadata
+  FOR EACH ROW
+  EXECUTE PROCEDURE trigger_binaries_metadata_invalidate_stanza()
+""",
+"""
+CREATE OR REPLACE FUNCTION trigger_metadata_keys_invalidate_stanza() RETURNS TRIGGER
+SET search_path = public, pg_temp
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  DELETE FROM binary_stanza_cache;
+  RETURN NULL;
+END;
+$$
+""",
+"""
+CREATE TRIGGER metadata_keys_invalidate_stanza
+  AFTER UPDATE OR DELETE
+  ON metadata_keys
+  FOR EACH STATEMENT
+  EXECUTE PROCEDURE trigger_metadata_keys_invalidate_stanza()
+""",
+]
+
+################################################################################
+def do_update(self):
+    print __doc__
+    try:
+        cnf = Config()
+
+        c = self.db.cursor()
+
+        for stmt in statements:
+            c.execute(stmt)
+
+        c.execute("UPDATE config SET value = '120' WHERE name = 'db_revision'")
+        self.db.commit()
+
+    except psycopg2.ProgrammingError as msg:
+        self.db.rollback()
+        raise DBUpdateError('Unable to apply sick update 120, rollback issued. Error message: {0}'.format(msg))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# coding=utf8
+
+"""
+Add pool_file_state and pool_directory_state tables for incremental pool checks
+
+@contact: Debian FTP Master <ftpmaster@debian.org>
+@copyright: 2026, Debian FTP Master <ftpmaster@debian.org>
+@license: GNU General Public License version 2 or later
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+################################################################################
+
+import psycopg2
+from daklib.dak_exceptions import DBUpdateError
+from daklib.config import Config
+
+statements = [
+"""
+CREATE TABLE pool_file_state (
+  file_id INTEGER PRIMARY KEY REFERENCES files(id) ON DELETE CASCADE,
+  path TEXT NOT NULL,
+  size BIGINT NOT NULL,
+  mtime BIGINT NOT NULL,
+  inode BIGINT NOT NULL,
+  last_verified TIMESTAMP WITH TIME ZONE NOT NULL
+)
+""",
+"""
+COMMENT ON TABLE pool_file_state
+  IS 'stat information of pool files at the time their checksums were last verified'
+""",
+"""
+COMMENT ON COLUMN pool_file_state.mtime
+  IS 'modification time in microseconds since the epoch'
+""",
+"""
+CREATE TABLE pool_directory_state (
+  path TEXT PRIMARY KEY,
+  mtime BIGINT NOT NULL,
+  inode BIGINT NOT NULL,
+  files TEXT[] NOT NULL,
+  directories TEXT[] NOT NULL
+)
+""",
+"""
+COMMENT ON TABLE pool_directory_state
+  IS 'listings of pool directories, valid as long as mtime and inode are unchanged'
+""",
+"""
+COMMENT ON COLUMN pool_directory_state.mtime
+  IS 'modification time in microseconds since the epoch'
+""",
+]
+
+################################################################################
+def do_update(self):
+    print __doc__
+    try:
+        cnf = Config()
+
+        c = self.db.cursor()
+
+        for stmt in statements:
+            c.execute(stmt)
+
+        c.execute("UPDATE config SET value = '121' WHERE name = 'db_revision'")
+        self.db.commit()
+
+    except psycopg2.ProgrammingError as msg:
+        self.db.rollback()
+        raise DBUpdateError('Unable to apply sick update 121, rollback issued. Error message: {0}'.format(msg))
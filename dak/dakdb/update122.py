@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# coding=utf8
+
+"""
+Add dominate_queue table to track suites and packages with changed associations
+
+@contact: Debian FTP Master <ftpmaster@debian.org>
+@copyright: 2026, Debian FTP Master <ftpmaster@debian.org>
+@license: GNU General Public License version 2 or later
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+################################################################################
+
+import psycopg2
+from daklib.dak_exceptions import DBUpdateError
+from daklib.config import Config
+
+statements = [
+"""
+CREATE TABLE dominate_queue (
+  suite_id INTEGER NOT NULL REFERENCES suite(id) ON DELETE CASCADE,
+  source TEXT NOT NULL,
+  package TEXT
+)
+""",
+"""
+COMMENT ON TABLE dominate_queue
+  IS 'source and binary package names whose associations changed since the last run of dak dominate'
+""",
+"""
+CREATE INDEX dominate_queue_suite_id ON dominate_queue (suite_id)
+""",
+"""
+CREATE OR REPLACE FUNCTION trigger_src_associations_dominate_queue() RETURNS TRIGGER
+SET search_path = public, pg_temp
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    INSERT INTO dominate_queue (suite_id, source)
+      SELECT OLD.suite, s.source FROM source s WHERE s.id = OLD.source;
+  ELSE
+    INSERT INTO dominate_queue (suite_id, source)
+      SELECT NEW.suite, s.source FROM source s WHERE s.id = NEW.source;
+  END IF;
+  RETURN NULL;
+END;
+$$
+""",
+"""
+CREATE TRIGGER src_associations_dominate_queue
+  AFTER INSERT OR DELETE
+  ON src_associations
+  FOR EACH ROW
+  EXECUTE PROCEDURE trigger_src_associations_dominate_queue()
+""",
+"""
+CREATE OR REPLACE FUNCTION trigger_bin_associations_dominate_queue() RETURNS TRIGGER
+SET search_path = public, pg_temp
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    INSERT INTO dominate_queue (suite_id, source, package)
+      SELECT OLD.suite, s.source, b.package
+        FROM binaries b JOIN source s ON s.id = b.source
+       WHERE b.id = OLD.bin;
+  ELSE
+    INSERT INTO dominate_queue (suite_id, source, package)
+      SELECT NEW.suite, s.source, b.package
+        FROM binaries b JOIN source s ON s.id = b.source
+       WHERE b.id = NEW.bin;
+  END IF;
+  RETURN NULL;
+END;
+$$
+""",
+"""
+CREATE TRIGGER bin_associations_dominate_queue
+  AFTER INSERT OR DELETE
+  ON bin_associations
+  FOR EACH ROW
+  EXECUTE PROCEDURE trigger_bin_associations_dominate_queue()
+""",
+]
+
+################################################################################
+def do_update(self):
+    print __doc__
+    try:
+        cnf = Config()
+
+        c = self.db.cursor()
+
+        for stmt in statements:
+            c.execute(stmt)
+
+        c.execute("UPDATE config SET value = '122' WHERE name = 'db_revision'")
+        self.db.commit()
+
+    except psycopg2.ProgrammingError as msg:
+        self.db.rollback()
+        raise DBUpdateError('Unable to apply sick update 122, rollback issued. Error message: {0}'.format(msg))
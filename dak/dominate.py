@@ -25,7 +25,7 @@ Remove obsolete source and binary associations from suites.
 from daklib.dbconn import *
 from daklib.config import Config
 from daklib import daklog, utils
-import apt_pkg, sys
+import apt_pkg, json, sys
 
 from sqlalchemy.sql import exists, text
 from tabulate import tabulate
@@ -35,7 +35,19 @@ Options = None
 Logger = None
 
 
-def retrieve_associations(suites, session):
+def retrieve_associations(suites, session, sources=None, packages=None):
+    '''
+    Find the dominated associations in suites.
+
+    If sources and packages are given, only source packages with these
+    names and binary packages with these names are considered.  The caller
+    must make sure that this set is closed, see affected_packages().
+    '''
+    source_filter = ''
+    binary_filter = ''
+    if sources is not None:
+        source_filter = 'AND source.source = ANY(:sources)'
+        binary_filter = 'AND binaries.package = ANY(:packages)'
     return session.execute(text('''
 WITH
   -- Provide (source, suite) tuple of all source packages to remain
@@ -57,6 +69,7 @@ WITH
             INNER JOIN src_associations ON
               src_associations.source = source.id
               AND src_associations.suite = ANY(:suite_ids)
+              {source_filter}
         ) AS source_ranked
       WHERE
         version_rank = 1
@@ -97,6 +110,7 @@ WITH
             INNER JOIN bin_associations ON
               bin_associations.bin = binaries.id
               AND bin_associations.suite = ANY(:suite_ids)
+              {binary_filter}
             INNER JOIN architecture ON architecture.id = binaries.architecture
         ) AS source_rank
       WHERE
@@ -123,6 +137,7 @@ WITH
         INNER JOIN src_associations ON
           src_associations.source = source.id
           AND src_associations.suite = ANY(:suite_ids)
+          {source_filter}
         INNER join suite ON suite.id = src_associations.suite
         LEFT JOIN remain_binaries ON
           remain_binaries.source_id = source.id
@@ -150,6 +165,7 @@ WITH
         INNER JOIN bin_associations ON
           bin_associations.bin = binaries.id
           AND bin_associations.suite = ANY(:suite_ids)
+          {binary_filter}
         INNER JOIN architecture ON architecture.id = binaries.architecture
         INNER join suite ON suite.id = bin_associations.suite
         LEFT JOIN remain_binaries ON
@@ -177,6 +193,7 @@ WITH
         INNER JOIN bin_associations ON
           bin_associations.bin = binaries.id
           AND bin_associations.suite = ANY(:suite_ids)
+          {binary_filter}
         INNER JOIN architecture ON architecture.id = binaries.architecture
         INNER join suite ON suite.id = bin_associations.suite
         LEFT JOIN remain_binaries ON
@@ -206,21 +223,80 @@ SELECT
     dominate_binaries_all
   ORDER BY
     source_package, source_version, package, version, arch, suite
-''').params(
+'''.format(source_filter=source_filter, binary_filter=binary_filter)).params(
     suite_ids = [s.suite_id for s in suites],
+    sources = list(sources or ()),
+    packages = list(packages or ()),
 ))
 
 
-def delete_associations_table(table, ids, session):
+def take_queue(suites, session):
+    '''
+    Remove the entries for suites from the dominate queue.
+
+    Returns the names of the source and binary packages whose associations
+    changed since the last run.
+    '''
+    sources = set()
+    packages = set()
     result = session.execute(text('''
-        DELETE
-            FROM {}
-            WHERE id = ANY(:assoc_ids)
-    '''.format(table)).params(
-        assoc_ids = list(ids),
+        DELETE FROM dominate_queue
+            WHERE suite_id = ANY(:suite_ids)
+            RETURNING source, package
+    ''').params(
+        suite_ids = [s.suite_id for s in suites],
     ))
-
-    assert result.rowcount == len(ids), 'Rows deleted are not equal to deletion requests'
+    for source, package in result:
+        sources.add(source)
+        if package is not None:
+            packages.add(package)
+    return sources, packages
+
+
+def affected_packages(suites, sources, packages, session):
+    '''
+    Extend the given source and binary package names to a closed set: all
+    binary packages built by the sources and all sources building one of
+    the binary packages are included.
+    '''
+    sources = set(sources)
+    packages = set(packages)
+    while True:
+        result = session.execute(text('''
+            SELECT DISTINCT source.source, binaries.package
+                FROM binaries
+                INNER JOIN source ON source.id = binaries.source
+                INNER JOIN bin_associations ON
+                  bin_associations.bin = binaries.id
+                  AND bin_associations.suite = ANY(:suite_ids)
+                WHERE source.source = ANY(:sources)
+                  OR binaries.package = ANY(:packages)
+        ''').params(
+            suite_ids = [s.suite_id for s in suites],
+            sources = list(sources),
+            packages = list(packages),
+        ))
+        size = len(sources) + len(packages)
+        for source, package in result:
+            sources.add(source)
+            packages.add(package)
+        if len(sources) + len(packages) == size:
+            return sources, packages
+
+
+def delete_associations_table(table, ids, session, batch_size=1000):
+    ids = sorted(ids)
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        result = session.execute(text('''
+            DELETE
+                FROM {}
+                WHERE id = ANY(:assoc_ids)
+        '''.format(table)).params(
+            assoc_ids = batch,
+        ))
+
+        assert result.rowcount == len(batch), 'Rows deleted are not equal to deletion requests'
 
 
 def delete_associations(assocs, session):
@@ -247,9 +323,17 @@ Remove obsolete source and binary associations from suites.
     -h, --help                 show this help and exit
     -n, --no-action            don't commit changes
     -f, --force                also clean up untouchable suites
+    -i, --incremental          only consider packages whose associations
+                               changed since the last run
+    -p, --plan=FILE            write the associations to remove to FILE
+                               as JSON
 
 SUITE can be comma (or space) separated list, e.g.
-    --suite=testing,unstable"""
+    --suite=testing,unstable
+
+With --incremental, changes made to untouchable suites are not taken into
+account by later runs with --force; use a run without --incremental for
+those."""
     sys.exit()
 
 def main():
@@ -258,10 +342,13 @@ def main():
     Arguments = [('h', "help",      "Obsolete::Options::Help"),
                  ('s', "suite",     "Obsolete::Options::Suite", "HasArg"),
                  ('n', "no-action", "Obsolete::Options::No-Action"),
-                 ('f', "force",     "Obsolete::Options::Force")]
+                 ('f', "force",     "Obsolete::Options::Force"),
+                 ('i', "incremental", "Obsolete::Options::Incremental"),
+                 ('p', "plan",      "Obsolete::Options::Plan", "HasArg")]
     cnf['Obsolete::Options::Help'] = ''
     cnf['Obsolete::Options::No-Action'] = ''
     cnf['Obsolete::Options::Force'] = ''
+    cnf['Obsolete::Options::Incremental'] = ''
     apt_pkg.parse_commandline(cnf.Cnf, Arguments, sys.argv)
     Options = cnf.subtree("Obsolete::Options")
     if Options['Help']:
@@ -281,7 +368,27 @@ def main():
         suites_query = suites_query.filter_by(untouchable = False)
     suites = suites_query.all()
 
-    assocs = list(retrieve_associations(suites, session))
+    sources, packages = take_queue(suites, session)
+    if 'Suite' not in Options:
+        # changes to suites we never act on would pile up otherwise
+        session.execute(text('''
+            DELETE FROM dominate_queue WHERE suite_id <> ALL(:suite_ids)
+        ''').params(
+            suite_ids = [s.suite_id for s in suites],
+        ))
+
+    if not Options['Incremental']:
+        assocs = list(retrieve_associations(suites, session))
+    elif sources:
+        sources, packages = affected_packages(suites, sources, packages, session)
+        assocs = list(retrieve_associations(suites, session, sources, packages))
+    else:
+        assocs = []
+
+    if 'Plan' in Options:
+        keys = ('source_package', 'source_version', 'package', 'version', 'arch', 'suite', 'assoc_id')
+        with open(Options['Plan'], 'w') as fh:
+            json.dump([dict(zip(keys, e)) for e in assocs], fh, indent=2, sort_keys=True)
 
     if Options['No-Action']:
         headers = ('source package', 'source version', 'package', 'version', 'arch', 'suite', 'id')
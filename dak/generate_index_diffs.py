@@ -33,12 +33,12 @@
 
 import sys
 import os
-import tempfile
 import time
 import apt_pkg
 import glob
 
-from daklib import utils
+from daklib import pdiff, utils
+from daklib.dakmultiprocessing import DakProcessPool, PROC_STATUS_SUCCESS, PROC_STATUS_SIGNALRAISED
 from daklib.dbconn import Archive, Component, DBConn, Suite, get_suite, get_suite_architectures
 #from daklib.regexes import re_includeinpdiff
 import re
@@ -62,6 +62,10 @@ Write out ed-style diffs to Packages/Source lists
   -p                    name for the patch (defaults to current time)
   -d                    name for the hardlink farm for status
   -m                    how many diffs to generate
+  -M, --merged-pdiffs   also generate patches from each history entry
+                        to the current file
+  -j, --jobs=N          generate up to N patches in parallel
+                        (default: number of CPUs)
   -n                    take no action
   -v                    be verbose and list each file as we work on it
     """
@@ -79,48 +83,24 @@ def smartstat(file):
             return (ext, os.stat(file + ext))
     return (None, None)
 
-def smartlink(f, t):
-    if os.path.isfile(f):
-        os.link(f,t)
-    elif os.path.isfile("%s.gz" % (f)):
-        os.system("gzip -d < %s.gz > %s" % (f, t))
-    elif os.path.isfile("%s.bz2" % (f)):
-        os.system("bzip2 -d < %s.bz2 > %s" % (f, t))
-    elif os.path.isfile("%s.xz" % (f)):
-        os.system("xz -d < %s.xz > %s" % (f, t))
-    else:
-        print "missing: %s" % (f)
-        raise IOError(f)
-
-def smartopen(file):
-    if os.path.isfile(file):
-        f = open(file, "r")
-    elif os.path.isfile("%s.gz" % file):
-        f = create_temp_file(os.popen("zcat %s.gz" % file, "r"))
-    elif os.path.isfile("%s.bz2" % file):
-        f = create_temp_file(os.popen("bzcat %s.bz2" % file, "r"))
-    elif os.path.isfile("%s.xz" % file):
-        f = create_temp_file(os.popen("xzcat %s.xz" % file, "r"))
-    else:
-        f = None
-    return f
-
-def pipe_file(f, t):
-    f.seek(0)
-    while 1:
-        l = f.read(65536)
-        if not l: break
-        t.write(l)
-    t.close()
+re_merged_patch = re.compile(r"^T-(.+)-F-(.+)$")
+
+def merged_name(target, source):
+    return "T-%s-F-%s" % (target, source)
 
 class Updates:
-    def __init__(self, readpath = None, max = 56):
+    def __init__(self, readpath = None, max = 56, merged_pdiffs = False):
         self.can_path = None
         self.history = {}
         self.history_order = []
         self.max = max
         self.readpath = readpath
         self.filesizehashes = None
+        self.merged_pdiffs = merged_pdiffs
+        # merged patches from each history entry to merged_target:
+        # source => [patch hashes, download hashes]
+        self.merged = {}
+        self.merged_target = None
 
         if readpath:
             try:
@@ -135,6 +115,18 @@ class Updates:
                         fname = l[2]
                         if fname.endswith('.gz'):
                             fname = fname[:-3]
+                        m = re_merged_patch.match(fname)
+                        if m:
+                            # merged history entries repeat the unmerged ones
+                            if ind > 0:
+                                self.merged_target = m.group(1)
+                                entry = self.merged.setdefault(m.group(2), [None, None])
+                                old = entry[ind-1] or (int(l[1]), None, None)
+                                if hashind == 1:
+                                    entry[ind-1] = (old[0], l[0], old[2])
+                                else:
+                                    entry[ind-1] = (old[0], old[1], l[0])
+                            continue
                         if fname not in self.history:
                             self.history[fname] = [None,None,None]
                             self.history_order.append(fname)
@@ -153,6 +145,11 @@ class Updates:
                         x = f.readline()
                         continue
 
+                    # with merged patches, the individual ones are listed
+                    # in X-Unmerged-* fields
+                    if l[0].startswith("X-Unmerged-"):
+                        l[0] = l[0][len("X-Unmerged-"):]
+
                     if l[0] == "SHA1-History:":
                         x = read_hashs(0,1,f,self)
                         continue
@@ -213,53 +210,100 @@ class Updates:
             for h in l[:cnt-self.max]:
                 tryunlink("%s/%s.gz" % (self.readpath, h))
                 del hs[h]
+                if h in self.merged:
+                    tryunlink("%s/%s.gz" % (self.readpath, merged_name(self.merged_target, h)))
+                    del self.merged[h]
             l = l[cnt-self.max:]
             self.history_order = l[:]
 
-        out.write("SHA1-History:\n")
-        for h in l:
-            if hs[h][0] and hs[h][0][1]:
-                out.write(" %s %7d %s\n" % (hs[h][0][1], hs[h][0][0], h))
-        out.write("SHA256-History:\n")
-        for h in l:
-            if hs[h][0] and hs[h][0][2]:
-                out.write(" %s %7d %s\n" % (hs[h][0][2], hs[h][0][0], h))
-        out.write("SHA1-Patches:\n")
-        for h in l:
-            if hs[h][1] and hs[h][1][1]:
-                out.write(" %s %7d %s\n" % (hs[h][1][1], hs[h][1][0], h))
-        out.write("SHA256-Patches:\n")
-        for h in l:
-            if hs[h][1] and hs[h][1][2]:
-                out.write(" %s %7d %s\n" % (hs[h][1][2], hs[h][1][0], h))
-        out.write("SHA1-Download:\n")
-        for h in l:
-            if hs[h][2] and hs[h][2][1]:
-                out.write(" %s %7d %s.gz\n" % (hs[h][2][1], hs[h][2][0], h))
-        out.write("SHA256-Download:\n")
-        for h in l:
-            if hs[h][2] and hs[h][2][2]:
-                out.write(" %s %7d %s.gz\n" % (hs[h][2][2], hs[h][2][0], h))
-
-def create_temp_file(r):
-    f = tempfile.TemporaryFile()
-    while 1:
-        x = r.read(65536)
-        if not x: break
-        f.write(x)
-    r.close()
-    del x,r
-    f.flush()
-    f.seek(0)
-    return f
-
-def sizehashes(f):
-    size = os.fstat(f.fileno())[6]
-    f.seek(0)
-    sha1sum = apt_pkg.sha1sum(f)
-    f.seek(0)
-    sha256sum = apt_pkg.sha256sum(f)
-    return (size, sha1sum, sha256sum)
+        # Clients that understand X-Patch-Precedence only download the
+        # patch for the version they have, which leads directly to the
+        # current file.  The individual patches stay available for
+        # everybody else.
+        merged = self.merged_pdiffs and l and all(h in self.merged for h in l)
+        if merged:
+            out.write("X-Patch-Precedence: merged\n")
+            self.dump_entries(out, l, "",
+                lambda h: (hs[h][0], self.merged[h][0], self.merged[h][1]),
+                lambda h: merged_name(self.merged_target, h))
+            prefix = "X-Unmerged-"
+        else:
+            prefix = ""
+        self.dump_entries(out, l, prefix, lambda h: hs[h], lambda h: h)
+
+    def dump_entries(self, out, l, prefix, entry, name):
+        for (field, ind, ext) in (("History", 0, ""), ("Patches", 1, ""), ("Download", 2, ".gz")):
+            for (hashname, hashind) in (("SHA1", 1), ("SHA256", 2)):
+                out.write("%s%s-%s:\n" % (prefix, hashname, field))
+                for h in l:
+                    e = entry(h)[ind]
+                    if e and e[hashind]:
+                        out.write(" %s %7d %s%s\n" % (e[hashind], e[0], name(h), ext))
+
+    def _chain_hunks(self, source, target):
+        # combine the individual patches from source up to target
+        order = self.history_order
+        hunks = []
+        for h in order[order.index(source):order.index(target) + 1]:
+            script = pdiff.read_patch("%s/%s.gz" % (self.readpath, h))
+            hunks = pdiff.compose_hunks(hunks, pdiff.parse_ed_script(script))
+        return hunks
+
+    def remove_merged(self):
+        for filename in glob.glob("%s/%s.gz" % (self.readpath, merged_name("*", "*"))):
+            tryunlink(filename)
+        self.merged = {}
+        self.merged_target = None
+
+    def update_merged(self, patchname, script):
+        """
+        Derive the merged patches leading to the new patch's target.
+
+        Each merged patch is computed from the previous merged patch for
+        the same history entry and the new patch, so the older files are
+        not needed.  If there is no previous merged patch (for example
+        when merged patches were just enabled), the individual patches
+        are combined instead.
+
+        @type patchname: string
+        @param patchname: name of the new patch, already in the history
+
+        @type script: string
+        @param script: ed script of the new patch
+        """
+        previous = self.merged_target
+        order = self.history_order
+        if len(order) > self.max:
+            order = order[len(order)-self.max:]
+        hunks = pdiff.parse_ed_script(script)
+        merged = {}
+        for h in order:
+            filename = "%s/%s.gz" % (self.readpath, merged_name(patchname, h))
+            if os.path.lexists(filename):
+                os.unlink(filename)
+            if h == patchname:
+                os.link("%s/%s.gz" % (self.readpath, patchname), filename)
+                merged[h] = self.history[h][1:]
+                continue
+            previous_file = "%s/%s.gz" % (self.readpath, merged_name(previous, h))
+            if previous == order[-2] and h in self.merged and os.path.isfile(previous_file):
+                base = pdiff.parse_ed_script(pdiff.read_patch(previous_file))
+            else:
+                base = self._chain_hunks(h, order[-2])
+            (difhashes, difgzhashes) = pdiff.write_patch(
+                pdiff.format_ed_script(pdiff.compose_hunks(base, hunks)), filename)
+            merged[h] = [sizehashes(difhashes), sizehashes(difgzhashes)]
+
+        if previous and previous != patchname:
+            for h in self.merged:
+                filename = "%s/%s.gz" % (self.readpath, merged_name(previous, h))
+                if os.path.lexists(filename):
+                    tryunlink(filename)
+        self.merged = merged
+        self.merged_target = patchname
+
+def sizehashes(hashes):
+    return (hashes['size'], hashes['sha1'], hashes['sha256'])
 
 def genchanges(Options, outdir, oldfile, origfile, maxdiffs = 56):
     if "NoAct" in Options:
@@ -270,16 +314,14 @@ def genchanges(Options, outdir, oldfile, origfile, maxdiffs = 56):
 
     # origfile = /path/to/Packages
     # oldfile  = ./Packages
-    # newfile  = ./Packages.tmp
     # difffile = outdir/patchname
     # index   => outdir/Index
 
     # (outdir, oldfile, origfile) = argv
 
-    newfile = oldfile + ".new"
     difffile = "%s/%s" % (outdir, patchname)
 
-    upd = Updates(outdir, int(maxdiffs))
+    upd = Updates(outdir, int(maxdiffs), "MergedPdiffs" in Options)
     (oldext, oldstat) = smartstat(oldfile)
     (origext, origstat) = smartstat(origfile)
     if not origstat:
@@ -294,8 +336,10 @@ def genchanges(Options, outdir, oldfile, origfile, maxdiffs = 56):
         #print "%s: hardlink unbroken, assuming unchanged" % (origfile)
         return
 
-    oldf = smartopen(oldfile)
-    oldsizehashes = sizehashes(oldf)
+    # Contents files are line based, everything else consists of stanzas
+    by_stanza = not os.path.basename(origfile).startswith("Contents-")
+    oldunits = pdiff.IndexUnits(oldfile + oldext, by_stanza)
+    oldsizehashes = sizehashes(oldunits.hashes)
 
     # should probably early exit if either of these checks fail
     # alternatively (optionally?) could just trim the patch history
@@ -306,46 +350,64 @@ def genchanges(Options, outdir, oldfile, origfile, maxdiffs = 56):
 
     if "CanonicalPath" in Options: upd.can_path=Options["CanonicalPath"]
 
-    if os.path.exists(newfile): os.unlink(newfile)
-    smartlink(origfile, newfile)
-    newf = open(newfile, "r")
-    newsizehashes = sizehashes(newf)
-    newf.close()
+    newunits = pdiff.IndexUnits(origfile + origext, by_stanza)
+    newsizehashes = sizehashes(newunits.hashes)
 
     if newsizehashes == oldsizehashes:
-        os.unlink(newfile)
-        oldf.close()
         #print "%s: unchanged" % (origfile)
-    else:
-        if not os.path.isdir(outdir):
-            os.mkdir(outdir)
-
-        w = os.popen("diff --ed - %s | gzip --rsyncable  --no-name -c -9 > %s.gz" %
-                     (newfile, difffile), "w")
-        pipe_file(oldf, w)
-        oldf.close()
-
-        difff = smartopen(difffile)
-        difsizehashes = sizehashes(difff)
-        difff.close()
-
-        difffgz = open(difffile + ".gz", "r")
-        difgzsizehashes = sizehashes(difffgz)
-        difffgz.close()
-
-        upd.history[patchname] = (oldsizehashes, difsizehashes, difgzsizehashes)
-        upd.history_order.append(patchname)
-
-        upd.filesizehashes = newsizehashes
-
-        os.unlink(oldfile + oldext)
-        os.link(origfile + origext, oldfile + origext)
-        os.unlink(newfile)
+        return
 
-        with open(outdir + "/Index.new", "w") as f:
-            upd.dump(f)
-        os.rename(outdir + "/Index.new", outdir + "/Index")
+    try:
+        script = pdiff.ed_script(oldunits, newunits)
+    except pdiff.PDiffError as e:
+        # Keep the old file so the next run covers these changes as well
+        print "%s: %s, not generating a patch" % (origfile, e)
+        return
 
+    if not os.path.isdir(outdir):
+        os.mkdir(outdir)
+
+    (difhashes, difgzhashes) = pdiff.write_patch(script, difffile + ".gz")
+
+    upd.history[patchname] = (oldsizehashes, sizehashes(difhashes), sizehashes(difgzhashes))
+    upd.history_order.append(patchname)
+
+    upd.filesizehashes = newsizehashes
+
+    if upd.merged_pdiffs:
+        try:
+            upd.update_merged(patchname, script)
+        except (IOError, pdiff.PDiffError) as e:
+            # Fall back to the individual patches; the next run will
+            # try again combining those
+            print "%s: %s, not generating merged patches" % (origfile, e)
+            upd.remove_merged()
+    elif upd.merged:
+        upd.remove_merged()
+
+    os.unlink(oldfile + oldext)
+    os.link(origfile + origext, oldfile + origext)
+
+    with open(outdir + "/Index.new", "w") as f:
+        upd.dump(f)
+    os.rename(outdir + "/Index.new", outdir + "/Index")
+
+def genchanges_helper(options, outdir, oldfile, origfile, maxdiffs):
+    '''
+    This function is called in a new subprocess.
+    '''
+    genchanges(options, outdir, oldfile, origfile, maxdiffs)
+    return (PROC_STATUS_SUCCESS, "generate-index-diffs {0}".format(origfile))
+
+def parse_results(message):
+    # Split out into (code, msg)
+    code, msg = message
+    if code == PROC_STATUS_SIGNALRAISED:
+        print "E: Subprocess received signal %s" % (msg)
+    elif code != PROC_STATUS_SUCCESS:
+        print "E: %s" % (msg)
+    elif "Verbose" in Options:
+        print "I: %s" % (msg)
 
 def main():
     global Cnf, Options, Logger
@@ -359,6 +421,8 @@ def main():
                   ('p', "patchname", "Generate-Index-Diffs::Options::PatchName", "hasArg"),
                   ('d', "tmpdir", "Generate-Index-Diffs::Options::TempDir", "hasArg"),
                   ('m', "maxdiffs", "Generate-Index-Diffs::Options::MaxDiffs", "hasArg"),
+                  ('M', "merged-pdiffs", "Generate-Index-Diffs::Options::MergedPdiffs"),
+                  ('j', "jobs", "Generate-Index-Diffs::Options::Jobs", "hasArg"),
                   ('n', "n-act", "Generate-Index-Diffs::Options::NoAct"),
                   ('v', "verbose", "Generate-Index-Diffs::Options::Verbose"),
                 ]
@@ -375,6 +439,16 @@ def main():
         format = "%Y-%m-%d-%H%M.%S"
         Options["PatchName"] = time.strftime( format )
 
+    # Options are passed to the worker processes and need to be picklable
+    job_options = dict((key, Options[key]) for key in ("NoAct", "PatchName", "CanonicalPath") if key in Options)
+    if Options.find_b("MergedPdiffs"):
+        job_options["MergedPdiffs"] = True
+
+    # Create the pool before connecting to the database so workers do not
+    # share our connection
+    jobs = int(Options["Jobs"]) if "Jobs" in Options else None
+    pool = DakProcessPool(processes=jobs)
+
     session = DBConn().session()
 
     if not suites:
@@ -409,6 +483,7 @@ def main():
 
         # See if there are Translations which might need a new pdiff
         cwd = os.getcwd()
+        translations = set()
         for component in components:
             #print "DEBUG: Working on %s" % (component)
             workpath=os.path.join(tree, component, "i18n")
@@ -421,10 +496,17 @@ def main():
                             continue
                         (fname, fext) = os.path.splitext(entry)
                         processfile=os.path.join(workpath, fname)
+                        # Only one job per file, even if it exists with
+                        # several compressions
+                        if processfile in translations:
+                            continue
+                        translations.add(processfile)
                         #print "Working: %s" % (processfile)
                         storename="%s/%s_%s_%s" % (Options["TempDir"], suite, component, fname)
                         #print "Storefile: %s" % (storename)
-                        genchanges(Options, processfile + ".diff", storename, processfile, maxdiffs)
+                        pool.apply_async(genchanges_helper,
+                            (job_options, processfile + ".diff", storename, processfile, maxdiffs),
+                            callback=parse_results)
         os.chdir(cwd)
 
         for archobj in architectures:
@@ -444,12 +526,23 @@ def main():
                 file = "%s/%s/Contents-%s" % (tree, component, architecture)
                 if "Verbose" in Options: print(file)
                 storename = "%s/%s_%s_contents_%s" % (Options["TempDir"], suite, component, architecture)
-                genchanges(Options, file + ".diff", storename, file, maxcontents)
+                pool.apply_async(genchanges_helper,
+                    (job_options, file + ".diff", storename, file, maxcontents),
+                    callback=parse_results)
 
                 file = "%s/%s/%s/%s" % (tree, component, longarch, packages)
                 if "Verbose" in Options: print(file)
                 storename = "%s/%s_%s_%s" % (Options["TempDir"], suite, component, architecture)
-                genchanges(Options, file + ".diff", storename, file, maxsuite)
+                pool.apply_async(genchanges_helper,
+                    (job_options, file + ".diff", storename, file, maxsuite),
+                    callback=parse_results)
+
+    session.close()
+
+    pool.close()
+    pool.join()
+
+    sys.exit(pool.overall_status())
 
 ################################################################################
 
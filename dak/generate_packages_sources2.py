@@ -28,7 +28,7 @@ Generate Packages/Sources files
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-import apt_pkg, sys
+import apt_pkg, hashlib, os, sys
 
 def usage():
     print """Usage: dak generate-packages-sources2 [OPTIONS]
@@ -39,6 +39,8 @@ Generate the Packages/Sources files
                                Default: All suites not marked 'untouchable'
   -f, --force                  Allow processing of untouchable suites
                                CAREFUL: Only to be used at point release time!
+  -i, --incremental            only regenerate files whose associations or
+                               overrides changed since they were last written
   -h, --help                   show this help and exit
 
 SUITE can be a space separated list, e.g.
@@ -48,6 +50,43 @@ SUITE can be a space separated list, e.g.
 
 #############################################################################
 
+def _index_fingerprint(session, query, params, settings):
+    """Fingerprint the database state an index file is generated from.
+
+    C{query} must return a single text value that changes whenever the
+    set of associations or overrides that end up in the file changes;
+    C{settings} covers suite options that influence the output.
+    """
+    (db_fingerprint,) = session.execute(query, params).fetchone()
+    return "{0}:{1}".format(db_fingerprint, hashlib.md5(repr(settings)).hexdigest())
+
+def _index_path(suite, writer):
+    return os.path.relpath(writer.path, suite.archive.path)
+
+def _index_unchanged(session, suite, writer, fingerprint):
+    """Check if the files of C{writer} were already generated from C{fingerprint}"""
+    for filename in writer.output_files():
+        if not os.path.exists(filename):
+            return False
+    query = "SELECT fingerprint FROM generated_index WHERE suite_id = :suite AND path = :path"
+    row = session.execute(query, {'suite': suite.suite_id, 'path': _index_path(suite, writer)}).fetchone()
+    return row is not None and row[0] == fingerprint
+
+def _record_index(session, suite, writer, fingerprint):
+    """Remember fingerprint and uncompressed hashes of a written index"""
+    from daklib.hashcache import HashCache
+    hashcache = HashCache(session)
+    hashcache.set_from_writer(writer)
+    hashcache.flush()
+
+    params = {'suite': suite.suite_id, 'path': _index_path(suite, writer), 'fingerprint': fingerprint}
+    # TODO [sqlalchemy >= 1.1]: use `ON CONFLICT DO UPDATE`
+    session.execute("DELETE FROM generated_index WHERE suite_id = :suite AND path = :path", params)
+    session.execute("INSERT INTO generated_index (suite_id, path, fingerprint) VALUES (:suite, :path, :fingerprint)", params)
+    session.commit()
+
+#############################################################################
+
 # Here be dragons.
 _sources_query = R"""
 SELECT
@@ -102,7 +141,23 @@ ORDER BY
 s.source, s.version
 """
 
-def generate_sources(suite_id, component_id):
+_sources_fingerprint_query = R"""
+SELECT
+  MD5(COALESCE(STRING_AGG(s.id || ':' || sa.extra_source || ':' || COALESCE(o.section, 0) || ':' || COALESCE(o.priority, 0), ',' ORDER BY s.id), ''))
+FROM
+  source s
+  JOIN src_associations_full sa ON sa.suite = :suite AND s.id = sa.source
+  JOIN files_archive_map fam
+    ON fam.file_id = s.file
+       AND fam.archive_id = (SELECT archive_id FROM suite WHERE id = :suite)
+       AND fam.component_id = :component
+  LEFT JOIN override o ON o.package = s.source
+                       AND o.suite = :overridesuite
+                       AND o.component = :component
+                       AND o.type = :dsc_type
+"""
+
+def generate_sources(suite_id, component_id, incremental=False):
     global _sources_query
     from daklib.filewriter import SourcesFileWriter
     from daklib.dbconn import Component, DBConn, OverrideType, Suite
@@ -124,22 +179,81 @@ def generate_sources(suite_id, component_id):
     if suite.indices_compression is not None:
         writer_args['compression'] = suite.indices_compression
     writer = SourcesFileWriter(**writer_args)
+
+    params = {"suite": suite_id, "component": component_id, "component_name": component.component_name, "dsc_type": dsc_type, "overridesuite": overridesuite_id}
+    fingerprint = _index_fingerprint(session, _sources_fingerprint_query, params,
+                                     (component.component_name, suite.checksums, writer.compression))
+    message = ["generate sources", suite.suite_name, component.component_name]
+    if incremental and _index_unchanged(session, suite, writer, fingerprint):
+        session.rollback()
+        return (PROC_STATUS_SUCCESS, message + ["unchanged"])
+
     output = writer.open()
 
     # run query and write Sources
-    r = session.execute(_sources_query, {"suite": suite_id, "component": component_id, "component_name": component.component_name, "dsc_type": dsc_type, "overridesuite": overridesuite_id})
+    r = session.execute(_sources_query, params)
     for (stanza,) in r:
         print >>output, stanza
         print >>output, ""
 
     writer.close()
+    _record_index(session, suite, writer, fingerprint)
 
-    message = ["generate sources", suite.suite_name, component.component_name]
     session.rollback()
     return (PROC_STATUS_SUCCESS, message)
 
 #############################################################################
 
+# Metadata part of a binary's stanza and the fallbacks for Section and
+# Priority, rendered from binaries_metadata
+_binary_metadata_columns = R"""
+  (SELECT
+     STRING_AGG(key || E'\: ' || value, E'\n' ORDER BY ordering, key)
+   FROM
+     (SELECT key, ordering,
+        CASE WHEN :include_long_description = 'false' AND key = 'Description'
+          THEN SUBSTRING(value FROM E'\\A[^\n]*')
+          ELSE value
+        END AS value
+      FROM
+        binaries_metadata bm
+        JOIN metadata_keys mk ON mk.key_id = bm.key_id
+      WHERE
+        bm.bin_id = {bin_id}
+        AND key != ALL (:metadata_skip)
+     ) AS metadata
+  ) AS metadata,
+  (SELECT value FROM binaries_metadata
+    WHERE bin_id = {bin_id}
+      AND key_id = (SELECT key_id FROM metadata_keys WHERE key = 'Section'))
+   AS fallback_section,
+  (SELECT value FROM binaries_metadata
+    WHERE bin_id = {bin_id}
+      AND key_id = (SELECT key_id FROM metadata_keys WHERE key = 'Priority'))
+   AS fallback_priority
+"""
+
+# Fills binary_stanza_cache for binaries not in it yet.  Entries are
+# removed by triggers when binaries_metadata or metadata_keys change.
+_packages_stanza_cache_query = R"""
+INSERT INTO binary_stanza_cache (bin_id, include_long_description, metadata, fallback_section, fallback_priority)
+SELECT
+  b.id,
+  :include_long_description = 'true',
+""" + _binary_metadata_columns.format(bin_id='b.id') + R"""
+FROM
+  binaries b
+  JOIN bin_associations ba ON b.id = ba.bin
+  JOIN files_archive_map fam ON b.file = fam.file_id AND fam.archive_id = :archive_id
+WHERE
+  (b.architecture = :arch_all OR b.architecture = :arch) AND b.type = :type_name
+  AND ba.suite = :suite
+  AND fam.component_id = :component
+  AND NOT EXISTS (SELECT 1 FROM binary_stanza_cache c
+                  WHERE c.bin_id = b.id
+                    AND c.include_long_description = (:include_long_description = 'true'))
+"""
+
 # Here be large dragons.
 _packages_query = R"""
 WITH
@@ -157,16 +271,14 @@ WITH
       f.md5sum AS md5sum,
       f.sha1sum AS sha1sum,
       f.sha256sum AS sha256sum,
-      (SELECT value FROM binaries_metadata
-        WHERE bin_id = b.id
-          AND key_id = (SELECT key_id FROM metadata_keys WHERE key = 'Priority'))
-       AS fallback_priority,
-      (SELECT value FROM binaries_metadata
-        WHERE bin_id = b.id
-          AND key_id = (SELECT key_id FROM metadata_keys WHERE key = 'Section'))
-       AS fallback_section
+      c.bin_id IS NOT NULL AS cached,
+      c.metadata AS metadata,
+      c.fallback_priority AS fallback_priority,
+      c.fallback_section AS fallback_section
     FROM
       binaries b
+      LEFT JOIN binary_stanza_cache c ON c.bin_id = b.id
+                                     AND c.include_long_description = (:include_long_description = 'true')
       JOIN bin_associations ba ON b.id = ba.bin
       JOIN files f ON f.id = b.file
       JOIN files_archive_map fam ON f.id = fam.file_id AND fam.archive_id = :archive_id
@@ -175,25 +287,25 @@ WITH
       (b.architecture = :arch_all OR b.architecture = :arch) AND b.type = :type_name
       AND ba.suite = :suite
       AND fam.component_id = :component
+  ),
+
+  -- binaries whose cache entry was removed after it was filled
+  uncached AS (
+    SELECT
+      binary_id,
+""" + _binary_metadata_columns.format(bin_id='binary_id') + R"""
+    FROM tmp
+    WHERE NOT cached
+  ),
+
+  rendered AS (
+    SELECT binary_id, metadata, fallback_section, fallback_priority FROM tmp WHERE cached
+    UNION ALL
+    SELECT binary_id, metadata, fallback_section, fallback_priority FROM uncached
   )
 
 SELECT
-  (SELECT
-     STRING_AGG(key || E'\: ' || value, E'\n' ORDER BY ordering, key)
-   FROM
-     (SELECT key, ordering,
-        CASE WHEN :include_long_description = 'false' AND key = 'Description'
-          THEN SUBSTRING(value FROM E'\\A[^\n]*')
-          ELSE value
-        END AS value
-      FROM
-        binaries_metadata bm
-        JOIN metadata_keys mk ON mk.key_id = bm.key_id
-      WHERE
-        bm.bin_id = tmp.binary_id
-        AND key != ALL (:metadata_skip)
-     ) AS metadata
-  )
+  rendered.metadata
   || COALESCE(E'\n' || (SELECT
      STRING_AGG(key || E'\: ' || value, E'\n' ORDER BY key)
    FROM external_overrides eo
@@ -201,8 +313,8 @@ SELECT
      eo.package = tmp.package
      AND eo.suite = :overridesuite AND eo.component = :component
   ), '')
-  || E'\nSection\: ' || COALESCE(sec.section, tmp.fallback_section)
-  || E'\nPriority\: ' || COALESCE(pri.priority, tmp.fallback_priority)
+  || E'\nSection\: ' || COALESCE(sec.section, rendered.fallback_section)
+  || E'\nPriority\: ' || COALESCE(pri.priority, rendered.fallback_priority)
   || E'\nFilename\: pool/' || :component_name || '/' || tmp.filename
   || E'\nSize\: ' || tmp.size
   || CASE WHEN suite.checksums && array['md5sum'] THEN E'\nMD5sum\: ' || tmp.md5sum ELSE '' END
@@ -211,6 +323,7 @@ SELECT
 
 FROM
   tmp
+  JOIN rendered ON rendered.binary_id = tmp.binary_id
   LEFT JOIN override o ON o.package = tmp.package
                       AND o.type = :type_id
                       AND o.suite = :overridesuite
@@ -231,7 +344,27 @@ WHERE
 ORDER BY tmp.source, tmp.package, tmp.version
 """
 
-def generate_packages(suite_id, component_id, architecture_id, type_name):
+_packages_fingerprint_query = R"""
+SELECT
+  MD5(COALESCE(STRING_AGG(b.id || ':' || COALESCE(o.section, 0) || ':' || COALESCE(o.priority, 0), ',' ORDER BY b.id), ''))
+  || MD5(COALESCE((SELECT STRING_AGG(eo.package || ':' || eo.key || ':' || eo.value, E'\n' ORDER BY eo.package, eo.key)
+                   FROM external_overrides eo
+                   WHERE eo.suite = :overridesuite AND eo.component = :component), ''))
+FROM
+  binaries b
+  JOIN bin_associations ba ON b.id = ba.bin
+  JOIN files_archive_map fam ON b.file = fam.file_id AND fam.archive_id = :archive_id
+  LEFT JOIN override o ON o.package = b.package
+                      AND o.type = :type_id
+                      AND o.suite = :overridesuite
+                      AND o.component = :component
+WHERE
+  (b.architecture = :arch_all OR b.architecture = :arch) AND b.type = :type_name
+  AND ba.suite = :suite
+  AND fam.component_id = :component
+"""
+
+def generate_packages(suite_id, component_id, architecture_id, type_name, incremental=False):
     global _packages_query
     from daklib.filewriter import PackagesFileWriter
     from daklib.dbconn import Architecture, Component, DBConn, OverrideType, Suite
@@ -266,20 +399,34 @@ def generate_packages(suite_id, component_id, architecture_id, type_name):
     if suite.indices_compression is not None:
         writer_args['compression'] = suite.indices_compression
     writer = PackagesFileWriter(**writer_args)
-    output = writer.open()
 
-    r = session.execute(_packages_query, {"archive_id": suite.archive.archive_id,
+    params = {"archive_id": suite.archive.archive_id,
         "suite": suite_id, "component": component_id, 'component_name': component.component_name,
         "arch": architecture_id, "type_id": type_id, "type_name": type_name, "arch_all": arch_all_id,
         "overridesuite": overridesuite_id, "metadata_skip": metadata_skip,
-        "include_long_description": 'true' if include_long_description else 'false'})
+        "include_long_description": 'true' if include_long_description else 'false'}
+    fingerprint = _index_fingerprint(session, _packages_fingerprint_query, params,
+                                     (component.component_name, suite.checksums, include_long_description, writer.compression))
+    message = ["generate-packages", suite.suite_name, component.component_name, architecture.arch_string]
+    if incremental and _index_unchanged(session, suite, writer, fingerprint):
+        session.rollback()
+        return (PROC_STATUS_SUCCESS, message + ["unchanged"])
+
+    # Workers for other architectures fill in the same arch:all binaries
+    session.execute("LOCK TABLE binary_stanza_cache IN SHARE ROW EXCLUSIVE MODE")
+    session.execute(_packages_stanza_cache_query, params)
+    session.commit()
+
+    output = writer.open()
+
+    r = session.execute(_packages_query, params)
     for (stanza,) in r:
         print >>output, stanza
         print >>output, ""
 
     writer.close()
+    _record_index(session, suite, writer, fingerprint)
 
-    message = ["generate-packages", suite.suite_name, component.component_name, architecture.arch_string]
     session.rollback()
     return (PROC_STATUS_SUCCESS, message)
 
@@ -316,7 +463,24 @@ GROUP BY b.package, bm_description_md5.value, bm_description.value
 ORDER BY MIN(s.source), b.package, bm_description_md5.value
 """
 
-def generate_translations(suite_id, component_id):
+_translations_fingerprint_query = """
+WITH
+  override_suite AS
+    (SELECT
+      s.id AS id,
+      COALESCE(os.id, s.id) AS overridesuite_id
+      FROM suite AS s LEFT JOIN suite AS os ON s.overridesuite = os.suite_name)
+
+SELECT
+  MD5(COALESCE(STRING_AGG(b.id::text, ',' ORDER BY b.id), ''))
+FROM binaries b
+  JOIN bin_associations ba ON b.id = ba.bin
+  JOIN override_suite os ON os.id = ba.suite
+  JOIN override o ON b.package = o.package AND o.suite = os.overridesuite_id AND o.type = (SELECT id FROM override_type WHERE type = 'deb')
+WHERE ba.suite = :suite AND o.component = :component
+"""
+
+def generate_translations(suite_id, component_id, incremental=False):
     global _translations_query
     from daklib.filewriter import TranslationFileWriter
     from daklib.dbconn import DBConn, Suite, Component
@@ -335,15 +499,24 @@ def generate_translations(suite_id, component_id):
     if suite.i18n_compression is not None:
         writer_args['compression'] = suite.i18n_compression
     writer = TranslationFileWriter(**writer_args)
+
+    params = {"suite": suite_id, "component": component_id}
+    fingerprint = _index_fingerprint(session, _translations_fingerprint_query, params,
+                                     (writer.compression,))
+    message = ["generate-translations", suite.suite_name, component.component_name]
+    if incremental and _index_unchanged(session, suite, writer, fingerprint):
+        session.rollback()
+        return (PROC_STATUS_SUCCESS, message + ["unchanged"])
+
     output = writer.open()
 
-    r = session.execute(_translations_query, {"suite": suite_id, "component": component_id})
+    r = session.execute(_translations_query, params)
     for (stanza,) in r:
         print >>output, stanza
 
     writer.close()
+    _record_index(session, suite, writer, fingerprint)
 
-    message = ["generate-translations", suite.suite_name, component.component_name]
     session.rollback()
     return (PROC_STATUS_SUCCESS, message)
 
@@ -359,6 +532,7 @@ def main():
                  ('a','archive','Generate-Packages-Sources::Options::Archive','HasArg'),
                  ('s',"suite","Generate-Packages-Sources::Options::Suite",'HasArg'),
                  ('f',"force","Generate-Packages-Sources::Options::Force"),
+                 ('i',"incremental","Generate-Packages-Sources::Options::Incremental"),
                  ('o','option','','ArbItem')]
 
     apt_pkg.parse_commandline(cnf.Cnf, Arguments, sys.argv)
@@ -400,6 +574,7 @@ def main():
         suites = query.all()
 
     force = "Force" in Options and Options["Force"]
+    incremental = "Incremental" in Options and Options["Incremental"]
 
 
     def parse_results(message):
@@ -422,14 +597,14 @@ def main():
             import daklib.utils
             daklib.utils.fubar("Refusing to touch %s (untouchable and not forced)" % s.suite_name)
         for c in component_ids:
-            pool.apply_async(generate_sources, [s.suite_id, c], callback=parse_results)
+            pool.apply_async(generate_sources, [s.suite_id, c, incremental], callback=parse_results)
             if not s.include_long_description:
-                pool.apply_async(generate_translations, [s.suite_id, c], callback=parse_results)
+                pool.apply_async(generate_translations, [s.suite_id, c, incremental], callback=parse_results)
             for a in s.architectures:
                 if a == 'source':
                     continue
-                pool.apply_async(generate_packages, [s.suite_id, c, a.arch_id, 'deb'], callback=parse_results)
-                pool.apply_async(generate_packages, [s.suite_id, c, a.arch_id, 'udeb'], callback=parse_results)
+                pool.apply_async(generate_packages, [s.suite_id, c, a.arch_id, 'deb', incremental], callback=parse_results)
+                pool.apply_async(generate_packages, [s.suite_id, c, a.arch_id, 'udeb', incremental], callback=parse_results)
 
     pool.close()
     pool.join()
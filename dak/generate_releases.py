@@ -42,6 +42,8 @@ import apt_pkg
 import subprocess
 from tempfile import mkstemp, mkdtemp
 import commands
+from contextlib import closing
+from multiprocessing.pool import ThreadPool
 from sqlalchemy.orm import object_session
 
 from daklib import utils, daklog
@@ -50,6 +52,8 @@ from daklib.dak_exceptions import *
 from daklib.dbconn import *
 from daklib.config import Config
 from daklib.dakmultiprocessing import DakProcessPool, PROC_STATUS_SUCCESS
+from daklib.compress import open_decompressed
+from daklib.hashcache import HashCache, hash_fileobj
 import daklib.daksubprocess
 
 ################################################################################
@@ -107,27 +111,25 @@ def sign_release_dir(suite, dirname):
             with open(inlinedest, 'w') as stdout:
                 daklib.gpg.sign(stdin, stdout, inline=True, **args)
 
-class XzFile(object):
-    def __init__(self, filename, mode='r'):
-        self.filename = filename
-    def read(self):
-        cmd = ("xz", "-d")
-        with open(self.filename, 'r') as stdin:
-            process = daklib.daksubprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE)
-            (stdout, stderr) = process.communicate()
-            return stdout
+def _hash_file(job):
+    """
+    Compute size and hashes of a single file for the Release file.
+    Called in worker threads of ReleaseWriter.generate_release_files.
+    """
+    opener, filename = job
+    with closing(opener(filename)) as fh:
+        return hash_fileobj(fh)
 
 
 class HashFunc(object):
-    def __init__(self, release_field, func, db_name):
+    def __init__(self, release_field, db_name):
         self.release_field = release_field
-        self.func = func
         self.db_name = db_name
 
 RELEASE_HASHES = [
-    HashFunc('MD5Sum', apt_pkg.md5sum, 'md5sum'),
-    HashFunc('SHA1', apt_pkg.sha1sum, 'sha1'),
-    HashFunc('SHA256', apt_pkg.sha256sum, 'sha256'),
+    HashFunc('MD5Sum', 'md5sum'),
+    HashFunc('SHA1', 'sha1'),
+    HashFunc('SHA256', 'sha256'),
 ]
 
 
@@ -372,12 +374,16 @@ class ReleaseWriter(object):
         os.chdir(self.suite_path())
 
         hashes = [x for x in RELEASE_HASHES if x.db_name in suite.checksums]
+        hashcache = HashCache(session, prefix=self.suite_path())
 
         fileinfo = {}
         fileinfo_byhash = {}
 
         uncompnotseen = {}
 
+        # Maps each filename to (opener, file to read) to compute its hashes
+        sources = {}
+
         for dirpath, dirnames, filenames in os.walk(".", followlinks=True, topdown=True):
             for entry in filenames:
                 if dirpath == '.' and entry in ["Release", "Release.gpg", "InRelease"]:
@@ -393,22 +399,17 @@ class ReleaseWriter(object):
                 else:
                     continue
 
-                contents = open(filename, 'r').read()
-
                 # If we find a file for which we have a compressed version and
                 # haven't yet seen the uncompressed one, store the possibility
                 # for future use
                 if entry.endswith(".gz") and filename[:-3] not in uncompnotseen:
-                    uncompnotseen[filename[:-3]] = (gzip.GzipFile, filename)
+                    uncompnotseen[filename[:-3]] = (open_decompressed, filename)
                 elif entry.endswith(".bz2") and filename[:-4] not in uncompnotseen:
-                    uncompnotseen[filename[:-4]] = (bz2.BZ2File, filename)
+                    uncompnotseen[filename[:-4]] = (open_decompressed, filename)
                 elif entry.endswith(".xz") and filename[:-3] not in uncompnotseen:
-                    uncompnotseen[filename[:-3]] = (XzFile, filename)
+                    uncompnotseen[filename[:-3]] = (open_decompressed, filename)
 
-                fileinfo[filename]['len'] = len(contents)
-
-                for hf in hashes:
-                    fileinfo[filename][hf.release_field] = hf.func(contents)
+                sources[filename] = (open, filename)
 
         for filename, comp in uncompnotseen.items():
             # If we've already seen the uncompressed file, we don't
@@ -417,15 +418,38 @@ class ReleaseWriter(object):
                 continue
 
             fileinfo[filename] = {}
-
             # File handler is comp[0], filename of compressed file is comp[1]
-            contents = comp[0](comp[1], 'r').read()
-
-            fileinfo[filename]['len'] = len(contents)
-
+            sources[filename] = comp
+
+        # Use cached hashes where possible and hash all other files in
+        # parallel.  Lookups and updates of the cache stay in this thread
+        # as they use the database session.
+        results = {}
+        missing = []
+        for filename in sorted(sources):
+            info = hashcache.get(os.path.join(self.suite_path(), filename))
+            if info is None:
+                missing.append(filename)
+            else:
+                results[filename] = info
+
+        jobs = [(sources[f][0], os.path.join(self.suite_path(), sources[f][1])) for f in missing]
+        workers = max(1, min(len(jobs), cnf.find_i("Generate-Releases::HashThreads", 4)))
+        hash_pool = ThreadPool(workers)
+        try:
+            hashed = hash_pool.map(_hash_file, jobs, chunksize=1)
+        finally:
+            hash_pool.close()
+            hash_pool.join()
+
+        for filename, (opener, path), info in zip(missing, jobs, hashed):
+            results[filename] = info
+            hashcache.set(os.path.join(self.suite_path(), filename), info, path)
+
+        for filename, info in results.iteritems():
+            fileinfo[filename]['len'] = info['size']
             for hf in hashes:
-                fileinfo[filename][hf.release_field] = hf.func(contents)
-
+                fileinfo[filename][hf.release_field] = info[hf.db_name]
 
         for field in sorted(h.release_field for h in hashes):
             out.write('%s:\n' % field)
@@ -435,6 +459,7 @@ class ReleaseWriter(object):
         out.close()
         os.rename(outfile + '.new', outfile)
 
+        hashcache.flush()
         self._update_hashfile_table(session, fileinfo_byhash, hashes)
         self._make_byhash_links(fileinfo_byhash, hashes)
         self._make_byhash_base_symlink(fileinfo_byhash, hashes)
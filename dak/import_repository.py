@@ -25,9 +25,11 @@ import daklib.import_repository
 import daklib.utils
 
 import apt_pkg
+import itertools
 import sys
 
 from collections import defaultdict
+from multiprocessing.pool import ThreadPool
 
 def usage(status=0):
     print("""
@@ -39,8 +41,15 @@ dak import-repository
   [--target-suite=${suite} (default: origin suite name)]
   [--add-overrides]
   [--max-packages=${n} (import at maximum ${n} packages, default: no limit)]
+  [--jobs=${n} (download and verify ${n} packages in parallel)]
+  [--commit-every=${n} (commit after every ${n} imported packages; an
+                       interrupted import can then be resumed by running
+                       it again, default: do not commit)]
   http://httpredir.debian.org/debian unstable
 
+A local mirror can be given as a path or file:// URL; its files are then
+used in place instead of being copied to temporary files first.
+
 Things to think about:
  - Import Built-Using sources
    - all / only referenced
@@ -63,6 +72,62 @@ def entry_is_newer(entry, packages):
 def entry_in_packages(entry, packages):
     return entry['Package'] in packages
 
+class Checkpoints(object):
+    """commit the transaction after every C{every} imported packages"""
+    def __init__(self, transaction, every=None):
+        self.transaction = transaction
+        self.every = every
+        self.count = 0
+
+    def imported(self):
+        self.count += 1
+        if self.every is not None and self.count % self.every == 0:
+            self.transaction.commit()
+            print("Committed after {0} packages".format(self.count))
+
+def copy_entry(entry):
+    """copy a section of an index file to a dict"""
+    return dict((key, entry[key]) for key in entry.keys())
+
+def obtain_helper(job):
+    """obtain files for an entry; runs in a worker thread"""
+    function, base, entry = job
+    try:
+        return entry, function(base, entry), None
+    except Exception as e:
+        return entry, None, e
+
+def obtain_all(pool, function, base, entries, chunk_size=100):
+    """obtain files for all entries
+
+    Files for the next C{chunk_size} entries are obtained by the workers of
+    C{pool} while the caller imports the current ones, so at most two
+    chunks of files are kept at any time.  Without a pool, files are
+    obtained one by one.
+
+    @return: generator of (entry, obtained) in the order of C{entries}
+    """
+    if pool is None:
+        for entry in entries:
+            yield entry, function(base, entry)
+        return
+
+    jobs = ((function, base, entry) for entry in entries)
+    pending = None
+    while True:
+        chunk = list(itertools.islice(jobs, chunk_size))
+        following = None
+        if len(chunk) > 0:
+            following = pool.map_async(obtain_helper, chunk)
+        if pending is not None:
+            for entry, obtained, error in pending.get():
+                if error is not None:
+                    raise error
+                yield entry, obtained
+        if following is None:
+            break
+        pending = following
+
 def get_packages_in_suite(suite):
     sources = defaultdict(list)
     for s in suite.sources:
@@ -74,22 +139,30 @@ def get_packages_in_suite(suite):
 
     return sources, packages
 
-def import_sources(base, sources, transaction, target_suite, component, target_sources, extra_sources, extra_sources_comp, max_packages=None):
+def import_sources(base, sources, transaction, target_suite, component, target_sources, extra_sources, extra_sources_comp, max_packages=None, pool=None, checkpoints=None):
+    def wanted():
+        n = 0
+        for entry in sources:
+            if max_packages is not None and n > max_packages:
+                break
+            entry = copy_entry(entry)
+            if entry.get('Extra-Source-Only', 'no') == 'yes':
+                # Remember package, we might need to import it later.
+                key = (entry['Package'], entry['Version'])
+                extra_sources[key] = entry
+                extra_sources_comp[key].add(component.component_name)
+                continue
+            if not entry_in_packages(entry, target_sources) or entry_is_newer(entry, target_sources):
+                n += 1
+                yield entry
+
     n = 0
-    for entry in sources:
-        if max_packages is not None and n > max_packages:
-            break
-        if entry.get('Extra-Source-Only', 'no') == 'yes':
-            # Remember package, we might need to import it later.
-            key = (entry['Package'], entry['Version'])
-            extra_sources[key] = entry
-            extra_sources_comp[key].add(c)
-            continue
-        if not entry_in_packages(entry, target_sources) or entry_is_newer(entry, target_sources):
-            print("Importing {0}={1}".format(entry['Package'], entry['Version']))
-            daklib.import_repository.import_source_to_suite(base, entry, transaction, target_suite, component)
-            n += 1
-            #transaction.commit()
+    for entry, obtained in obtain_all(pool, daklib.import_repository.obtain_source_files, base, wanted()):
+        print("Importing {0}={1}".format(entry['Package'], entry['Version']))
+        daklib.import_repository.import_source_to_suite(base, entry, transaction, target_suite, component, obtained)
+        n += 1
+        if checkpoints is not None:
+            checkpoints.imported()
     return n
 
 def import_built_using(base, source, version, transaction, target_suite, component, extra_sources, extra_sources_comp):
@@ -107,20 +180,27 @@ def import_built_using(base, source, version, transaction, target_suite, compone
             raise Exception("Not implemented.")
         daklib.import_repository.import_source_to_suite(base, extra_entry, transaction, target_suite, extra_component)
 
-def import_packages(base, packages, transaction, target_suite, component, architecture, target_binaries, extra_sources, extra_sources_comp, max_packages=None):
+def import_packages(base, packages, transaction, target_suite, component, architecture, target_binaries, extra_sources, extra_sources_comp, max_packages=None, pool=None, checkpoints=None):
+    def wanted():
+        n = 0
+        for entry in packages:
+            if max_packages is not None and n > max_packages:
+                break
+            if not entry_in_packages(entry, target_binaries) or entry_is_newer(entry, target_binaries):
+                n += 1
+                yield copy_entry(entry)
+
     n = 0
-    for entry in packages:
-        if max_packages is not None and n > max_packages:
-            break
-        if not entry_in_packages(entry, target_binaries) or entry_is_newer(entry, target_binaries):
-            print("Importing {0}={1} ({2})".format(entry['Package'], entry['Version'], architecture))
-            # Import Built-Using sources:
-            for bu_source, bu_version in daklib.utils.parse_built_using(entry):
-                import_built_using(base, bu_source, bu_version, transaction, target_suite, component, extra_sources, extra_sources_comp)
-            # Import binary:
-            daklib.import_repository.import_package_to_suite(base, entry, transaction, target_suite, component)
-            n += 1
-            #transaction.commit()
+    for entry, obtained in obtain_all(pool, daklib.import_repository.obtain_package_file, base, wanted()):
+        print("Importing {0}={1} ({2})".format(entry['Package'], entry['Version'], architecture))
+        # Import Built-Using sources:
+        for bu_source, bu_version in daklib.utils.parse_built_using(entry):
+            import_built_using(base, bu_source, bu_version, transaction, target_suite, component, extra_sources, extra_sources_comp)
+        # Import binary:
+        daklib.import_repository.import_package_to_suite(base, entry, transaction, target_suite, component, obtained)
+        n += 1
+        if checkpoints is not None:
+            checkpoints.imported()
     return n
 
 def main(argv=None):
@@ -136,6 +216,8 @@ def main(argv=None):
         ('t', 'target-suite', 'Import-Repository::Target-Suite', 'HasArg'),
         ('A', 'add-overrides', 'Import-Repository::AddOverrides'),
         ('n', 'max-packages', 'Import-Repository::MaxPackages', 'HasArg'),
+        ('j', 'jobs', 'Import-Repository::Jobs', 'HasArg'),
+        ('C', 'commit-every', 'Import-Repository::CommitEvery', 'HasArg'),
         ]
 
     cnf = daklib.config.Config();
@@ -161,6 +243,14 @@ def main(argv=None):
     else:
         max_packages = None
 
+    pool = None
+    if 'Jobs' in options:
+        pool = ThreadPool(int(options['Jobs']))
+
+    commit_every = None
+    if 'CommitEvery' in options:
+        commit_every = int(options['CommitEvery'])
+
     base, suite = argv[0:2]
 
     target_suite_name = options.find('Target-Suite') or suite
@@ -173,6 +263,7 @@ def main(argv=None):
 
         release = daklib.import_repository.obtain_release(base, suite, keyring)
         target_sources, target_binaries = get_packages_in_suite(target_suite)
+        checkpoints = Checkpoints(transaction, commit_every)
 
         if 'Architectures' in options:
             architectures = options['Architectures'].split(',')
@@ -198,7 +289,7 @@ def main(argv=None):
             component = daklib.dbconn.get_component(c, transaction.session)
             print("Processing {0}/source...".format(c))
             sources = release.sources(c)
-            imported = import_sources(base, sources, transaction, target_suite, component, target_sources, extra_sources, extra_sources_comp, max_packages)
+            imported = import_sources(base, sources, transaction, target_suite, component, target_sources, extra_sources, extra_sources_comp, max_packages, pool, checkpoints)
             print("  imported {0} source packages".format(imported))
             n += imported
             if max_packages is not None:
@@ -209,13 +300,20 @@ def main(argv=None):
             for architecture in architectures:
                 print("Processing {0}/{1}...".format(c, architecture))
                 packages = release.packages(c, architecture)
-                imported = import_packages(base, packages, transaction, target_suite, component, architecture, target_binaries, extra_sources, extra_sources_comp, max_packages)
+                imported = import_packages(base, packages, transaction, target_suite, component, architecture, target_binaries, extra_sources, extra_sources_comp, max_packages, pool, checkpoints)
                 print("  imported {0} binary packages".format(imported))
                 n += imported
                 if max_packages is not None:
                     max_packages -= n
 
-        transaction.rollback()
+        if commit_every is not None:
+            transaction.commit()
+        else:
+            transaction.rollback()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
 
 if __name__ == '__main__':
     main()
@@ -159,6 +159,7 @@ Checks Debian packages from Incoming
 
 ## Queue builds
 
+import contextlib
 import datetime
 import errno
 import fcntl
@@ -167,6 +168,7 @@ import sys
 import traceback
 import apt_pkg
 import time
+from multiprocessing import Lock, Pool
 from sqlalchemy.orm.exc import NoResultFound
 
 from daklib import daklog
@@ -180,12 +182,14 @@ from daklib.regexes import *
 import daklib.announce
 import daklib.archive
 import daklib.checks
+import daklib.gpg
 import daklib.upload
 
 ###############################################################################
 
 Options = None
 Logger = None
+InstallLock = None
 
 ###############################################################################
 
@@ -194,6 +198,8 @@ def usage (exit_code=0):
   -a, --automatic           automatic run
   -d, --directory <DIR>     process uploads in <DIR>
   -h, --help                show this help and exit.
+  -j, --jobs=NUMBER         check uploads of NUMBER source packages in parallel
+                            (requires --automatic or --no-action)
   -n, --no-action           don't do anything
   -p, --no-lock             don't check lockfile !! for cron.daily only !!
   -s, --no-mail             don't send any mail
@@ -356,6 +362,19 @@ def real_reject(directory, upload, reason=None, notify=True):
 
 ###############################################################################
 
+@contextlib.contextmanager
+def installing():
+    """serialise changes to the archive when processing uploads in parallel
+
+    Uploads are checked concurrently, but only one worker at a time may
+    install, reject or otherwise change the archive.
+    """
+    if InstallLock is None:
+        yield
+    else:
+        with InstallLock:
+            yield
+
 def action(directory, upload):
     changes = upload.changes
     processed = True
@@ -420,26 +439,28 @@ def action(directory, upload):
             answer = m.group(1)
         answer = answer[:1].upper()
 
-    if answer == 'R':
-        reject(directory, upload)
-    elif answer == 'A':
-        # upload.try_autobyhand must not be run with No-Action.
-        if Options['No-Action']:
-            accept(directory, upload)
-        elif upload.try_autobyhand():
-            accept(directory, upload)
-        else:
-            print "W: redirecting to BYHAND as automatic processing failed."
-            accept_to_new(directory, upload)
-    elif answer == 'N':
-        accept_to_new(directory, upload)
-    elif answer == 'Q':
+    if answer == 'Q':
         sys.exit(0)
-    elif answer == 'S':
-        processed = False
 
-    if not Options['No-Action']:
-        upload.commit()
+    with installing():
+        if answer == 'R':
+            reject(directory, upload)
+        elif answer == 'A':
+            # upload.try_autobyhand must not be run with No-Action.
+            if Options['No-Action']:
+                accept(directory, upload)
+            elif upload.try_autobyhand():
+                accept(directory, upload)
+            else:
+                print "W: redirecting to BYHAND as automatic processing failed."
+                accept_to_new(directory, upload)
+        elif answer == 'N':
+            accept_to_new(directory, upload)
+        elif answer == 'S':
+            processed = False
+
+        if not Options['No-Action']:
+            upload.commit()
 
     return processed
 
@@ -461,12 +482,13 @@ def process_it(directory, changes, keyrings):
     with daklib.archive.ArchiveUpload(directory, changes, keyrings) as upload:
         processed = action(directory, upload)
         if processed and not Options['No-Action']:
-            session = DBConn().session()
-            history = SignatureHistory.from_signed_file(upload.changes)
-            if history.query(session) is None:
-                session.add(history)
-                session.commit()
-            session.close()
+            with installing():
+                session = DBConn().session()
+                history = SignatureHistory.from_signed_file(upload.changes)
+                if history.query(session) is None:
+                    session.add(history)
+                    session.commit()
+                session.close()
 
             unlink_if_exists(os.path.join(directory, changes.filename))
             for fn in changes.files:
@@ -474,12 +496,75 @@ def process_it(directory, changes, keyrings):
 
 ###############################################################################
 
-def process_changes(changes_filenames):
+def init_worker(install_lock):
+    global InstallLock
+    InstallLock = install_lock
+
+def process_source_helper(job):
+    """
+    Process all uploads of one source package in order.  This function runs
+    in a subprocess.
+
+    @type job: tuple
+    @param job: (source, changes_filenames, keyrings, verifications) where
+                verifications are the signature verification results of the
+                main process (see L{daklib.gpg.export_verifications})
+
+    @rtype: tuple
+    @return: (source, accept_count, accept_bytes, reject_count, urgencies, error)
+             where urgencies is the number of entries written to the urgency log
+    """
+    source, changes_filenames, keyrings, verifications = job
+    daklib.gpg.import_verifications(verifications)
+
+    summarystats = SummaryStats()
+    summarystats.reset_accept()
+    summarystats.reset_reject()
+    urgencies = 0
+    if not Options['No-Action']:
+        urgencies = UrgencyLog().writes
+
+    error = None
+    for fn in changes_filenames:
+        directory, filename = os.path.split(fn)
+        try:
+            c = daklib.upload.Changes(directory, filename, keyrings)
+        except Exception as e:
+            Logger.log([filename, "Error while loading changes: {0}".format(e)])
+            continue
+        try:
+            process_it(directory, c, keyrings)
+        except Exception as e:
+            # later uploads of the same source must not overtake this one
+            error = "{0}: {1}".format(filename, traceback.format_exc())
+            break
+
+    if not Options['No-Action']:
+        urgencies = UrgencyLog().writes - urgencies
+
+    return (source, summarystats.accept_count, summarystats.accept_bytes,
+            summarystats.reject_count, urgencies, error)
+
+def process_changes(changes_filenames, pool=None):
     session = DBConn().session()
     keyrings = session.query(Keyring).filter_by(active=True).order_by(Keyring.priority)
     keyring_files = [ k.keyring_name for k in keyrings ]
     session.close()
 
+    # Verify all signatures up front: this runs several instances of gpg
+    # at once and the results are remembered for the Changes objects.
+    datas = []
+    for fn in changes_filenames:
+        try:
+            with open(fn, 'r') as fh:
+                datas.append(fh.read())
+        except IOError:
+            pass
+    if Options["Jobs"]:
+        daklib.gpg.verify_signed_files(datas, keyring_files, threads=int(Options["Jobs"]))
+    else:
+        daklib.gpg.verify_signed_files(datas, keyring_files)
+
     changes = []
     for fn in changes_filenames:
         try:
@@ -491,8 +576,35 @@ def process_changes(changes_filenames):
 
     changes.sort(key=lambda x: x[1])
 
+    if pool is None:
+        for directory, c in changes:
+            process_it(directory, c, keyring_files)
+        return
+
+    # Uploads of the same source are sorted next to each other and are
+    # processed in order by a single worker; uploads of different sources
+    # are independent of each other.
+    groups = []
     for directory, c in changes:
-        process_it(directory, c, keyring_files)
+        source = c.changes.get('Source')
+        if len(groups) > 0 and groups[-1][0] == source:
+            groups[-1][1].append(c)
+        else:
+            groups.append((source, [c]))
+
+    summarystats = SummaryStats()
+    jobs = [ (source, [ c.path for c in group ], keyring_files,
+              daklib.gpg.export_verifications([ c.signature.cache_key for c in group ]))
+             for source, group in groups ]
+    for source, accept_count, accept_bytes, reject_count, urgencies, error in pool.imap_unordered(process_source_helper, jobs):
+        summarystats.accept_count += accept_count
+        summarystats.accept_bytes += accept_bytes
+        summarystats.reject_count += reject_count
+        if not Options['No-Action']:
+            UrgencyLog().writes += urgencies
+        if error is not None:
+            Logger.log(["E: processing uploads of source failed", source])
+            utils.warn("Processing uploads of {0} failed:\n{1}".format(source, error))
 
 def process_buildinfos(upload):
     cnf = Config()
@@ -522,12 +634,13 @@ def main():
 
     Arguments = [('a',"automatic","Dinstall::Options::Automatic"),
                  ('h',"help","Dinstall::Options::Help"),
+                 ('j',"jobs","Dinstall::Options::Jobs","HasArg"),
                  ('n',"no-action","Dinstall::Options::No-Action"),
                  ('p',"no-lock", "Dinstall::Options::No-Lock"),
                  ('s',"no-mail", "Dinstall::Options::No-Mail"),
                  ('d',"directory", "Dinstall::Options::Directory", "HasArg")]
 
-    for i in ["automatic", "help", "no-action", "no-lock", "no-mail",
+    for i in ["automatic", "help", "jobs", "no-action", "no-lock", "no-mail",
               "version", "directory"]:
         key = "Dinstall::Options::%s" % i
         if key not in cnf:
@@ -543,6 +656,9 @@ def main():
     if Options["No-Action"]:
         Options["Automatic"] = ""
 
+    if Options["Jobs"] and not (Options["Automatic"] or Options["No-Action"]):
+        utils.fubar("--jobs can only be used together with --automatic or --no-action")
+
     # Obtain lock if not in no-action mode and initialize the log
     if not Options["No-Action"]:
         lock_fd = os.open(os.path.join(cnf["Dir::Lock"], 'process-upload.lock'), os.O_RDWR | os.O_CREAT)
@@ -574,7 +690,15 @@ def main():
     else:
         Logger.log(["Using changes files from command-line", len(changes_files)])
 
-    process_changes(changes_files)
+    pool = None
+    if Options["Jobs"]:
+        pool = Pool(int(Options["Jobs"]), init_worker, (Lock(), ))
+
+    process_changes(changes_files, pool)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
 
     if summarystats.accept_count:
         sets = "set"
@@ -47,10 +47,14 @@ class HashMismatchException(ArchiveException):
 
 class ArchiveTransaction(object):
     """manipulate the archive in a transaction
+
+    The metadata of installed packages is collected in C{metadata_importer}
+    and inserted in batches, at the latest when the transaction is committed.
     """
     def __init__(self):
         self.fs = FilesystemTransaction()
         self.session = DBConn().session()
+        self.metadata_importer = MetadataImporter(self.session)
 
     def get_file(self, hashed_file, source_name, check_hashes=True):
         """Look for file C{hashed_file} in database
@@ -111,8 +115,10 @@ class ArchiveTransaction(object):
             session.flush()
 
             path = os.path.join(archive.path, 'pool', component.component_name, poolname)
+            if hashed_file.changed_since_check(directory):
+                raise ArchiveException('{0}: file changed after its hashes were checked.'.format(hashed_file.filename))
             hashed_file_path = os.path.join(directory, hashed_file.input_filename)
-            self.fs.copy(hashed_file_path, path, link=False, mode=archive.mode)
+            self.fs.copy(hashed_file_path, path, link=False, mode=archive.mode, reflink=True)
 
         return poolfile
 
@@ -197,7 +203,7 @@ class ArchiveTransaction(object):
                 setattr(db_binary, key, value)
             session.add(db_binary)
             session.flush()
-            import_metadata_into_db(db_binary, session)
+            self.metadata_importer.add(db_binary)
 
             # FIXME-PUREOS: Disabled temporarily, we can't support this easily when doing binary syncs
             #self._add_built_using(db_binary, binary.hashed_file.filename, control, suite, extra_archives=extra_source_archives)
@@ -333,7 +339,7 @@ class ArchiveTransaction(object):
         session.flush()
 
         # Importing is safe as we only arrive here when we did not find the source already installed earlier.
-        import_metadata_into_db(db_source, session)
+        self.metadata_importer.add(db_source)
 
         # Uploaders are the maintainer and co-maintainers from the Uploaders field
         db_source.uploaders.append(maintainer)
@@ -409,7 +415,7 @@ class ArchiveTransaction(object):
             target_af = ArchiveFile(archive, component, db_file)
             session.add(target_af)
             session.flush()
-            self.fs.copy(source_af.path, target_af.path, link=False, mode=archive.mode)
+            self.fs.copy(source_af.path, target_af.path, link=False, mode=archive.mode, reflink=True)
 
     def copy_binary(self, db_binary, suite, component, allow_tainted=False, extra_archives=None):
         """Copy a binary package to the given suite and component
@@ -529,14 +535,17 @@ class ArchiveTransaction(object):
     def commit(self):
         """commit changes"""
         try:
+            self.metadata_importer.flush()
             self.session.commit()
             self.fs.commit()
         finally:
+            self.metadata_importer.clear()
             self.session.rollback()
             self.fs.rollback()
 
     def rollback(self):
         """rollback changes"""
+        self.metadata_importer.clear()
         self.session.rollback()
         self.fs.rollback()
 
@@ -660,7 +669,9 @@ class ArchiveUpload(object):
     def prepare(self):
         """prepare upload for further processing
 
-        This copies the files involved to a temporary directory.  If you use
+        This copies the files involved to a temporary directory.  Where the
+        filesystem supports it, the copies share their data with the
+        original files (see L{daklib.fstransactions.clone_file}).  If you use
         this method directly, you have to remove the directory given by the
         C{directory} attribute later on your own.
 
@@ -683,7 +694,7 @@ class ArchiveUpload(object):
         with FilesystemTransaction() as fs:
             src = os.path.join(self.original_directory, self.original_changes.filename)
             dst = os.path.join(self.directory, self.original_changes.filename)
-            fs.copy(src, dst, mode=0o640)
+            fs.copy(src, dst, mode=0o640, reflink=True)
 
             self.changes = upload.Changes(self.directory, self.original_changes.filename, self.keyrings)
 
@@ -692,7 +703,7 @@ class ArchiveUpload(object):
                 dst = os.path.join(self.directory, f.filename)
                 if not os.path.exists(src):
                     continue
-                fs.copy(src, dst, mode=0o640)
+                fs.copy(src, dst, mode=0o640, reflink=True)
 
             source = None
             try:
@@ -709,7 +720,7 @@ class ArchiveUpload(object):
                         try:
                             db_file = self.transaction.get_file(f, source.dsc['Source'], check_hashes=False)
                             db_archive_file = session.query(ArchiveFile).filter_by(file=db_file).first()
-                            fs.copy(db_archive_file.path, dst, mode=0o640)
+                            fs.copy(db_archive_file.path, dst, mode=0o640, reflink=True)
                         except KeyError:
                             # Ignore if get_file could not find it. Upload will
                             # probably be rejected later.
@@ -1427,6 +1438,7 @@ class ArchiveUpload(object):
     def __exit__(self, type, value, traceback):
         if self.directory is not None:
             shutil.rmtree(self.directory)
+            upload.forget_checked_files(self.directory)
             self.directory = None
         self.changes = None
         self.transaction.rollback()
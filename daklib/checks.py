@@ -805,8 +805,50 @@ class ArchAllBinNMUCheck(Check):
 
         return True
 
+_lintian_tags = {}
+_lintian_cache = None
+
+def _get_lintian_tags(tagfile):
+    """parsed lintian tag definitions
+
+    The file is only parsed again when it changed.
+    """
+    st = os.stat(tagfile)
+    state = (st.st_size, st.st_mtime, st.st_ino)
+    cached = _lintian_tags.get(tagfile)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+
+    with open(tagfile, 'r') as sourcefile:
+        sourcecontent = sourcefile.read()
+    try:
+        lintiantags = yaml.safe_load(sourcecontent)['lintian']
+    except yaml.YAMLError as msg:
+        raise Exception('Could not read lintian tags file {0}, YAML error: {1}'.format(tagfile, msg))
+
+    _lintian_tags[tagfile] = (state, lintiantags)
+    return lintiantags
+
+def _get_lintian_cache():
+    """lintian results of earlier runs, kept in C{Dir::Cache/lintian}"""
+    global _lintian_cache
+    if _lintian_cache is None:
+        directory = None
+        cache = Config().get('Dir::Cache')
+        if cache:
+            directory = os.path.join(cache, 'lintian')
+        _lintian_cache = lintian.LintianCache(directory)
+        _lintian_cache.expire()
+    return _lintian_cache
+
 class LintianCheck(Check):
-    """Check package using lintian"""
+    """Check package using lintian
+
+    Results are remembered by the checksums of the upload's files, so
+    processing an upload again does not run lintian again.  If
+    C{Dinstall::LintianTimeout} is set, lintian is stopped after that many
+    seconds and treated like a failed lintian run.
+    """
     def check(self, upload):
         changes = upload.changes
 
@@ -820,27 +862,68 @@ class LintianCheck(Check):
         cnf = Config()
         if 'Dinstall::LintianTags' not in cnf:
             return True
-        tagfile = cnf['Dinstall::LintianTags']
+        lintiantags = _get_lintian_tags(cnf['Dinstall::LintianTags'])
+        tags = set()
+        for values in lintiantags.itervalues():
+            tags.update(values)
 
-        with open(tagfile, 'r') as sourcefile:
-            sourcecontent = sourcefile.read()
-        try:
-            lintiantags = yaml.safe_load(sourcecontent)['lintian']
-        except yaml.YAMLError as msg:
-            raise Exception('Could not read lintian tags file {0}, YAML error: {1}'.format(tagfile, msg))
+        changespath = os.path.join(upload.directory, changes.filename)
+        with open(changespath, 'r') as fh:
+            files = [ (changes.filename, apt_pkg.sha256sum(fh)) ]
+        files.extend((f.filename, f.sha256sum) for f in changes.files.itervalues())
+
+        cache = _get_lintian_cache()
+        key = lintian.lintian_cache_key(files, tags)
+        cached = cache.get(key)
+        if cached is not None:
+            result, output = cached
+        else:
+            result, output = self._run_lintian(changespath, tags)
+            # 0: no tags emitted, 1: tags emitted; anything else is a failure
+            if result in (0, 1):
+                try:
+                    cache.put(key, result, output)
+                except (IOError, OSError) as e:
+                    utils.warn("could not remember lintian result for %s: %s" % (changespath, e))
+
+        if result == 2:
+            utils.warn("lintian failed for %s [return code: %s]." % \
+                (changespath, result))
+            utils.warn(utils.prefix_multi_line_string(output, \
+                " [possible output:] "))
+        elif result in (124, 137) and cnf.get('Dinstall::LintianTimeout'):
+            utils.warn("lintian did not finish for %s within %s seconds." % \
+                (changespath, cnf['Dinstall::LintianTimeout']))
+
+        parsed_tags = lintian.parse_lintian_output(output)
+        rejects = list(lintian.generate_reject_messages(parsed_tags, lintiantags))
+        if len(rejects) != 0:
+            raise Reject('\n'.join(rejects))
+
+        return True
+
+    def _run_lintian(self, changespath, tags):
+        """run lintian on an upload
+
+        @rtype:  tuple
+        @return: (returncode, output)
+        """
+        cnf = Config()
 
         fd, temp_filename = utils.temp_filename(mode=0o644)
         temptagfile = os.fdopen(fd, 'w')
-        for tags in lintiantags.itervalues():
-            for tag in tags:
-                print >>temptagfile, tag
+        for tag in sorted(tags):
+            print >>temptagfile, tag
         temptagfile.close()
 
-        changespath = os.path.join(upload.directory, changes.filename)
         try:
             cmd = []
             result = 0
 
+            timeout = cnf.get('Dinstall::LintianTimeout') or None
+            if timeout is not None:
+                cmd.extend(['timeout', '--kill-after=60', timeout])
+
             user = cnf.get('Dinstall::UnprivUser') or None
             if user is not None:
                 cmd.extend(['sudo', '-H', '-u', user])
@@ -853,18 +936,7 @@ class LintianCheck(Check):
         finally:
             os.unlink(temp_filename)
 
-        if result == 2:
-            utils.warn("lintian failed for %s [return code: %s]." % \
-                (changespath, result))
-            utils.warn(utils.prefix_multi_line_string(output, \
-                " [possible output:] "))
-
-        parsed_tags = lintian.parse_lintian_output(output)
-        rejects = list(lintian.generate_reject_messages(parsed_tags, lintiantags))
-        if len(rejects) != 0:
-            raise Reject('\n'.join(rejects))
-
-        return True
+        return result, output
 
 class SourceFormatCheck(Check):
     """Check source format is allowed in the target suite"""
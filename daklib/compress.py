@@ -18,10 +18,14 @@
 Helper methods to deal with (de)compressing files
 """
 
+import bz2
+import gzip
 import os
 import shutil
 import subprocess
 
+import daklib.daksubprocess
+
 def decompress_xz(input, output):
     subprocess.check_call(["xz", "--decompress"], stdin=input, stdout=output)
 
@@ -47,3 +51,45 @@ def decompress(input, output, filename=None):
         decompressor(input, output)
     else:
         shutil.copyfileobj(input, output)
+
+class _XzFile(object):
+    """read-only file object decompressing a .xz file through a pipe"""
+    def __init__(self, filename):
+        self.name = filename
+        with open(filename, 'r') as stdin:
+            self.process = daklib.daksubprocess.Popen(["xz", "--decompress"],
+                stdin=stdin, stdout=subprocess.PIPE, close_fds=True)
+
+    def read(self, size=-1):
+        return self.process.stdout.read(size)
+
+    def close(self):
+        self.process.stdout.close()
+        returncode = self.process.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, "xz --decompress < {0}".format(self.name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+openers = {
+    '.xz': _XzFile,
+    '.bz2': bz2.BZ2File,
+    '.gz': gzip.GzipFile,
+}
+
+def open_decompressed(filename):
+    """open a file for reading, decompressing it on the fly
+
+    The compression is detected from the extension; files without a
+    known extension are opened as-is.  The returned object supports
+    at least read(size) and close().
+    """
+    base, ext = os.path.splitext(filename)
+    opener = openers.get(ext, None)
+    if opener is not None:
+        return opener(filename)
+    return open(filename, 'r')
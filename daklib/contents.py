@@ -27,9 +27,13 @@ Helper code for contents generation.
 
 from daklib.dbconn import *
 from daklib.config import Config
+from daklib.debfile import DebFileError, data_names, normalize_name
+from daklib.sourcecontents import source_names
 from daklib.filewriter import BinaryContentsFileWriter, SourceContentsFileWriter
+from daklib.hashcache import HashCache
 
 from multiprocessing import Pool
+from StringIO import StringIO
 from shutil import rmtree
 from tempfile import mkdtemp
 
@@ -140,6 +144,10 @@ select bc.file, string_agg(o.section || '/' || b.package, ',' order by b.package
         for item in self.fetch():
             file.write(item)
         writer.close()
+        hashcache = HashCache(self.session)
+        hashcache.set_from_writer(writer)
+        hashcache.flush()
+        self.session.commit()
 
 
 class SourceContentsWriter(object):
@@ -224,6 +232,10 @@ select sc.file, string_agg(s.source, ',' order by s.source) as pkglist
         for item in self.fetch():
             file.write(item)
         writer.close()
+        hashcache = HashCache(self.session)
+        hashcache.set_from_writer(writer)
+        hashcache.flush()
+        self.session.commit()
 
 
 def binary_helper(suite_id, arch_id, overridetype_id, component_id):
@@ -316,6 +328,23 @@ class ContentsWriter(object):
         session.close()
 
 
+def copy_rows(session, table, columns, rows):
+    '''
+    Inserts rows into table using COPY, which is a lot faster than
+    individual INSERT statements. The rows are written in the session's
+    current transaction.
+    '''
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+            .replace('\n', '\\n').replace('\r', '\\r')
+    data = StringIO()
+    for row in rows:
+        data.write('\t'.join(escape(value) for value in row))
+        data.write('\n')
+    data.seek(0)
+    cursor = session.connection().connection.cursor()
+    cursor.copy_expert('COPY %s (%s) FROM STDIN' % (table, ', '.join(columns)), data)
+
 class BinaryContentsScanner(object):
     '''
     BinaryContentsScanner provides a threadsafe method scan() to scan the
@@ -339,40 +368,85 @@ class BinaryContentsScanner(object):
         fileset = set(binary.scan_contents())
         if len(fileset) == 0:
             fileset.add('EMPTY_PACKAGE')
-        for filename in fileset:
-            binary.contents.append(BinContents(file = filename))
+        copy_rows(session, 'bin_contents', ('binary_id', 'file'),
+            ((self.binary_id, filename) for filename in fileset))
         session.commit()
         session.close()
 
+    # The path is chosen like PoolFile.fullpath does.
+    _unscanned_query = '''
+        SELECT DISTINCT ON (b.id)
+          b.id, a.path || '/pool/' || c.name || '/' || f.filename
+        FROM binaries b
+          JOIN files f ON f.id = b.file
+          JOIN files_archive_map fam ON fam.file_id = f.id
+          JOIN archive a ON a.id = fam.archive_id
+          JOIN component c ON c.id = fam.component_id
+        WHERE NOT EXISTS (SELECT 1 FROM bin_contents bc WHERE bc.binary_id = b.id)
+        ORDER BY b.id, a.tainted DESC
+        LIMIT :limit'''
+
     @classmethod
-    def scan_all(class_, limit = None):
+    def scan_all(class_, limit = None, processes = None, batch_size = 10000,
+            progress = None):
         '''
-        The class method scan_all() scans all binaries using multiple threads.
-        The number of binaries to be scanned can be limited with the limit
-        argument. Returns the number of processed and remaining packages as a
-        dict.
+        The class method scan_all() scans all binaries using multiple
+        processes. The number of binaries to be scanned can be limited with
+        the limit argument and the number of processes with the processes
+        argument. The workers only read the packages; their results are
+        written in batches of at least batch_size rows. progress is called
+        with the number of scanned and total packages after each batch.
+
+        Returns the number of processed, failed and remaining packages as a
+        dict; 'errors' is a list of error messages for the failed packages.
         '''
+        pool = Pool(processes)
         session = DBConn().session()
-        query = session.query(DBBinary).filter(DBBinary.contents == None)
-        remaining = query.count
-        if limit is not None:
-            query = query.limit(limit)
-        processed = query.count()
-        pool = Pool()
-        for binary in query.yield_per(100):
-            pool.apply_async(binary_scan_helper, (binary.binary_id, ))
+        jobs = session.execute(class_._unscanned_query, {'limit': limit}).fetchall()
+        session.rollback()
+        total = len(jobs)
+        processed = 0
+        errors = []
+        rows = []
+
+        def flush():
+            copy_rows(session, 'bin_contents', ('binary_id', 'file'), rows)
+            session.commit()
+            del rows[:]
+            if progress is not None:
+                progress(processed + len(errors), total)
+
+        for binary_id, filenames, error in pool.imap_unordered(binary_scan_helper,
+                [tuple(job) for job in jobs], chunksize=16):
+            if error is not None:
+                errors.append(error)
+                continue
+            processed += 1
+            rows.extend((binary_id, filename) for filename in filenames)
+            if len(rows) >= batch_size:
+                flush()
         pool.close()
         pool.join()
-        remaining = remaining()
+        flush()
+
+        remaining = session.query(DBBinary).filter(DBBinary.contents == None).count()
         session.close()
-        return { 'processed': processed, 'remaining': remaining }
+        return { 'processed': processed, 'failed': len(errors), 'errors': errors,
+            'remaining': remaining }
 
-def binary_scan_helper(binary_id):
+def binary_scan_helper(job):
     '''
-    This function runs in a subprocess.
+    This function runs in a subprocess. It returns the binary_id, the
+    filenames and an error message or None.
     '''
-    scanner = BinaryContentsScanner(binary_id)
-    scanner.scan()
+    binary_id, path = job
+    try:
+        fileset = set(data_names(path))
+    except Exception as e:
+        return (binary_id, None, '%s: %s' % (path, e))
+    if len(fileset) == 0:
+        fileset.add('EMPTY_PACKAGE')
+    return (binary_id, sorted(fileset), None)
 
 class UnpackedSource(object):
     '''
@@ -434,6 +508,23 @@ class UnpackedSource(object):
         self.cleanup()
 
 
+def source_contents(dscfilename, filenames):
+    '''
+    Returns the set of normalized filenames in the source package described
+    by dscfilename. filenames are the paths of the files listed in the
+    .dsc. The tarballs are only read; dpkg-source is used to unpack the
+    package for unsupported formats.
+    '''
+    try:
+        return source_names(filenames)
+    except DebFileError:
+        pass
+    unpacked = UnpackedSource(dscfilename)
+    try:
+        return set(normalize_name(name) for name in unpacked.get_all_filenames())
+    finally:
+        unpacked.cleanup()
+
 class SourceContentsScanner(object):
     '''
     SourceContentsScanner provides a method scan() to scan the contents of a
@@ -454,40 +545,86 @@ class SourceContentsScanner(object):
         session = DBConn().session()
         source = session.query(DBSource).get(self.source_id)
         fileset = set(source.scan_contents())
-        for filename in fileset:
-            source.contents.append(SrcContents(file = filename))
+        copy_rows(session, 'src_contents', ('source_id', 'file'),
+            ((self.source_id, filename) for filename in fileset))
         session.commit()
         session.close()
 
+    # The path is chosen like PoolFile.fullpath does; all other files of
+    # a source package are in the same directory as the .dsc.
+    _unscanned_query = '''
+        SELECT DISTINCT ON (s.id)
+          s.id, a.path || '/pool/' || c.name || '/' || f.filename,
+          ARRAY(SELECT df_f.filename FROM dsc_files df JOIN files df_f ON df_f.id = df.file
+                WHERE df.source = s.id)
+        FROM source s
+          JOIN files f ON f.id = s.file
+          JOIN files_archive_map fam ON fam.file_id = f.id
+          JOIN archive a ON a.id = fam.archive_id
+          JOIN component c ON c.id = fam.component_id
+        WHERE NOT EXISTS (SELECT 1 FROM src_contents sc WHERE sc.source_id = s.id)
+        ORDER BY s.id, a.tainted DESC
+        LIMIT :limit'''
+
     @classmethod
-    def scan_all(class_, limit = None):
+    def scan_all(class_, limit = None, processes = None, batch_size = 10000,
+            progress = None):
         '''
         The class method scan_all() scans all source using multiple processes.
         The number of sources to be scanned can be limited with the limit
-        argument. Returns the number of processed and remaining packages as a
-        dict.
+        argument and the number of processes with the processes argument.
+        The results are written in batches of at least batch_size rows.
+        progress is called with the number of scanned and total packages
+        after each batch.
+
+        Returns the number of processed, failed and remaining packages as a
+        dict; 'errors' is a list of error messages for the failed packages.
         '''
+        pool = Pool(processes)
         session = DBConn().session()
-        query = session.query(DBSource).filter(DBSource.contents == None)
-        remaining = query.count
-        if limit is not None:
-            query = query.limit(limit)
-        processed = query.count()
-        pool = Pool()
-        for source in query.yield_per(100):
-            pool.apply_async(source_scan_helper, (source.source_id, ))
+        jobs = []
+        for source_id, dscfilename, filenames in \
+                session.execute(class_._unscanned_query, {'limit': limit}):
+            directory = os.path.dirname(dscfilename)
+            jobs.append((source_id, dscfilename,
+                [os.path.join(directory, os.path.basename(f)) for f in filenames]))
+        session.rollback()
+        total = len(jobs)
+        processed = 0
+        errors = []
+        rows = []
+
+        def flush():
+            copy_rows(session, 'src_contents', ('source_id', 'file'), rows)
+            session.commit()
+            del rows[:]
+            if progress is not None:
+                progress(processed + len(errors), total)
+
+        for source_id, filenames, error in pool.imap_unordered(source_scan_helper, jobs):
+            if error is not None:
+                errors.append(error)
+                continue
+            processed += 1
+            rows.extend((source_id, filename) for filename in filenames)
+            if len(rows) >= batch_size:
+                flush()
         pool.close()
         pool.join()
-        remaining = remaining()
+        flush()
+
+        remaining = session.query(DBSource).filter(DBSource.contents == None).count()
         session.close()
-        return { 'processed': processed, 'remaining': remaining }
+        return { 'processed': processed, 'failed': len(errors), 'errors': errors,
+            'remaining': remaining }
 
-def source_scan_helper(source_id):
+def source_scan_helper(job):
     '''
-    This function runs in a subprocess.
+    This function runs in a subprocess. It returns the source_id, the
+    filenames and an error message or None.
     '''
+    source_id, dscfilename, filenames = job
     try:
-        scanner = SourceContentsScanner(source_id)
-        scanner.scan()
+        return (source_id, sorted(source_contents(dscfilename, filenames)), None)
     except Exception as e:
-        print e
+        return (source_id, None, '%s: %s' % (dscfilename, e))
@@ -75,6 +75,9 @@ def _func_wrapper(func, *args, **kwds):
         sqlalchemy.orm.session.Session.close_all()
 
 
+# Create process pools, this one as well as plain multiprocessing pools,
+# before opening a database session so forked workers do not inherit the
+# connection.
 class DakProcessPool(Pool):
     def __init__(self, *args, **kwds):
         Pool.__init__(self, *args, **kwds)
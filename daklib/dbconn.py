@@ -36,7 +36,6 @@
 import apt_pkg
 import daklib.daksubprocess
 import os
-from os.path import normpath
 import re
 import psycopg2
 import subprocess
@@ -52,7 +51,6 @@ except:
 from datetime import datetime, timedelta
 from errno import ENOENT
 from tempfile import mkstemp, mkdtemp
-from tarfile import TarFile
 
 from inspect import getargspec
 
@@ -459,22 +457,9 @@ class DBBinary(ORMObject):
         or iso8859-1 encoding. It yields the string ' <EMPTY PACKAGE>' if the
         package does not contain any regular file.
         '''
-        fullpath = self.poolfile.fullpath
-        dpkg_cmd = ('dpkg-deb', '--fsys-tarfile', fullpath)
-        dpkg = daklib.daksubprocess.Popen(dpkg_cmd, stdout=subprocess.PIPE)
-        tar = TarFile.open(fileobj = dpkg.stdout, mode = 'r|')
-        for member in tar.getmembers():
-            if not member.isdir():
-                name = normpath(member.name)
-                # enforce proper utf-8 encoding
-                try:
-                    name.decode('utf-8')
-                except UnicodeDecodeError:
-                    name = name.decode('iso8859-1').encode('utf-8')
-                yield name
-        tar.close()
-        dpkg.stdout.close()
-        dpkg.wait()
+        from daklib.debfile import data_names
+        for name in data_names(self.poolfile.fullpath):
+            yield name
 
     def read_control(self):
         '''
@@ -1642,17 +1627,11 @@ class DBSource(ORMObject):
         encoding.
         '''
         fullpath = self.poolfile.fullpath
-        from daklib.contents import UnpackedSource
-        unpacked = UnpackedSource(fullpath)
-        fileset = set()
-        for name in unpacked.get_all_filenames():
-            # enforce proper utf-8 encoding
-            try:
-                name.decode('utf-8')
-            except UnicodeDecodeError:
-                name = name.decode('iso8859-1').encode('utf-8')
-            fileset.add(name)
-        return fileset
+        directory = os.path.dirname(fullpath)
+        filenames = [os.path.join(directory, os.path.basename(dscfile.poolfile.filename))
+                     for dscfile in self.srcfiles]
+        from daklib.contents import source_contents
+        return source_contents(fullpath, filenames)
 
     @property
     def proxy(self):
@@ -1708,28 +1687,88 @@ def get_source_in_suite(source, suite_name, session=None):
 
 __all__.append('get_source_in_suite')
 
+def _encode_metadata_value(value):
+    try:
+        # Try raw ASCII
+        return str(value)
+    except UnicodeEncodeError:
+        # Fall back to UTF-8
+        try:
+            return value.encode('utf-8')
+        except UnicodeEncodeError:
+            # Finally try iso8859-1
+            return value.encode('iso8859-1')
+            # Otherwise we allow the exception to percolate up and we cause
+            # a reject as someone is playing silly buggers
+
+class MetadataImporter(object):
+    """
+    Imports the metadata of many DBBinary or DBSource objects with a
+    single INSERT statement per table and batch.
+
+    Metadata of added objects is kept in memory until L{flush} is called
+    or C{batch_size} rows are pending.  Until then it is not visible in
+    the database, not even to the session it is imported with.
+    """
+    def __init__(self, session, batch_size=10000):
+        self.session = session
+        self.batch_size = batch_size
+        self.clear()
+
+    def add(self, obj):
+        """
+        Queue the metadata of C{obj}.  The object must have been flushed
+        to the database already.
+
+        @type  obj: L{DBBinary} or L{DBSource}
+        @param obj: package to import the metadata of
+        """
+        fields = obj.read_control_fields()
+        key_ids = get_metadata_key_ids(fields.keys(), self.session)
+        if isinstance(obj, DBBinary):
+            pending, obj_id = self.binaries, obj.binary_id
+        else:
+            pending, obj_id = self.sources, obj.source_id
+        for k in fields.keys():
+            pending.append((obj_id, key_ids[k], _encode_metadata_value(fields[k])))
+
+        if len(self.binaries) + len(self.sources) >= self.batch_size:
+            self.flush()
+
+    def _insert(self, table, column, rows):
+        # A list of parameter sets would be run as executemany(), that is
+        # one INSERT per row; pass the rows as arrays instead.
+        ids, key_ids, values = zip(*rows)
+        self.session.execute("""
+            INSERT INTO {0} ({1}, key_id, value)
+            SELECT * FROM UNNEST(CAST(:ids AS INTEGER[]), CAST(:key_ids AS INTEGER[]), CAST(:values AS TEXT[]))
+            """.format(table, column),
+            {'ids': list(ids), 'key_ids': list(key_ids), 'values': list(values)})
+
+    def flush(self):
+        """insert all pending metadata"""
+        if self.binaries:
+            self._insert('binaries_metadata', 'bin_id', self.binaries)
+        if self.sources:
+            self._insert('source_metadata', 'src_id', self.sources)
+        self.clear()
+
+    def clear(self):
+        """forget pending metadata without inserting it"""
+        self.binaries = []
+        self.sources = []
+
+__all__.append('MetadataImporter')
+
 @session_wrapper
 def import_metadata_into_db(obj, session=None):
     """
     This routine works on either DBBinary or DBSource objects and imports
     their metadata into the database
     """
-    fields = obj.read_control_fields()
-    for k in fields.keys():
-        try:
-            # Try raw ASCII
-            val = str(fields[k])
-        except UnicodeEncodeError:
-            # Fall back to UTF-8
-            try:
-                val = fields[k].encode('utf-8')
-            except UnicodeEncodeError:
-                # Finally try iso8859-1
-                val = fields[k].encode('iso8859-1')
-                # Otherwise we allow the exception to percolate up and we cause
-                # a reject as someone is playing silly buggers
-
-        obj.metadata[get_or_set_metadatakey(k, session)] = val
+    importer = MetadataImporter(session)
+    importer.add(obj)
+    importer.flush()
 
     session.commit_or_flush()
 
@@ -2044,6 +2083,47 @@ def get_or_set_metadatakey(keyname, session=None):
 
 __all__.append('get_or_set_metadatakey')
 
+_metadata_key_ids = {}
+
+def get_metadata_key_ids(keynames, session):
+    """
+    Returns the ids of the given metadata keys.
+
+    Missing keys are added in a separate transaction which is committed
+    immediately, so the ids can be remembered for the lifetime of the
+    process even if C{session} is rolled back later.
+
+    @type keynames: iterable
+    @param keynames: names of the keys
+
+    @type session: SQLAlchemy
+    @param session: SQL session object
+
+    @rtype: dict
+    @return: key_id for each key name
+    """
+    missing = set(keynames) - set(_metadata_key_ids)
+    if missing:
+        query = "SELECT key, key_id FROM metadata_keys WHERE key = ANY(:keys)"
+        _metadata_key_ids.update(session.execute(query, {'keys': list(missing)}).fetchall())
+        missing.difference_update(_metadata_key_ids)
+    if missing:
+        key_session = DBConn().session()
+        try:
+            for keyname in missing:
+                try:
+                    get_or_set_metadatakey(keyname, key_session)
+                    key_session.commit()
+                except IntegrityError:
+                    # somebody else added the same key
+                    key_session.rollback()
+        finally:
+            key_session.close()
+        _metadata_key_ids.update(session.execute(query, {'keys': list(missing)}).fetchall())
+    return dict((keyname, _metadata_key_ids[keyname]) for keyname in keynames)
+
+__all__.append('get_metadata_key_ids')
+
 ################################################################################
 
 class BinaryMetadata(ORMObject):
@@ -0,0 +1,215 @@
+"""read the contents of binary packages without calling dpkg-deb
+
+A .deb is an ar archive whose data.tar member is read and decompressed
+in-process.  gzip and bzip2 are handled by the tarfile module; for xz
+and zstd the data is fed to the decompressor through a pipe as there
+are no Python modules for them.
+
+@copyright: 2026, Debian FTP Master <ftpmaster@debian.org>
+@license: GPL-2+
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from contextlib import closing
+from os.path import normpath
+import subprocess
+import tarfile
+import threading
+
+import daklib.daksubprocess
+
+class DebFileError(Exception):
+    pass
+
+AR_MAGIC = '!<arch>\n'
+
+def ar_members(fh):
+    """iterate over the members of an ar archive
+
+    After each member is yielded, C{fh} is positioned at the start of
+    its data.
+
+    @type  fh: file object
+    @param fh: seekable file object
+
+    @return: generator yielding (name, size) tuples
+    """
+    fh.seek(0)
+    if fh.read(len(AR_MAGIC)) != AR_MAGIC:
+        raise DebFileError("not an ar archive")
+    offset = len(AR_MAGIC)
+    while True:
+        fh.seek(offset)
+        header = fh.read(60)
+        if not header:
+            return
+        if len(header) != 60 or header[58:60] != '`\n':
+            raise DebFileError("invalid ar member header at offset {0}".format(offset))
+        # GNU ar terminates names with a slash
+        name = header[0:16].rstrip(' ')
+        if name.endswith('/'):
+            name = name[:-1]
+        try:
+            size = int(header[48:58])
+        except ValueError:
+            raise DebFileError("invalid ar member size at offset {0}".format(offset))
+        yield name, size
+        offset += 60 + size + size % 2
+
+class _LimitedFile(object):
+    """read-only file object for the next C{size} bytes of C{fh}"""
+    def __init__(self, fh, size=None):
+        self.fh = fh
+        self.remaining = size
+
+    def read(self, size=-1):
+        if self.remaining is None:
+            return self.fh.read(size)
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fh.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        pass
+
+class _PipeFile(object):
+    """read-only file object for the output of C{command}
+
+    The input is written to the command by a separate thread.
+    """
+    def __init__(self, command, fh):
+        self.command = command
+        self.process = daklib.daksubprocess.Popen(command,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+        self.thread = threading.Thread(target=self._feed, args=(fh, ))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _feed(self, fh):
+        try:
+            while True:
+                data = fh.read(1024 * 1024)
+                if not data:
+                    break
+                self.process.stdin.write(data)
+        except IOError:
+            # the reader stopped early; close() reports this
+            pass
+        finally:
+            try:
+                self.process.stdin.close()
+            except IOError:
+                pass
+
+    def read(self, size=-1):
+        return self.process.stdout.read(size)
+
+    def close(self):
+        # drain the output so the exit status is meaningful
+        while self.process.stdout.read(1024 * 1024):
+            pass
+        self.process.stdout.close()
+        self.thread.join()
+        returncode = self.process.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, " ".join(self.command))
+
+#: decompressors for data not supported by the tarfile module
+pipe_decompressors = {
+    '.xz': ('xz', '--decompress', '--stdout'),
+    '.lzma': ('xz', '--format=lzma', '--decompress', '--stdout'),
+    '.zst': ('zstd', '--decompress', '--stdout', '--quiet'),
+}
+
+#: stream modes for the tarfile module
+tarfile_modes = {
+    '': 'r|',
+    '.gz': 'r|gz',
+    '.bz2': 'r|bz2',
+}
+
+def iter_tar(fh, compression, size=None):
+    """iterate over the members of a tarball
+
+    As the tarball is read as a stream, the data of a member can only
+    be extracted before the next member is requested.
+
+    @type  fh: file object
+    @param fh: file object positioned at the start of the tarball
+
+    @type  compression: str
+    @param compression: extension of the compression method, for
+                        example C{'.xz'}, or the empty string
+
+    @type  size: int
+    @param size: size of the compressed tarball; C{None} to read until
+                 the end of the file
+
+    @return: generator yielding (tar, member) tuples
+    """
+    data = _LimitedFile(fh, size)
+    if compression in tarfile_modes:
+        mode = tarfile_modes[compression]
+    elif compression in pipe_decompressors:
+        data = _PipeFile(pipe_decompressors[compression], data)
+        mode = 'r|'
+    else:
+        raise DebFileError("unsupported compression: {0}".format(compression))
+    with closing(data):
+        with closing(tarfile.open(fileobj=data, mode=mode)) as tar:
+            for member in tar:
+                yield tar, member
+
+def iter_tar_names(fh, compression, size=None):
+    """iterate over the names of all non-directory members of a tarball
+
+    See L{iter_tar} for the parameters.
+
+    @return: generator yielding names as stored in the tarball
+    """
+    for tar, member in iter_tar(fh, compression, size):
+        if not member.isdir():
+            yield member.name
+
+def normalize_name(name):
+    """normalize a path name and make sure it is valid utf-8
+
+    Names that are not valid utf-8 are assumed to be iso8859-1.
+    """
+    name = normpath(name)
+    try:
+        name.decode('utf-8')
+    except UnicodeDecodeError:
+        name = name.decode('iso8859-1').encode('utf-8')
+    return name
+
+def data_names(filename):
+    """iterate over the contents of a binary package
+
+    @type  filename: str
+    @param filename: name of the .deb or .udeb
+
+    @return: generator yielding normalized names of all non-directories
+    """
+    with open(filename, 'rb') as fh:
+        for name, size in ar_members(fh):
+            if name.startswith('data.tar'):
+                for member in iter_tar_names(fh, name[len('data.tar'):], size):
+                    yield normalize_name(member)
+                return
+    raise DebFileError("{0}: no data.tar member".format(filename))
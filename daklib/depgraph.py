@@ -0,0 +1,316 @@
+"""snapshot of the dependency relations in a suite
+
+Parsing the Depends, Provides and Build-Depends fields of a whole suite
+takes a long time, but the fields of a given binary or source package
+never change.  A L{DependencySnapshot} keeps the parsed relations keyed
+by package id and is stored in C{Dir::Cache}, so it only needs to parse
+the packages added to the suite since it was last updated.
+
+The snapshot is written with L{marshal}: it only contains tuples,
+strings and dicts, which marshal loads much faster than pickle.
+
+@copyright: 2026, Debian FTP Master <ftpmaster@debian.org>
+@license: GPL-2+
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from collections import defaultdict
+import apt_pkg
+import marshal
+import os
+import tempfile
+
+from daklib.config import Config
+from daklib.regexes import re_build_dep_arch
+
+#: version of the on-disk format; snapshots in other formats are ignored
+FORMAT_VERSION = 1
+
+_fingerprint_query = """
+SELECT
+  (SELECT COUNT(*) || ':' || COALESCE(SUM(id), 0) || ':' || COALESCE(MAX(id), 0)
+     FROM bin_associations WHERE suite = :suite_id),
+  (SELECT COUNT(*) || ':' || COALESCE(SUM(id), 0) || ':' || COALESCE(MAX(id), 0)
+     FROM src_associations WHERE suite = :suite_id)
+"""
+
+_binaries_query = """
+SELECT b.id, b.package, a.arch_string, s.source, c.name
+  FROM bin_associations ba
+  JOIN binaries b ON b.id = ba.bin
+  JOIN architecture a ON a.id = b.architecture
+  JOIN source s ON s.id = b.source
+  JOIN files_archive_map af ON af.file_id = b.file AND af.archive_id = :archive_id
+  JOIN component c ON c.id = af.component_id
+ WHERE ba.suite = :suite_id
+"""
+
+_binaries_metadata_query = """
+SELECT bm.bin_id, mk.key, bm.value
+  FROM binaries_metadata bm
+  JOIN metadata_keys mk ON mk.key_id = bm.key_id
+ WHERE bm.bin_id = ANY(:ids) AND mk.key IN ('Depends', 'Provides')
+"""
+
+_sources_query = """
+SELECT s.id, s.source, s.version
+  FROM src_associations sa
+  JOIN source s ON s.id = sa.source
+ WHERE sa.suite = :suite_id
+"""
+
+_sources_metadata_query = """
+SELECT sm.src_id, mk.key, sm.value
+  FROM source_metadata sm
+  JOIN metadata_keys mk ON mk.key_id = sm.key_id
+ WHERE sm.src_id = ANY(:ids) AND mk.key IN ('Build-Depends', 'Build-Depends-Indep')
+"""
+
+def parse_depends(package, depends, provides):
+    """parse the relations of a binary package
+
+    @type  package: str
+    @param package: name of the binary package
+
+    @type  depends: str
+    @param depends: value of the Depends field or C{None}
+
+    @type  provides: str
+    @param provides: value of the Provides field or C{None}
+
+    @rtype:  tuple
+    @return: (depends, provides, error) where depends is C{None} or a
+             tuple of alternatives, each a tuple of package names;
+             provides is a tuple of virtual package names; error is an
+             error message if the Depends field could not be parsed
+    """
+    parsed = None
+    error = None
+    if depends is not None:
+        try:
+            parsed = tuple(tuple(d[0] for d in dep) for dep in apt_pkg.parse_depends(depends))
+        except ValueError as e:
+            error = str(e)
+    virtual = []
+    if provides is not None:
+        for virtual_pkg in provides.split(","):
+            virtual_pkg = virtual_pkg.strip()
+            if virtual_pkg != package:
+                virtual.append(virtual_pkg)
+    return parsed, tuple(virtual), error
+
+def parse_build_depends(value):
+    """parse a Build-Depends or Build-Depends-Indep field
+
+    Architecture restrictions are ignored as breakage on any architecture
+    is of interest.
+
+    @rtype:  tuple
+    @return: (relations, error) where relations is a tuple of
+             alternatives as returned by C{apt_pkg.parse_src_depends},
+             converted to tuples
+    """
+    if value is None:
+        return (), None
+    try:
+        parsed = apt_pkg.parse_src_depends(re_build_dep_arch.sub("", value))
+    except ValueError as e:
+        return (), str(e)
+    return tuple(tuple(tuple(d) for d in dep) for dep in parsed), None
+
+class DependencySnapshot(object):
+    """parsed dependency relations of all packages in a suite
+
+    C{binaries} maps binary ids to tuples (package, architecture, source,
+    component, depends, provides, error) as returned by L{parse_depends}.
+    C{sources} maps source ids to tuples (source, version, build_depends,
+    error, build_depends_indep, error_indep) as returned by
+    L{parse_build_depends}.
+    """
+    def __init__(self, suite, filename=None):
+        """
+        @type  suite: L{daklib.dbconn.Suite}
+        @param suite: suite
+
+        @type  filename: str
+        @param filename: file to keep the snapshot in; C{None} to not
+                         keep it at all
+        """
+        self.suite_id = suite.suite_id
+        self.archive_id = suite.archive_id
+        self.filename = filename
+        self.fingerprint = None
+        self.binaries = {}
+        self.sources = {}
+        self._by_architecture = None
+        if filename is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as fh:
+                data = marshal.load(fh)
+        except (IOError, EOFError, ValueError, TypeError):
+            return
+        if not isinstance(data, tuple) or data[0] != FORMAT_VERSION or data[1] != self.suite_id:
+            return
+        self.fingerprint, self.binaries, self.sources = data[2:]
+        self._by_architecture = None
+
+    def save(self):
+        """write the snapshot to its file
+
+        Other processes see either the old or the new snapshot.
+        """
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmpname = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.filename))
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                marshal.dump((FORMAT_VERSION, self.suite_id, self.fingerprint, self.binaries, self.sources), fh)
+            os.chmod(tmpname, 0o664)
+            os.rename(tmpname, self.filename)
+        except:
+            os.unlink(tmpname)
+            raise
+
+    def refresh(self, session):
+        """update the snapshot to the current state of the suite
+
+        Only packages not in the snapshot yet are parsed.
+
+        @rtype:  bool
+        @return: C{True} if the snapshot changed
+        """
+        params = {'suite_id': self.suite_id, 'archive_id': self.archive_id}
+        fingerprint = tuple(session.execute(_fingerprint_query, params).fetchone())
+        if fingerprint == self.fingerprint:
+            return False
+
+        binaries = {}
+        missing = []
+        for bin_id, package, architecture, source, component in session.execute(_binaries_query, params):
+            entry = self.binaries.get(bin_id)
+            if entry is None:
+                missing.append(bin_id)
+                entry = (None, None, None, None, None, (), None)
+            binaries[bin_id] = (package, architecture, source, component) + entry[4:]
+        for ids in _chunks(missing):
+            fields = defaultdict(dict)
+            for bin_id, key, value in session.execute(_binaries_metadata_query, {'ids': ids}):
+                fields[bin_id][key] = value
+            for bin_id in ids:
+                entry = binaries[bin_id]
+                binaries[bin_id] = entry[:4] + parse_depends(entry[0],
+                    fields[bin_id].get('Depends'), fields[bin_id].get('Provides'))
+
+        sources = {}
+        missing = []
+        for src_id, source, version in session.execute(_sources_query, params):
+            entry = self.sources.get(src_id)
+            if entry is None:
+                missing.append(src_id)
+                entry = (None, None, (), None, (), None)
+            sources[src_id] = (source, version) + entry[2:]
+        for ids in _chunks(missing):
+            fields = defaultdict(dict)
+            for src_id, key, value in session.execute(_sources_metadata_query, {'ids': ids}):
+                fields[src_id][key] = value
+            for src_id in ids:
+                sources[src_id] = sources[src_id][:2] \
+                    + parse_build_depends(fields[src_id].get('Build-Depends')) \
+                    + parse_build_depends(fields[src_id].get('Build-Depends-Indep'))
+
+        self.fingerprint = fingerprint
+        self.binaries = binaries
+        self.sources = sources
+        self._by_architecture = None
+        return True
+
+    def binaries_by_architecture(self, architecture):
+        """
+        @rtype:  list
+        @return: list of (package, source, component, depends, provides,
+                 error) tuples for all binaries of C{architecture}
+        """
+        if self._by_architecture is None:
+            by_architecture = defaultdict(list)
+            for entry in self.binaries.itervalues():
+                by_architecture[entry[1]].append(entry[:1] + entry[2:])
+            self._by_architecture = by_architecture
+        return self._by_architecture.get(architecture, [])
+
+    def source_build_depends(self, newest_only=False, include_indep=True):
+        """
+        @type  newest_only: bool
+        @param newest_only: only include the newest version of each source
+
+        @type  include_indep: bool
+        @param include_indep: include Build-Depends-Indep
+
+        @rtype:  list
+        @return: list of (source, build_depends, error) tuples
+        """
+        entries = self.sources.itervalues()
+        if newest_only:
+            newest = {}
+            for entry in entries:
+                other = newest.get(entry[0])
+                if other is None or apt_pkg.version_compare(entry[1], other[1]) > 0:
+                    newest[entry[0]] = entry
+            entries = newest.itervalues()
+        result = []
+        for source, version, build_depends, error, build_depends_indep, error_indep in entries:
+            if include_indep:
+                build_depends = build_depends + build_depends_indep
+                error = error or error_indep
+            result.append((source, build_depends, error))
+        return result
+
+def _chunks(ids, size=10000):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+_snapshots = {}
+
+def get_dependency_snapshot(session, suite):
+    """get an up-to-date dependency snapshot for a suite
+
+    Snapshots are kept for the lifetime of the process and, if
+    C{Dir::Cache} is set, in C{Dir::Cache/dependency-snapshot}.
+
+    @type  session: SQLAlchemy session
+    @param session: database session
+
+    @type  suite: L{daklib.dbconn.Suite}
+    @param suite: suite
+
+    @rtype:  L{DependencySnapshot}
+    """
+    snapshot = _snapshots.get(suite.suite_id)
+    if snapshot is None:
+        filename = None
+        cache = Config().get('Dir::Cache')
+        if cache:
+            filename = os.path.join(cache, 'dependency-snapshot', suite.suite_name)
+        snapshot = _snapshots[suite.suite_id] = DependencySnapshot(suite, filename)
+    if snapshot.refresh(session) and snapshot.filename is not None:
+        try:
+            snapshot.save()
+        except (IOError, OSError) as e:
+            print "W: Could not save dependency snapshot for %s: %s" % (suite.suite_name, e)
+    return snapshot
@@ -25,10 +25,12 @@ Helper code for file writing with optional compression.
 
 ################################################################################
 
-from daklib.daksubprocess import check_call
+import daklib.daksubprocess
+from daklib.hashcache import MultiHash
 
 import errno
 import os, os.path
+import subprocess
 
 class CompressionMethod(object):
     def __init__(self, keyword, extension, command):
@@ -40,11 +42,29 @@ _compression_methods = (
     CompressionMethod('bzip2', '.bz2', ['bzip2', '-9']),
     CompressionMethod('gzip', '.gz', ['gzip', '-9cn', '--rsyncable', '--no-name']),
     CompressionMethod('xz', '.xz', ['xz', '-c']),
-    # 'none' must be the last compression method as BaseFileWriter
-    # handling it will remove the input file for other compressions
     CompressionMethod('none', '', None),
 )
 
+class _TeeFile(object):
+    '''
+    Minimal file-like object passing everything written to it on to
+    several other file objects.
+    '''
+    def __init__(self, files):
+        self.files = files
+
+    def write(self, data):
+        for f in self.files:
+            f.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
 class BaseFileWriter(object):
     '''
     Base class for compressed and uncompressed file writing.
@@ -59,52 +79,78 @@ class BaseFileWriter(object):
         '''
         self.compression = keywords.get('compression', ['none'])
         self.path = template % keywords
+        self.uncompressed_hashes = None
 
     def open(self):
         '''
         Returns a file object for writing.
+
+        Everything written to it is fed to all configured compressors at
+        the same time, so all output files are complete once the
+        returned object is closed by close().  Size and hashes of the
+        uncompressed data are available as uncompressed_hashes after
+        close().
         '''
         # create missing directories
         try:
             os.makedirs(os.path.dirname(self.path))
         except:
             pass
-        self.file = open(self.path + '.new', 'w')
+        self.processes = []
+        self.multihash = MultiHash()
+        outputs = [self.multihash]
+        for method in _compression_methods:
+            if method.keyword not in self.compression:
+                continue
+            filename = "{0}{1}.new".format(self.path, method.extension)
+            if method.command is None:
+                outputs.append(open(filename, 'w'))
+            else:
+                with open(filename, 'w') as out_fh:
+                    process = daklib.daksubprocess.Popen(method.command,
+                        stdin=subprocess.PIPE, stdout=out_fh, close_fds=True, bufsize=-1)
+                self.processes.append((method.command, process))
+                outputs.append(process.stdin)
+        self.file = _TeeFile(outputs)
         return self.file
 
+    def output_files(self):
+        '''
+        Returns the names of all files that close() will produce.
+        '''
+        return ["{0}{1}".format(self.path, method.extension)
+                for method in _compression_methods
+                if method.keyword in self.compression]
+
     # internal helper function
     def rename(self, filename):
         tempfilename = filename + '.new'
         os.chmod(tempfilename, 0o644)
         os.rename(tempfilename, filename)
 
-    # internal helper function to compress output
-    def compress(self, cmd, suffix, path):
-        in_filename = "{0}.new".format(path)
-        out_filename = "{0}{1}.new".format(path, suffix)
-        if cmd is not None:
-            with open(in_filename, 'r') as in_fh, open(out_filename, 'w') as out_fh:
-                check_call(cmd, stdin=in_fh, stdout=out_fh, close_fds=True)
-        self.rename("{0}{1}".format(path, suffix))
-
     def close(self):
         '''
-        Closes the file object and does the compression and rename work.
+        Closes the file object, waits for the compressors to finish and
+        does the rename work.
         '''
         self.file.close()
+        for command, process in self.processes:
+            returncode = process.wait()
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, command)
+        self.uncompressed_hashes = self.multihash.result()
         for method in _compression_methods:
+            filename = "{0}{1}".format(self.path, method.extension)
             if method.keyword in self.compression:
-                self.compress(method.command, method.extension, self.path)
+                self.rename(filename)
             else:
                 # Try removing the file that would be generated.
                 # It's not an error if it does not exist.
                 try:
-                    os.unlink("{0}{1}".format(self.path, method.extension))
+                    os.unlink(filename)
                 except OSError as e:
                     if e.errno != errno.ENOENT:
                         raise
-        else:
-            os.unlink(self.path + '.new')
 
 class BinaryContentsFileWriter(BaseFileWriter):
     def __init__(self, **keywords):
@@ -17,9 +17,35 @@
 """Transactions for filesystem actions
 """
 
+import errno
+import fcntl
 import os
 import shutil
 
+#: ioctl to share the data of a file with another file (Linux)
+FICLONE = 0x40049409
+
+def clone_file(source, destination):
+    """copy C{source} to C{destination}, sharing data if possible
+
+    On filesystems that support it (e.g. btrfs, XFS), the copy shares its
+    data blocks with C{source} until either file is changed (a reflink), so
+    no data needs to be copied.  Otherwise the data is copied as usual.
+    As with C{shutil.copy2}, the permissions and timestamps are copied too.
+
+    Unlike a hardlink, C{destination} is a file of its own: changes to
+    either file (including its permissions) do not affect the other one.
+    """
+    with open(source, 'rb') as src:
+        with open(destination, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS):
+                    raise
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+    shutil.copystat(source, destination)
+
 class _FilesystemAction(object):
     @property
     def temporary_name(self):
@@ -33,7 +59,7 @@ class _FilesystemAction(object):
             pass
 
 class _FilesystemCopyAction(_FilesystemAction):
-    def __init__(self, source, destination, link=True, symlink=False, mode=None):
+    def __init__(self, source, destination, link=True, symlink=False, mode=None, reflink=False):
         self.destination = destination
         self.need_cleanup = False
 
@@ -50,15 +76,20 @@ class _FilesystemCopyAction(_FilesystemAction):
         destdir = os.path.dirname(self.destination)
         if not os.path.exists(destdir):
             os.makedirs(destdir, dirmode)
+        if reflink:
+            copy = clone_file
+        else:
+            copy = shutil.copy2
+
         if symlink:
             os.symlink(source, self.destination)
         elif link:
             try:
                 os.link(source, self.destination)
             except OSError:
-                shutil.copy2(source, self.destination)
+                copy(source, self.destination)
         else:
-            shutil.copy2(source, self.destination)
+            copy(source, self.destination)
 
         self.need_cleanup = True
         if mode is not None:
@@ -121,7 +152,7 @@ class FilesystemTransaction(object):
     def __init__(self):
         self.actions = []
 
-    def copy(self, source, destination, link=False, symlink=False, mode=None):
+    def copy(self, source, destination, link=False, symlink=False, mode=None, reflink=False):
         """copy C{source} to C{destination}
 
         @type  source: str
@@ -138,11 +169,15 @@ class FilesystemTransaction(object):
 
         @type  mode: int
         @param mode: permissions to change C{destination} to
+
+        @type  reflink: bool
+        @param reflink: share data with C{source} instead of copying it if
+                        the filesystem supports it (see L{clone_file})
         """
         if isinstance(mode, str) or isinstance(mode, unicode):
             mode = int(mode, 8)
 
-        self.actions.append(_FilesystemCopyAction(source, destination, link=link, symlink=symlink, mode=mode))
+        self.actions.append(_FilesystemCopyAction(source, destination, link=link, symlink=symlink, mode=mode, reflink=reflink))
 
     def move(self, source, destination, mode=None):
         """move C{source} to C{destination}
@@ -22,8 +22,12 @@
 import apt_pkg
 import datetime
 import fcntl
+import hashlib
 import os
 import select
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import daklib.daksubprocess
 
@@ -32,9 +36,111 @@ try:
 except:
     _MAXFD = 256
 
+#: maximum number of remembered verification results; raised to the size
+#: of the last batch passed to L{verify_signed_files}
+CACHE_SIZE = 1000
+
+#: remembered results, least recently used first
+_verification_cache = OrderedDict()
+_verification_cache_lock = threading.Lock()
+_batch_size = 0
+
 class GpgException(Exception):
     pass
 
+def _cache_key(data, keyrings, gpg):
+    """key for the verification cache
+
+    The key covers the signed data and the state of all keyrings, so
+    changes to a keyring invalidate earlier results.
+    """
+    state = []
+    for keyring in keyrings:
+        try:
+            st = os.stat(keyring)
+            state.append((keyring, st.st_size, st.st_mtime, st.st_ino))
+        except OSError:
+            state.append((keyring, None, None, None))
+    return (hashlib.sha1(data).hexdigest(), gpg, tuple(state))
+
+def export_verifications(keys):
+    """get remembered verification results
+
+    The results can be passed to L{import_verifications} in another
+    process, for example a worker of a process pool.
+
+    @type  keys: sequence
+    @param keys: cache keys as found in L{SignedFile.cache_key}
+
+    @rtype:  dict
+    @return: remembered results for (some of) C{keys}
+    """
+    with _verification_cache_lock:
+        return dict((key, _verification_cache[key]) for key in keys if key in _verification_cache)
+
+def import_verifications(verifications):
+    """remember verification results exported by L{export_verifications}
+
+    The least recently used results are forgotten when there are too many.
+    """
+    with _verification_cache_lock:
+        for key, result in verifications.iteritems():
+            _verification_cache.pop(key, None)
+            _verification_cache[key] = result
+        limit = max(CACHE_SIZE, _batch_size)
+        while len(_verification_cache) > limit:
+            _verification_cache.popitem(last=False)
+
+def _lookup_verification(key):
+    """get a remembered result and mark it as recently used"""
+    with _verification_cache_lock:
+        result = _verification_cache.pop(key, None)
+        if result is not None:
+            _verification_cache[key] = result
+        return result
+
+def verify_signed_files(datas, keyrings, threads=4, gpg="/usr/bin/gpg"):
+    """verify signatures of many messages at once
+
+    Runs several instances of gpg concurrently and remembers their results,
+    so later L{SignedFile} objects for the same messages and keyrings do
+    not need to run gpg again.  Errors are only reported when these
+    L{SignedFile} objects are created.
+
+    @type  datas: sequence
+    @param datas: strings containing the messages
+
+    @type  keyrings: sequence
+    @param keyrings: keyrings to verify the signatures with
+
+    @type  threads: int
+    @param threads: number of gpg processes to run in parallel
+    """
+    global _batch_size
+    # all results of this batch must still be there when they are used
+    _batch_size = len(datas)
+
+    missing = {}
+    for data in datas:
+        key = _cache_key(data, keyrings, gpg)
+        if _lookup_verification(key) is None:
+            missing[key] = data
+    if len(missing) == 0:
+        return
+
+    def verify(data):
+        try:
+            SignedFile(data, keyrings, require_signature=False, gpg=gpg)
+        except GpgException:
+            pass
+
+    pool = ThreadPool(threads)
+    try:
+        pool.map(verify, missing.values())
+    finally:
+        pool.close()
+        pool.join()
+
 class _Pipe(object):
     """context manager for pipes
 
@@ -68,6 +174,11 @@ class SignedFile(object):
       weak_signature      - signature uses a weak algorithm (e.g. SHA-1)
       fingerprint         - fingerprint of the key used for signing
       primary_fingerprint - fingerprint of the primary key associated to the key used for signing
+      cache_key           - key of the verification result in the verification cache
+
+    Verification results are remembered for the lifetime of the process (see
+    L{verify_signed_files}), so verifying the same message with unchanged
+    keyrings again does not run gpg.
     """
     def __init__(self, data, keyrings, require_signature=True, gpg="/usr/bin/gpg"):
         """
@@ -105,6 +216,35 @@ class SignedFile(object):
         return self.signature_ids[0]
 
     def _verify(self, data, require_signature):
+        self.cache_key = _cache_key(data, self.keyrings, self.gpg)
+        result = _lookup_verification(self.cache_key)
+        if result is None:
+            result = self._run_gpg(data)
+            import_verifications({self.cache_key: result})
+
+        (exit_code, self.contents, self.status, self.stderr) = result
+
+        if self.status == "":
+            raise GpgException("No status output from GPG. (GPG exited with status code %s)\n%s" % (exit_code, self.stderr))
+
+        for line in self.status.splitlines():
+            self._parse_status(line)
+
+        if self.invalid:
+            self.valid = False
+
+        if require_signature and not self.valid:
+            raise GpgException("No valid signature found. (GPG exited with status code %s)\n%s" % (exit_code, self.stderr))
+
+        assert len(self.fingerprints) == len(self.primary_fingerprints)
+        assert len(self.fingerprints) == len(self.signature_ids)
+
+    def _run_gpg(self, data):
+        """run gpg to verify C{data}
+
+        @rtype:  tuple
+        @return: (exit_code, contents, status, stderr)
+        """
         with _Pipe() as stdin:
          with _Pipe() as contents:
           with _Pipe() as status:
@@ -123,24 +263,7 @@ class SignedFile(object):
 
                 (pid_, exit_code, usage_) = os.wait4(pid, 0)
 
-                self.contents = read[contents.r]
-                self.status   = read[status.r]
-                self.stderr   = read[stderr.r]
-
-                if self.status == "":
-                    raise GpgException("No status output from GPG. (GPG exited with status code %s)\n%s" % (exit_code, self.stderr))
-
-                for line in self.status.splitlines():
-                    self._parse_status(line)
-
-                if self.invalid:
-                    self.valid = False
-
-                if require_signature and not self.valid:
-                    raise GpgException("No valid signature found. (GPG exited with status code %s)\n%s" % (exit_code, self.stderr))
-
-        assert len(self.fingerprints) == len(self.primary_fingerprints)
-        assert len(self.fingerprints) == len(self.signature_ids)
+                return (exit_code, read[contents.r], read[status.r], read[stderr.r])
 
     def _do_io(self, read, write):
         for fd in write.keys():
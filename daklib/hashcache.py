@@ -0,0 +1,213 @@
+"""cache sizes and hashes of index files
+
+@copyright: 2026, Debian FTP Master <ftpmaster@debian.org>
+@license: GPL-2+
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import hashlib
+import os
+
+#: hash algorithms, named as in C{suite.checksums}
+HASH_NAMES = ('md5sum', 'sha1', 'sha256')
+
+def stat_mtime(st):
+    """
+    @rtype:  int
+    @return: modification time from C{st} in microseconds
+
+    Modification times are stored as integers: before PostgreSQL 12,
+    floating point values are returned with only 15 significant digits
+    and sub-second times would never compare equal again.
+    """
+    return int(round(st.st_mtime * 1000000))
+
+_hashlib_names = {
+    'md5sum': 'md5',
+    'sha1': 'sha1',
+    'sha256': 'sha256',
+}
+
+class MultiHash(object):
+    """compute size and all hashes in C{HASH_NAMES} in a single pass
+
+    Can be used as a file-like object for writing.
+    """
+    def __init__(self):
+        self.size = 0
+        self._hashes = dict((name, hashlib.new(_hashlib_names[name])) for name in HASH_NAMES)
+
+    def update(self, data):
+        self.size += len(data)
+        for h in self._hashes.itervalues():
+            h.update(data)
+
+    write = update
+
+    def close(self):
+        pass
+
+    def result(self):
+        """get size and hashes
+
+        @rtype:  dict
+        @return: dict mapping C{'size'} and the names in C{HASH_NAMES}
+                 to the respective values
+        """
+        result = dict((name, h.hexdigest()) for name, h in self._hashes.iteritems())
+        result['size'] = self.size
+        return result
+
+def hash_fileobj(fh, blocksize=1024*1024):
+    """hash the remaining content of a file object
+
+    @type  fh: file-like object
+    @param fh: file object to read from
+
+    @rtype:  dict
+    @return: see L{MultiHash.result}
+    """
+    multihash = MultiHash()
+    while True:
+        data = fh.read(blocksize)
+        if not data:
+            break
+        multihash.update(data)
+    return multihash.result()
+
+class HashCache(object):
+    """persistent cache of file sizes and hashes
+
+    Entries are stored in the C{file_hash_cache} table and are keyed on
+    the file's path.  They are only considered valid as long as inode,
+    size and mtime of the file they were computed from (the I{stat path})
+    are unchanged.  The stat path differs from the path for uncompressed
+    variants of indices that only exist in compressed form: their hashes
+    are bound to the compressed file instead.
+    """
+    def __init__(self, session, prefix=None):
+        """
+        @type  session: SQLAlchemy session
+        @param session: database session
+
+        @type  prefix: str
+        @param prefix: preload all entries for paths starting with this
+        """
+        self.session = session
+        self._entries = {}
+        self._pending = {}
+        if prefix is not None:
+            query = """
+                SELECT path, stat_path, inode, stat_size, mtime, size, md5sum, sha1, sha256
+                FROM file_hash_cache
+                WHERE LEFT(path, LENGTH(:prefix)) = :prefix"""
+            prefix = os.path.normpath(prefix)
+            for row in session.execute(query, {'prefix': prefix}):
+                self._entries[row[0]] = row[1:]
+
+    @staticmethod
+    def _stat_key(stat_path):
+        try:
+            st = os.stat(stat_path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, stat_mtime(st))
+
+    def _load(self, path):
+        query = """
+            SELECT stat_path, inode, stat_size, mtime, size, md5sum, sha1, sha256
+            FROM file_hash_cache WHERE path = :path"""
+        return self.session.execute(query, {'path': path}).fetchone()
+
+    def get(self, path):
+        """get cached size and hashes
+
+        @type  path: str
+        @param path: absolute path
+
+        @rtype:  dict or C{None}
+        @return: see L{MultiHash.result}; C{None} if there is no valid entry
+        """
+        path = os.path.normpath(path)
+        if path in self._entries:
+            entry = self._entries[path]
+        else:
+            entry = self._load(path)
+        if entry is None:
+            return None
+        stat_path, inode, stat_size, mtime = entry[:4]
+        if self._stat_key(stat_path) != (inode, stat_size, mtime):
+            return None
+        result = dict(zip(HASH_NAMES, entry[5:]))
+        result['size'] = entry[4]
+        return result
+
+    def set(self, path, result, stat_path=None):
+        """remember size and hashes for C{path}
+
+        Entries are only written to the database by L{flush}.
+
+        @type  path: str
+        @param path: absolute path
+
+        @type  result: dict
+        @param result: see L{MultiHash.result}
+
+        @type  stat_path: str
+        @param stat_path: file the hashes were computed from; defaults
+                          to C{path}
+        """
+        path = os.path.normpath(path)
+        if stat_path is None:
+            stat_path = path
+        stat_path = os.path.normpath(stat_path)
+        stat_key = self._stat_key(stat_path)
+        if stat_key is None:
+            return
+        entry = (stat_path, ) + stat_key + (result['size'], ) + tuple(result[name] for name in HASH_NAMES)
+        self._entries[path] = self._pending[path] = entry
+
+    def set_from_writer(self, writer):
+        """remember the uncompressed hashes recorded by a file writer
+
+        @type  writer: L{daklib.filewriter.BaseFileWriter}
+        @param writer: closed file writer
+        """
+        if writer.uncompressed_hashes is None:
+            return
+        output_files = writer.output_files()
+        if writer.path in output_files:
+            stat_path = writer.path
+        else:
+            stat_path = output_files[0]
+        self.set(writer.path, writer.uncompressed_hashes, stat_path)
+
+    def flush(self):
+        """write new entries to the database
+
+        The caller is responsible for committing the transaction.
+        """
+        if not self._pending:
+            return
+        # TODO [sqlalchemy >= 1.1]: use `ON CONFLICT DO UPDATE`
+        self.session.execute("DELETE FROM file_hash_cache WHERE path = ANY(:paths)",
+                             {'paths': list(self._pending)})
+        self.session.execute("""
+            INSERT INTO file_hash_cache (path, stat_path, inode, stat_size, mtime, size, md5sum, sha1, sha256)
+            VALUES (:path, :stat_path, :inode, :stat_size, :mtime, :size, :md5sum, :sha1, :sha256)""",
+            [dict(zip(('path', 'stat_path', 'inode', 'stat_size', 'mtime', 'size') + HASH_NAMES, (path, ) + entry))
+             for path, entry in self._pending.iteritems()])
+        self._pending = {}
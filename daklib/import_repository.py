@@ -69,22 +69,33 @@ class File(object):
     def hashes(self):
         return apt_pkg.Hashes(self.fh())
 
+class LocalFile(File):
+    """File in a local mirror
+
+    The file is used in place instead of copying it to a temporary file.
+    """
+    def __init__(self, path):
+        self._tmp = open(path, 'r')
+
 def obtain_file(base, path):
     """Obtain a file 'path' located below 'base'
 
+    Files below a local 'base' (a path or a file:// URL) are used in place.
+
     Returns: daklib.import_repository.File
 
     Note: return type can still change
     """
     fn = '{0}/{1}'.format(base, path)
-    tmp = File()
     if fn.startswith('http://'):
+        tmp = File()
         fh = urllib2.urlopen(fn, timeout=300)
         shutil.copyfileobj(fh, tmp._tmp)
         fh.close()
+    elif fn.startswith('file://'):
+        tmp = LocalFile(fn[len('file://'):])
     else:
-        with open(fn, 'r') as fh:
-            shutil.copyfileobj(fh, tmp._tmp)
+        tmp = LocalFile(fn)
     return tmp
 
 def obtain_release(base, suite_name, keyring, fingerprint=None):
@@ -132,17 +143,15 @@ def obtain_release_file(release, filename):
 
     return tmp
 
-def import_source_to_archive(base, entry, transaction, archive, component):
-    """Import source package described by 'entry' into the given 'archive' and 'component'
-
-    'entry' needs to be a dict-like object with at least the following
-    keys as used in a Sources index: Directory, Files, Checksums-Sha1,
-    Checksums-Sha256
+def obtain_source_files(base, entry):
+    """Obtain and verify the files of the source package described by 'entry'
 
-    Return: daklib.dbconn.DBSource
+    This does not use the database and can run in a separate thread.
 
+    Returns: (directory, hashed_files, files) where 'files' are the
+    daklib.import_repository.File objects which must be kept until the
+    source package is imported
     """
-    # Obtain and verify files
     if not daklib.regexes.re_file_safe_slash.match(entry['Directory']):
         raise Exception("Unsafe path in Directory field")
     hashed_files = daklib.upload.parse_file_list(entry, False)
@@ -153,6 +162,25 @@ def import_source_to_archive(base, entry, transaction, archive, component):
         f.check_fh(tmp.fh())
         files.append(tmp)
         directory, f.input_filename = os.path.split(tmp.fh().name)
+    return directory, hashed_files, files
+
+def import_source_to_archive(base, entry, transaction, archive, component, obtained=None):
+    """Import source package described by 'entry' into the given 'archive' and 'component'
+
+    'entry' needs to be a dict-like object with at least the following
+    keys as used in a Sources index: Directory, Files, Checksums-Sha1,
+    Checksums-Sha256
+
+    'obtained' can give the result of obtain_source_files if the files
+    were already obtained.
+
+    Return: daklib.dbconn.DBSource
+
+    """
+    # Obtain and verify files
+    if obtained is None:
+        obtained = obtain_source_files(base, entry)
+    directory, hashed_files, files = obtained
 
     # Inject files into archive
     source = daklib.upload.Source(directory, hashed_files.values(), [], require_signature=False)
@@ -169,21 +197,38 @@ def import_source_to_archive(base, entry, transaction, archive, component):
 
     return db_source
 
-def import_package_to_suite(base, entry, transaction, suite, component):
+def obtain_package_file(base, entry):
+    """Obtain and verify the file of the binary package described by 'entry'
+
+    This does not use the database and can run in a separate thread.
+
+    Returns: (directory, hashedfile, tmp) where 'tmp' is the
+    daklib.import_repository.File which must be kept until the binary
+    package is imported
+    """
+    filename = entry['Filename']
+    tmp = obtain_file(base, filename)
+    directory, fn = os.path.split(tmp.fh().name)
+    hashedfile = daklib.upload.HashedFile(os.path.basename(filename), long(entry['Size']), entry['MD5sum'], entry['SHA1'], entry['SHA256'], input_filename=fn)
+    hashedfile.check_fh(tmp.fh())
+    return directory, hashedfile, tmp
+
+def import_package_to_suite(base, entry, transaction, suite, component, obtained=None):
     """Import binary package described by 'entry' into the given 'suite' and 'component'
 
     'entry' needs to be a dict-like object with at least the following
     keys as used in a Packages index: Filename, Size, MD5sum, SHA1,
     SHA256
 
+    'obtained' can give the result of obtain_package_file if the file
+    was already obtained.
+
     Returns: daklib.dbconn.DBBinary
     """
     # Obtain and verify file
-    filename = entry['Filename']
-    tmp = obtain_file(base, filename)
-    directory, fn = os.path.split(tmp.fh().name)
-    hashedfile = daklib.upload.HashedFile(os.path.basename(filename), long(entry['Size']), entry['MD5sum'], entry['SHA1'], entry['SHA256'], input_filename=fn)
-    hashedfile.check_fh(tmp.fh())
+    if obtained is None:
+        obtained = obtain_package_file(base, entry)
+    directory, hashedfile, tmp = obtained
 
     # Inject file into archive
     binary = daklib.upload.Binary(directory, hashedfile)
@@ -192,7 +237,7 @@ def import_package_to_suite(base, entry, transaction, suite, component):
 
     return db_binary
 
-def import_source_to_suite(base, entry, transaction, suite, component):
+def import_source_to_suite(base, entry, transaction, suite, component, obtained=None):
     """Import source package described by 'entry' into the given 'suite' and 'component'
 
     'entry' needs to be a dict-like object with at least the following
@@ -201,7 +246,7 @@ def import_source_to_suite(base, entry, transaction, suite, component):
 
     Returns: daklib.dbconn.DBBinary
     """
-    source = import_source_to_archive(base, entry, transaction, suite.archive, component)
+    source = import_source_to_archive(base, entry, transaction, suite.archive, component, obtained)
     source.suites.append(suite)
     transaction.flush()
 
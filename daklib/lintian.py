@@ -46,6 +46,11 @@
 
 ################################################################################
 
+import hashlib
+import os
+import tempfile
+import time
+
 from regexes import re_parse_lintian
 
 def parse_lintian_output(output):
@@ -113,3 +118,98 @@ def generate_reject_messages(parsed_tags, tag_definitions, log=lambda *args: arg
                    "override this lintian tag." % tag
             else:
                 log("auto rejecting", "not overridable", tag_name)
+
+def lintian_cache_key(files, tags, lintian='/usr/bin/lintian'):
+    """
+    Returns the key under which the lintian results for an upload are
+    remembered.
+
+    The key covers the checksums of all files of the upload, the tags
+    lintian is asked to check for and the installed lintian version (by
+    way of the size and mtime of the lintian executable).
+
+    @type files: iterable
+    @param files: (filename, sha256sum) for all files including the .changes
+
+    @type tags: iterable
+    @param tags: names of the tags passed to lintian
+
+    @rtype: str
+    @return: hex digest
+    """
+    h = hashlib.sha256()
+    try:
+        st = os.stat(lintian)
+        h.update('lintian {0} {1}\n'.format(st.st_size, st.st_mtime))
+    except OSError:
+        h.update('lintian\n')
+    for filename, sha256sum in sorted(files):
+        h.update('file {0} {1}\n'.format(filename, sha256sum))
+    for tag in sorted(tags):
+        h.update('tag {0}\n'.format(tag))
+    return h.hexdigest()
+
+class LintianCache(object):
+    """
+    Remembers lintian results by L{lintian_cache_key}.
+
+    Results are kept in memory and, if a directory is given, in files in
+    that directory so they survive between runs.  Results older than
+    C{max_age} seconds are ignored and removed.
+    """
+
+    def __init__(self, directory=None, max_age=7 * 86400):
+        self.directory = directory
+        self.max_age = max_age
+        self._results = {}
+
+    def get(self, key):
+        """
+        @rtype: tuple
+        @return: (returncode, output) or C{None} if nothing is known for C{key}
+        """
+        result = self._results.get(key)
+        if result is not None or self.directory is None:
+            return result
+
+        filename = os.path.join(self.directory, key)
+        try:
+            if os.stat(filename).st_mtime < time.time() - self.max_age:
+                return None
+            with open(filename, 'r') as fh:
+                returncode, output = fh.read().split('\n', 1)
+            result = self._results[key] = (int(returncode), output)
+        except (IOError, OSError, ValueError):
+            return None
+        return result
+
+    def put(self, key, returncode, output):
+        """remember the result of a lintian run"""
+        self._results[key] = (returncode, output)
+        if self.directory is None:
+            return
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, prefix='.' + key)
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                fh.write('{0}\n{1}'.format(returncode, output))
+            os.chmod(tmpname, 0o664)
+            os.rename(tmpname, os.path.join(self.directory, key))
+        except:
+            os.unlink(tmpname)
+            raise
+
+    def expire(self):
+        """remove results older than C{max_age} from the directory"""
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        cutoff = time.time() - self.max_age
+        for name in os.listdir(self.directory):
+            filename = os.path.join(self.directory, name)
+            try:
+                if os.stat(filename).st_mtime < cutoff:
+                    os.unlink(filename)
+            except OSError:
+                pass
@@ -0,0 +1,546 @@
+"""generate ed-style patches between index files
+
+The differences are computed in-process on streams of units: stanzas
+for Packages, Sources and Translation files, lines for Contents files.
+Units are compared by their hash; anchors are units that occur exactly
+once in both files (as in patience diff), the gaps between them are
+diffed with Myers' algorithm.  The actual content is only looked at
+again when the ed script is written, which also verifies that units
+considered equal really are equal.
+
+@copyright: 2026, Debian FTP Master <ftpmaster@debian.org>
+@license: GPL-2+
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from array import array
+from bisect import bisect_left
+from contextlib import closing
+import gzip
+import re
+import subprocess
+
+from daklib.compress import open_decompressed
+import daklib.daksubprocess
+from daklib.hashcache import MultiHash
+
+class PDiffError(Exception):
+    pass
+
+re_ed_command = re.compile(r'^(\d+)(?:,(\d+))?([acd])\n$')
+
+def iter_line_blocks(fh, multihash=None, blocksize=1024*1024):
+    """iterate over the lines of a file object, one list per block read
+
+    @type  fh: file-like object
+    @param fh: file object; only read() is used
+
+    @type  multihash: L{daklib.hashcache.MultiHash}
+    @param multihash: optional object to feed all data to
+    """
+    pending = ''
+    while True:
+        data = fh.read(blocksize)
+        if not data:
+            break
+        if multihash is not None:
+            multihash.update(data)
+        lines = (pending + data).split('\n')
+        pending = lines.pop()
+        yield [line + '\n' for line in lines]
+    if pending:
+        yield [pending]
+
+def iter_units(fh, by_stanza=True, multihash=None):
+    """iterate over the units of an index
+
+    @type  fh: file-like object
+    @param fh: uncompressed index
+
+    @type  by_stanza: bool
+    @param by_stanza: if C{True}, a unit is a stanza including the
+                      following empty line; otherwise a unit is a line
+
+    @type  multihash: L{daklib.hashcache.MultiHash}
+    @param multihash: optional object to feed all data to
+
+    @return: generator yielding lists of lines
+    """
+    unit = []
+    for lines in iter_line_blocks(fh, multihash):
+        if not by_stanza:
+            for line in lines:
+                yield [line]
+            continue
+        for line in lines:
+            unit.append(line)
+            if line == '\n':
+                yield unit
+                unit = []
+    if unit:
+        yield unit
+
+class IndexUnits(object):
+    """hashed units of an index file"""
+    def __init__(self, filename, by_stanza=True):
+        """
+        @type  filename: str
+        @param filename: name of the file, compressed or not
+
+        @type  by_stanza: bool
+        @param by_stanza: see L{iter_units}
+        """
+        self.filename = filename
+        self.by_stanza = by_stanza
+        #: hash of each unit
+        self.keys = array('l')
+        #: number of lines in each unit (only when splitting into stanzas)
+        self.line_counts = array('l')
+        self.ends_with_newline = True
+
+        multihash = MultiHash()
+        with closing(open_decompressed(filename)) as fh:
+            if by_stanza:
+                for unit in self.units(fh, multihash):
+                    self.keys.append(hash(''.join(unit)))
+                    self.line_counts.append(len(unit))
+                    self.ends_with_newline = unit[-1].endswith('\n')
+            else:
+                for lines in iter_line_blocks(fh, multihash):
+                    self.keys.extend(map(hash, lines))
+                    self.ends_with_newline = lines[-1].endswith('\n')
+        #: see L{daklib.hashcache.MultiHash.result}
+        self.hashes = multihash.result()
+
+    def units(self, fh, multihash=None):
+        return iter_units(fh, self.by_stanza, multihash)
+
+    def open(self):
+        return closing(open_decompressed(self.filename))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def line_count(self, unit):
+        if self.by_stanza:
+            return self.line_counts[unit]
+        return 1
+
+def _common_affixes(a, alo, ahi, b, blo, bhi):
+    prefix = 0
+    while alo + prefix < ahi and blo + prefix < bhi and a[alo + prefix] == b[blo + prefix]:
+        prefix += 1
+    suffix = 0
+    while alo + prefix < ahi - suffix and blo + prefix < bhi - suffix \
+            and a[ahi - suffix - 1] == b[bhi - suffix - 1]:
+        suffix += 1
+    return prefix, suffix
+
+def _unique_anchors(a, b, modulus):
+    """find units unique in both sequences, keeping only those in order
+
+    Only units whose key is divisible by C{modulus} are considered to
+    limit memory usage for large files; as equal units have equal keys
+    this does not affect uniqueness.
+
+    @return: list of (i, j) with a[i] == b[j], increasing in i and j
+    """
+    def unique_positions(seq):
+        positions = {}
+        for i, key in enumerate(seq):
+            if key % modulus:
+                continue
+            positions[key] = -1 if key in positions else i
+        return positions
+
+    apos = unique_positions(a)
+    bpos = unique_positions(b)
+    candidates = []
+    for i, key in enumerate(a):
+        if key % modulus:
+            continue
+        if apos.get(key, -1) == i:
+            j = bpos.get(key, -1)
+            if j >= 0:
+                candidates.append((i, j))
+    del apos, bpos
+
+    # longest increasing subsequence of the b positions
+    tails = []
+    tail_indices = []
+    predecessors = array('l', [-1]) * len(candidates)
+    for index, (i, j) in enumerate(candidates):
+        pos = bisect_left(tails, j)
+        if pos > 0:
+            predecessors[index] = tail_indices[pos - 1]
+        if pos == len(tails):
+            tails.append(j)
+            tail_indices.append(index)
+        else:
+            tails[pos] = j
+            tail_indices[pos] = index
+    anchors = []
+    index = tail_indices[-1] if tail_indices else -1
+    while index >= 0:
+        anchors.append(candidates[index])
+        index = predecessors[index]
+    anchors.reverse()
+    return anchors
+
+def _myers(a, alo, ahi, b, blo, bhi, max_edits):
+    """match a[alo:ahi] against b[blo:bhi] with Myers' algorithm
+
+    @return: list of (i, j) pairs of matching units in increasing
+             order, or C{None} if more than C{max_edits} edits are needed
+    """
+    n = ahi - alo
+    m = bhi - blo
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, max_edits) + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _myers_backtrack(trace, n, m, alo, blo)
+    return None
+
+def _myers_backtrack(trace, x, y, alo, blo):
+    matches = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((alo + x, blo + y))
+        x, y = prev_x, prev_y
+    matches.reverse()
+    return matches
+
+def matching_blocks(a, b, max_edits=1000, anchor_density=200000):
+    """find matching blocks between two sequences
+
+    The result is not necessarily minimal, but every block is a real
+    match.  Gaps that would need more than C{max_edits} edits are
+    treated as completely replaced.
+
+    @type  a: sequence
+    @param a: old sequence
+
+    @type  b: sequence
+    @param b: new sequence
+
+    @type  max_edits: int
+    @param max_edits: maximum number of edits between two anchors
+
+    @type  anchor_density: int
+    @param anchor_density: maximum number of anchor candidates
+
+    @return: list of (i, j, size) triples like
+             C{difflib.SequenceMatcher.get_matching_blocks}, ending with
+             C{(len(a), len(b), 0)}
+    """
+    blocks = []
+
+    def add(i, j, size=1):
+        if size == 0:
+            return
+        if blocks:
+            pi, pj, psize = blocks[-1]
+            if pi + psize == i and pj + psize == j:
+                blocks[-1] = (pi, pj, psize + size)
+                return
+        blocks.append((i, j, size))
+
+    def match_gap(alo, ahi, blo, bhi):
+        prefix, suffix = _common_affixes(a, alo, ahi, b, blo, bhi)
+        add(alo, blo, prefix)
+        alo += prefix
+        blo += prefix
+        ahi -= suffix
+        bhi -= suffix
+        if alo < ahi and blo < bhi:
+            for i, j in _myers(a, alo, ahi, b, blo, bhi, max_edits) or ():
+                add(i, j)
+        add(ahi, bhi, suffix)
+
+    modulus = max(1, (len(a) + len(b)) // anchor_density)
+    alo = blo = 0
+    for i, j in _unique_anchors(a, b, modulus):
+        match_gap(alo, i, blo, j)
+        add(i, j)
+        alo, blo = i + 1, j + 1
+    match_gap(alo, len(a), blo, len(b))
+
+    blocks.append((len(a), len(b), 0))
+    return blocks
+
+def ed_script(old, new, blocks=None):
+    """create an ed script transforming C{old} into C{new}
+
+    @type  old: L{IndexUnits}
+    @param old: old index
+
+    @type  new: L{IndexUnits}
+    @param new: new index
+
+    @type  blocks: list
+    @param blocks: matching blocks as returned by L{matching_blocks}
+
+    @rtype:  str
+    @return: ed script in the format of C{diff --ed}
+    """
+    if not old.ends_with_newline or not new.ends_with_newline:
+        raise PDiffError("cannot create ed script for files not ending in a newline")
+    if blocks is None:
+        blocks = matching_blocks(old.keys, new.keys)
+
+    hunks = []
+    with old.open() as oldfh, new.open() as newfh:
+        old_units = old.units(oldfh)
+        new_units = new.units(newfh)
+        i = j = 0
+        line = 0
+        for bi, bj, size in blocks:
+            start = line
+            while i < bi:
+                line += old.line_count(i)
+                next(old_units)
+                i += 1
+            lines = []
+            while j < bj:
+                lines.extend(next(new_units))
+                j += 1
+            if start != line or lines:
+                hunks.append((start, line, lines))
+            for offset in range(size):
+                if next(old_units) != next(new_units):
+                    raise PDiffError("hash collision between {0} and {1}".format(old.filename, new.filename))
+                line += old.line_count(i)
+                i += 1
+                j += 1
+
+    return format_ed_script(hunks)
+
+def format_ed_script(hunks):
+    """format hunks as an ed script
+
+    @type  hunks: list of tuple
+    @param hunks: list of C{(start, end, lines)} in increasing order,
+                  replacing the lines C{start:end} (counting from zero)
+                  of the old file by C{lines}
+
+    @rtype:  str
+    @return: ed script in the format of C{diff --ed}
+    """
+    script = []
+    for start, end, lines in reversed(hunks):
+        if '.\n' in lines:
+            raise PDiffError("ed scripts cannot contain lines consisting of a single dot")
+        if end == start:
+            script.append("{0}a\n".format(start))
+        else:
+            if end == start + 1:
+                lines_range = "{0}".format(end)
+            else:
+                lines_range = "{0},{1}".format(start + 1, end)
+            script.append("{0}{1}\n".format(lines_range, "c" if lines else "d"))
+        if lines:
+            script.extend(lines)
+            script.append(".\n")
+    return "".join(script)
+
+def parse_ed_script(script):
+    """parse an ed script as written by L{format_ed_script}
+
+    @type  script: str
+    @param script: ed script
+
+    @rtype:  list of tuple
+    @return: hunks as expected by L{format_ed_script}
+    """
+    hunks = []
+    commands = iter(script.splitlines(True))
+    for command in commands:
+        match = re_ed_command.match(command)
+        if match is None:
+            raise PDiffError("unsupported ed command: {0!r}".format(command))
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        action = match.group(3)
+        lines = []
+        if action in 'ac':
+            for line in commands:
+                if line == '.\n':
+                    break
+                lines.append(line)
+            else:
+                raise PDiffError("unterminated ed command: {0!r}".format(command))
+        if action == 'a':
+            hunks.append((first, first, lines))
+        else:
+            hunks.append((first - 1, last, lines))
+    hunks.reverse()
+    for (start, end, lines), (next_start, next_end, next_lines) in zip(hunks, hunks[1:]):
+        if end > next_start:
+            raise PDiffError("ed script does not modify the file from end to start")
+    return hunks
+
+def _hunks_to_segments(hunks):
+    """describe the result of applying C{hunks} as a list of segments
+
+    A segment is either C{(start, length)}, referring to lines of the
+    original file, or a list of new lines.  The last segment is always
+    C{(start, None)}, standing for the rest of the original file.
+    """
+    segments = []
+    pos = 0
+    for start, end, lines in hunks:
+        if start > pos:
+            segments.append((pos, start - pos))
+        if lines:
+            segments.append(lines)
+        pos = end
+    segments.append((pos, None))
+    return segments
+
+def _segments_to_hunks(segments):
+    hunks = []
+    pos = 0
+    pending = []
+    for segment in segments:
+        if isinstance(segment, list):
+            pending.extend(segment)
+            continue
+        start, length = segment
+        if start != pos or pending:
+            hunks.append((pos, start, pending))
+            pending = []
+        if length is None:
+            break
+        pos = start + length
+    return hunks
+
+def compose_hunks(first, second):
+    """combine two patches into a single one
+
+    Applying the result is equivalent to applying C{first} and then
+    C{second}.  The original file is not needed.
+
+    @type  first: list of tuple
+    @param first: hunks (see L{parse_ed_script}) of the first patch
+
+    @type  second: list of tuple
+    @param second: hunks of the second patch, applying to the result of
+                   the first one
+
+    @rtype:  list of tuple
+    @return: hunks of the combined patch
+    """
+    segments = iter(_hunks_to_segments(first))
+    result = []
+    # segment of the intermediate file not consumed yet
+    current = [None]
+
+    def take(count, keep):
+        # consume count lines of the intermediate file
+        while count > 0:
+            segment = current[0] or next(segments)
+            current[0] = None
+            if isinstance(segment, list):
+                length = len(segment)
+                head, tail = segment[:count], segment[count:]
+            else:
+                start, length = segment
+                if length is None:
+                    head, tail = (start, count), (start + count, None)
+                else:
+                    head = (start, min(count, length))
+                    tail = (start + count, length - count)
+            if length is None or length > count:
+                current[0] = tail
+            if keep:
+                result.append(head)
+            count -= min(count, length if length is not None else count)
+
+    pos = 0
+    for start, end, lines in second:
+        take(start - pos, True)
+        take(end - start, False)
+        if lines:
+            result.append(lines)
+        pos = end
+    if current[0] is not None:
+        result.append(current[0])
+    result.extend(segments)
+    return _segments_to_hunks(result)
+
+def read_patch(filename):
+    """read a gzip-compressed patch as written by L{write_patch}
+
+    @type  filename: str
+    @param filename: name of the patch
+
+    @rtype:  str
+    @return: ed script
+    """
+    with closing(gzip.GzipFile(filename, 'rb')) as gz:
+        return gz.read()
+
+def write_patch(script, filename):
+    """write a gzip-compressed patch
+
+    @type  script: str
+    @param script: ed script
+
+    @type  filename: str
+    @param filename: name of the output file
+
+    @rtype:  tuple of dict
+    @return: hashes (see L{daklib.hashcache.MultiHash.result}) of the
+             uncompressed and compressed patch
+    """
+    uncompressed = MultiHash()
+    uncompressed.update(script)
+
+    # Python's gzip module cannot write rsync-friendly files
+    command = ['gzip', '-9cn', '--rsyncable']
+    process = daklib.daksubprocess.Popen(command, stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE, close_fds=True)
+    data = process.communicate(script)[0]
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, " ".join(command))
+    compressed = MultiHash()
+    compressed.update(data)
+    with open(filename, 'w') as fh:
+        fh.write(data)
+
+    return uncompressed.result(), compressed.result()
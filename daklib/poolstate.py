@@ -0,0 +1,139 @@
+"""remember the state of files and directories in the pool
+
+check-archive records the stat information of files whose checksums it
+verified in C{pool_file_state} and the listings of pool directories in
+C{pool_directory_state}.  Later runs only need to rehash files whose
+stat changed and only need to list directories whose mtime changed.
+
+@copyright: 2026, Debian FTP Master <ftpmaster@debian.org>
+@license: GPL-2+
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import os
+import stat
+import time
+
+from daklib.hashcache import stat_mtime
+
+#: listings of directories modified less than this many seconds ago are not
+#: remembered: further changes within the same mtime would go unnoticed
+RACY_SECONDS = 2
+
+def stat_key(st):
+    """
+    @rtype:  tuple
+    @return: (size, mtime, inode) as stored in C{pool_file_state}
+    """
+    return (st.st_size, stat_mtime(st), st.st_ino)
+
+def record_file_states(session, states):
+    """remember the state of verified files
+
+    The rows are written in the session's current transaction.
+
+    @type  states: list
+    @param states: list of (file_id, path, size, mtime, inode) tuples
+    """
+    if not states:
+        return
+    # TODO [sqlalchemy >= 1.1]: use `ON CONFLICT DO UPDATE`
+    session.execute("DELETE FROM pool_file_state WHERE file_id = ANY(:ids)",
+                    {'ids': [state[0] for state in states]})
+    session.execute("""
+        INSERT INTO pool_file_state (file_id, path, size, mtime, inode, last_verified)
+        VALUES (:file_id, :path, :size, :mtime, :inode, now())""",
+        [dict(zip(('file_id', 'path', 'size', 'mtime', 'inode'), state)) for state in states])
+
+def _list_directory(dirpath):
+    """list a directory like C{os.walk}
+
+    Symlinks to directories are neither listed as files nor descended into.
+    """
+    files = []
+    directories = []
+    for name in os.listdir(dirpath):
+        path = os.path.join(dirpath, name)
+        if os.path.isdir(path):
+            if not os.path.islink(path):
+                directories.append(name)
+        else:
+            files.append(name)
+    return files, directories
+
+def list_pool(session, top):
+    """list all files below C{top}
+
+    Remembered listings are used for directories whose mtime and inode
+    did not change.  The remembered listings are updated in the session's
+    current transaction.
+
+    @type  session: SQLAlchemy session
+    @param session: database session
+
+    @type  top: str
+    @param top: directory to list
+
+    @rtype:  set
+    @return: paths of all non-directories below C{top}
+    """
+    known = {}
+    query = """
+        SELECT path, mtime, inode, files, directories FROM pool_directory_state
+         WHERE path = :top OR LEFT(path, LENGTH(:prefix)) = :prefix"""
+    for path, mtime, inode, files, directories in session.execute(query, {'top': top, 'prefix': top + '/'}):
+        known[path] = (mtime, inode, files, directories)
+
+    result = set()
+    changed = []
+    seen = set()
+    racy = time.time() - RACY_SECONDS
+    pending = [top]
+    while pending:
+        dirpath = pending.pop()
+        try:
+            st = os.lstat(dirpath)
+        except OSError:
+            continue
+        if not stat.S_ISDIR(st.st_mode):
+            continue
+        seen.add(dirpath)
+        entry = known.get(dirpath)
+        if entry is not None and entry[:2] == (stat_mtime(st), st.st_ino):
+            files, directories = entry[2:]
+        else:
+            try:
+                files, directories = _list_directory(dirpath)
+            except OSError:
+                continue
+            if st.st_mtime < racy:
+                changed.append((dirpath, stat_mtime(st), st.st_ino, files, directories))
+            elif entry is not None:
+                changed.append((dirpath, None, None, None, None))
+        result.update(os.path.join(dirpath, name) for name in files)
+        pending.extend(os.path.join(dirpath, name) for name in directories)
+
+    removed = [path for path in known if path not in seen]
+    stale = removed + [row[0] for row in changed]
+    if stale:
+        session.execute("DELETE FROM pool_directory_state WHERE path = ANY(:paths)", {'paths': stale})
+    rows = [dict(zip(('path', 'mtime', 'inode', 'files', 'directories'), row))
+            for row in changed if row[1] is not None]
+    if rows:
+        session.execute("""
+            INSERT INTO pool_directory_state (path, mtime, inode, files, directories)
+            VALUES (:path, :mtime, :inode, :files, :directories)""", rows)
+    return result
@@ -143,6 +143,14 @@ re_file_source = re.compile(_re_file_prefix + r'\.' + file_source_ext_re)
 # Groups: package, version
 re_file_orig = re.compile(_re_file_prefix + r'\.' + orig_source_ext_re)
 
+# Match source tarballs
+# Groups: package, version, kind, component, compression
+re_file_source_tarball = re.compile(_re_file_prefix + r'\.(?:(?P<kind>orig(?:-(?P<component>[a-zA-Z0-9-]+))?|debian)\.)?tar(?P<compression>\.(?:gz|bz2|xz))$')
+
+# Match source diffs (format 1.0)
+# Groups: package, version
+re_file_source_diff = re.compile(_re_file_prefix + r'\.diff\.gz$')
+
 # Match buildinfo file
 # Groups: package, version, suffix
 re_file_buildinfo = re.compile(_re_file_prefix + r'_(?P<suffix>[a-zA-Z0-9+-]+)\.buildinfo$')
@@ -42,12 +42,11 @@
 import commands
 import apt_pkg
 import fcntl
-import sqlalchemy.sql as sql
 from re import sub
 from collections import defaultdict
-from regexes import re_build_dep_arch
 
 from daklib.dbconn import *
+from daklib.depgraph import get_dependency_snapshot
 from daklib import utils
 from daklib.regexes import re_bin_only_nmu
 import debianbts as bts
@@ -80,27 +79,21 @@ class ReverseDependencyChecker(object):
         dbsuite = get_suite(suite, session)
         suite_archs2id = dict((x.arch_string, x.arch_id) for x in get_suite_architectures(suite))
         package_dependencies, arch_providers_of, arch_provided_by = self._load_package_information(session,
-                                                                                                   dbsuite.suite_id,
+                                                                                                   dbsuite,
                                                                                                    suite_archs2id)
         self._package_dependencies = package_dependencies
+        self._reverse_dependencies = self._build_reverse_dependencies(package_dependencies)
         self._arch_providers_of = arch_providers_of
         self._arch_provided_by = arch_provided_by
         self._archs_in_suite = set(suite_archs2id)
 
     @staticmethod
-    def _load_package_information(session, suite_id, suite_archs2id):
+    def _load_package_information(session, dbsuite, suite_archs2id):
         package_dependencies = defaultdict(lambda: defaultdict(set))
         arch_providers_of = defaultdict(lambda: defaultdict(set))
         arch_provided_by = defaultdict(lambda: defaultdict(set))
         source_deps = defaultdict(set)
-        metakey_d = get_or_set_metadatakey("Depends", session)
-        metakey_p = get_or_set_metadatakey("Provides", session)
-        params = {
-            'suite_id':     suite_id,
-            'arch_all_id':  suite_archs2id['all'],
-            'metakey_d_id': metakey_d.key_id,
-            'metakey_p_id': metakey_p.key_id,
-        }
+        snapshot = get_dependency_snapshot(session, dbsuite)
         all_arches = set(suite_archs2id)
         all_arches.discard('source')
 
@@ -114,73 +107,62 @@ class ReverseDependencyChecker(object):
             arch_provided_by[architecture] = provided_by
             package_dependencies[architecture] = deps
 
-            params['arch_id'] = suite_archs2id[architecture]
-
-            statement = sql.text('''
-                    SELECT b.package,
-                        (SELECT bmd.value FROM binaries_metadata bmd WHERE bmd.bin_id = b.id AND bmd.key_id = :metakey_d_id) AS depends,
-                        (SELECT bmp.value FROM binaries_metadata bmp WHERE bmp.bin_id = b.id AND bmp.key_id = :metakey_p_id) AS provides
-                        FROM binaries b
-                        JOIN bin_associations ba ON b.id = ba.bin AND ba.suite = :suite_id
-                        WHERE b.architecture = :arch_id OR b.architecture = :arch_all_id''')
-            query = session.query('package', 'depends', 'provides'). \
-                from_statement(statement).params(params)
-            for package, depends, provides in query:
-
-                if depends is not None:
-                    try:
-                        parsed_dep = []
-                        for dep in apt_pkg.parse_depends(depends):
-                            parsed_dep.append(frozenset(d[0] for d in dep))
-                        deps[package].update(parsed_dep)
-                    except ValueError as e:
-                        print "Error for package %s: %s" % (package, e)
+            binaries = snapshot.binaries_by_architecture(architecture)
+            if architecture != 'all':
+                binaries = binaries + snapshot.binaries_by_architecture('all')
+            for package, _, _, depends, provides, error in binaries:
+
+                if error is not None:
+                    print "Error for package %s: %s" % (package, error)
+                elif depends is not None:
+                    deps[package].update(frozenset(dep) for dep in depends)
                 # Maintain a counter for each virtual package.  If a
                 # Provides: exists, set the counter to 0 and count all
                 # provides by a package not in the list for removal.
                 # If the counter stays 0 at the end, we know that only
                 # the to-be-removed packages provided this virtual
                 # package.
-                if provides is not None:
-                    for virtual_pkg in provides.split(","):
-                        virtual_pkg = virtual_pkg.strip()
-                        if virtual_pkg == package:
-                            continue
-                        provided_by[virtual_pkg].add(package)
-                        providers_of[package].add(virtual_pkg)
+                for virtual_pkg in provides:
+                    provided_by[virtual_pkg].add(package)
+                    providers_of[package].add(virtual_pkg)
 
         # Check source dependencies (Build-Depends and Build-Depends-Indep)
-        metakey_bd = get_or_set_metadatakey("Build-Depends", session)
-        metakey_bdi = get_or_set_metadatakey("Build-Depends-Indep", session)
-        params = {
-            'suite_id':    suite_id,
-            'metakey_ids': (metakey_bd.key_id, metakey_bdi.key_id),
-        }
-        statement = sql.text('''
-            SELECT s.source, string_agg(sm.value, ', ') as build_dep
-               FROM source s
-               JOIN source_metadata sm ON s.id = sm.src_id
-               WHERE s.id in
-                   (SELECT source FROM src_associations
-                       WHERE suite = :suite_id)
-                   AND sm.key_id in :metakey_ids
-               GROUP BY s.id, s.source''')
-        query = session.query('source', 'build_dep').from_statement(statement). \
-            params(params)
-        for source, build_dep in query:
-            if build_dep is not None:
-                # Remove [arch] information since we want to see breakage on all arches
-                build_dep = re_build_dep_arch.sub("", build_dep)
-                try:
-                    parsed_dep = []
-                    for dep in apt_pkg.parse_src_depends(build_dep):
-                        parsed_dep.append(frozenset(d[0] for d in dep))
-                    source_deps[source].update(parsed_dep)
-                except ValueError as e:
-                    print "Error for package %s: %s" % (source, e)
+        for source, build_depends, error in snapshot.source_build_depends():
+            if error is not None:
+                print "Error for package %s: %s" % (source, error)
+            source_deps[source].update(frozenset(d[0] for d in dep) for dep in build_depends)
 
         return package_dependencies, arch_providers_of, arch_provided_by
 
+    @staticmethod
+    def _build_reverse_dependencies(package_dependencies):
+        """Index the dependency clauses of each architecture
+
+        A clause is only broken if all of its alternatives are removed, so it
+        is enough to index each clause under one of them.
+        """
+        reverse_dependencies = {}
+        for arch, deps in package_dependencies.iteritems():
+            index = defaultdict(list)
+            for package, dependencies in deps.iteritems():
+                for clause in dependencies:
+                    if clause:
+                        index[min(clause)].append((package, clause))
+            reverse_dependencies[arch] = index
+        return reverse_dependencies
+
+    @staticmethod
+    def _broken_clauses(reverse_dependencies, removals):
+        """Find the clauses that can only be satisfied by removed packages
+
+        @rtype: generator
+        @return: (package, clause) tuples
+        """
+        for removal in removals:
+            for package, clause in reverse_dependencies.get(removal, ()):
+                if clause <= removals:
+                    yield package, clause
+
     def check_reverse_depends(self, removal_requests):
         """Bulk check reverse dependencies
 
@@ -206,12 +188,12 @@ class ReverseDependencyChecker(object):
         archs_in_suite = self._archs_in_suite
         removals_by_arch = defaultdict(set)
         affected_virtual_by_arch = defaultdict(set)
-        package_dependencies = self._package_dependencies
+        reverse_dependencies = self._reverse_dependencies
         arch_providers_of = self._arch_providers_of
         arch_provided_by = self._arch_provided_by
         arch_provides2removal = defaultdict(lambda: defaultdict(set))
         dep_problems = defaultdict(set)
-        src_deps = package_dependencies['source']
+        src_reverse_deps = reverse_dependencies['source']
         src_removals = set()
         arch_all_removals = set()
 
@@ -248,7 +230,13 @@ class ReverseDependencyChecker(object):
         for arch, removed_providers in affected_virtual_by_arch.iteritems():
             provides2removal = arch_provides2removal[arch]
             removals = removals_by_arch[arch]
-            for virtual_pkg, virtual_providers in arch_provided_by[arch].iteritems():
+            providers_of = arch_providers_of[arch]
+            provided_by = arch_provided_by[arch]
+            affected_virtual = set()
+            for provider in removed_providers:
+                affected_virtual.update(providers_of[provider])
+            for virtual_pkg in affected_virtual:
+                virtual_providers = provided_by[virtual_pkg]
                 v = virtual_providers & removed_providers
                 if len(v) == len(virtual_providers):
                     # We removed all the providers of virtual_pkg
@@ -259,39 +247,31 @@ class ReverseDependencyChecker(object):
                     provides2removal[virtual_pkg] = sorted(v)[0]
 
         for arch, removals in removals_by_arch.iteritems():
-            deps = package_dependencies[arch]
+            reverse_deps = reverse_dependencies.get(arch, {})
             provides2removal = arch_provides2removal[arch]
 
             # Check binary dependencies (Depends)
-            for package, dependencies in deps.iteritems():
+            for package, clause in self._broken_clauses(reverse_deps, removals):
                 if package in removals:
                     continue
-                for clause in dependencies:
-                    if not (clause <= removals):
-                        # Something probably still satisfies this relation
-                        continue
-                    # whoops, we seemed to have removed all packages that could possibly satisfy
-                    # this relation.  Lets blame something for it
-                    for dep_package in clause:
-                        removal = dep_package
-                        if dep_package in provides2removal:
-                            removal = provides2removal[dep_package]
-                        dep_problems[(removal, arch)].add((package, arch))
-
-            for source, build_dependencies in src_deps.iteritems():
+                # whoops, we seemed to have removed all packages that could possibly satisfy
+                # this relation.  Lets blame something for it
+                for dep_package in clause:
+                    removal = dep_package
+                    if dep_package in provides2removal:
+                        removal = provides2removal[dep_package]
+                    dep_problems[(removal, arch)].add((package, arch))
+
+            for source, clause in self._broken_clauses(src_reverse_deps, removals):
                 if source in src_removals:
                     continue
-                for clause in build_dependencies:
-                    if not (clause <= removals):
-                        # Something probably still satisfies this relation
-                        continue
-                    # whoops, we seemed to have removed all packages that could possibly satisfy
-                    # this relation.  Lets blame something for it
-                    for dep_package in clause:
-                        removal = dep_package
-                        if dep_package in provides2removal:
-                            removal = provides2removal[dep_package]
-                        dep_problems[(removal, arch)].add((source, 'source'))
+                # whoops, we seemed to have removed all packages that could possibly satisfy
+                # this relation.  Lets blame something for it
+                for dep_package in clause:
+                    removal = dep_package
+                    if dep_package in provides2removal:
+                        removal = provides2removal[dep_package]
+                    dep_problems[(removal, arch)].add((source, 'source'))
 
         return dep_problems
 
@@ -0,0 +1,259 @@
+"""list the files of a source package without unpacking it
+
+The tarballs of a source package are read as streams and the file lists
+of the patches dpkg-source would apply are taken into account, giving
+the same names as listing the tree created by C{dpkg-source -x},
+including the C{.pc} directory it creates for quilt.
+
+Only the formats 1.0, 3.0 (native) and 3.0 (quilt) are supported;
+anything else raises L{daklib.debfile.DebFileError}.
+
+@copyright: 2026, Debian FTP Master <ftpmaster@debian.org>
+@license: GPL-2+
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from contextlib import closing
+import gzip
+import os.path
+import re
+
+from daklib.debfile import DebFileError, iter_tar, normalize_name
+from daklib.regexes import re_file_source_diff, re_file_source_tarball
+
+re_hunk = re.compile(r'^@@ -\d+(?:,(\d+))? \+\d+(?:,(\d+))? @@')
+
+def _read_tarball(filename, compression, wanted=None):
+    """read the members of a tarball
+
+    @type  wanted: callable
+    @param wanted: called with the normalized name of regular files;
+                   the content of files it returns C{True} for is read
+
+    @return: tuple of a list of (name, member) tuples and a dict
+             mapping names to contents
+    """
+    entries = []
+    contents = {}
+    with open(filename, 'rb') as fh:
+        for tar, member in iter_tar(fh, compression):
+            name = os.path.normpath(member.name)
+            if name == '.':
+                continue
+            entries.append((name, member))
+            if wanted is not None and member.isfile() and wanted(name):
+                contents[name] = tar.extractfile(member).read()
+    return entries, contents
+
+def _strip_top_directory(entries):
+    """remove a single top-level directory like dpkg-source does"""
+    tops = set(name.split('/', 1)[0] for name, member in entries)
+    if len(tops) != 1:
+        return entries
+    top = tops.pop()
+    if not any(name != top or member.isdir() for name, member in entries):
+        return entries
+    return [(name[len(top) + 1:], member) for name, member in entries if name != top]
+
+def _patch_path(line, strip):
+    path = line[4:].split('\t', 1)[0].rstrip()
+    if path == '/dev/null':
+        return None
+    return os.path.normpath('/'.join(path.split('/')[strip:]))
+
+def patched_files(patch, strip=1):
+    """iterate over the files changed by a unified diff
+
+    @type  patch: str
+    @param patch: content of the patch
+
+    @type  strip: int
+    @param strip: number of leading path components to remove
+
+    @return: generator yielding (name, deleted) tuples
+    """
+    lines = iter(patch.splitlines())
+    old = None
+    for line in lines:
+        if line.startswith('--- '):
+            old = line
+            continue
+        if line.startswith('+++ ') and old is not None:
+            new_path = _patch_path(line, strip)
+            if new_path is None:
+                yield _patch_path(old, strip), True
+            else:
+                yield new_path, False
+        elif line.startswith('@@ '):
+            match = re_hunk.match(line)
+            if match is None:
+                raise DebFileError("invalid hunk header: {0}".format(line))
+            old_count = int(match.group(1) or 1)
+            new_count = int(match.group(2) or 1)
+            while old_count > 0 or new_count > 0:
+                try:
+                    line = next(lines)
+                except StopIteration:
+                    raise DebFileError("patch ends in the middle of a hunk")
+                if line.startswith('\\'):
+                    continue
+                if line == '' or line[0] == ' ':
+                    old_count -= 1
+                    new_count -= 1
+                elif line[0] == '-':
+                    old_count -= 1
+                elif line[0] == '+':
+                    new_count -= 1
+                else:
+                    raise DebFileError("invalid line in hunk: {0}".format(line))
+        old = None
+
+def _series(content):
+    """parse a quilt series file
+
+    @return: list of (patch, strip) tuples
+    """
+    patches = []
+    for line in content.splitlines():
+        line = re.sub(r'(?:^|\s+)#.*', '', line).strip()
+        if not line:
+            continue
+        fields = line.split()
+        strip = 1
+        for option in fields[1:]:
+            if re.match(r'^-p\d+$', option):
+                strip = int(option[2:])
+            else:
+                raise DebFileError("unsupported option in series file: {0}".format(option))
+        patches.append((fields[0], strip))
+    return patches
+
+class _Tree(object):
+    """names in an unpacked source tree"""
+    def __init__(self):
+        self.files = {}
+        self.dirs = set()
+
+    def add(self, entries, prefix=None):
+        for name, member in entries:
+            if prefix is not None:
+                name = os.path.join(prefix, name)
+            if member.isdir():
+                self.dirs.add(name)
+            elif member.issym():
+                self.files[name] = member.linkname
+            else:
+                self.files[name] = None
+
+    def remove_tree(self, top):
+        prefix = top + '/'
+        for name in [name for name in self.files if name == top or name.startswith(prefix)]:
+            del self.files[name]
+        self.dirs = set(name for name in self.dirs if name != top and not name.startswith(prefix))
+
+    def patch(self, patch, strip=1):
+        """
+        @return: list of the names changed by the patch
+        """
+        changed = []
+        for name, deleted in patched_files(patch, strip):
+            if deleted:
+                self.files.pop(name, None)
+            else:
+                self.files[name] = None
+            changed.append(name)
+        return changed
+
+    def names(self):
+        """
+        @return: set of normalized names; like C{os.walk} symlinks to
+                 directories are not included
+        """
+        dirs = set(self.dirs)
+        for name in self.files:
+            while '/' in name:
+                name = name.rsplit('/', 1)[0]
+                dirs.add(name)
+        names = set()
+        for name, linkname in self.files.iteritems():
+            if linkname is not None and not linkname.startswith('/'):
+                if os.path.normpath(os.path.join(os.path.dirname(name), linkname)) in dirs:
+                    continue
+            names.add(normalize_name(name))
+        return names
+
+def source_names(filenames):
+    """list the files of an unpacked source package
+
+    @type  filenames: list of str
+    @param filenames: paths of the files listed in the .dsc; the .dsc
+                      itself may be included
+
+    @rtype:  set of str
+    @return: normalized names relative to the root of the source tree
+    """
+    native = None
+    orig = None
+    debian = None
+    diff = None
+    components = []
+    for filename in filenames:
+        basename = os.path.basename(filename)
+        match = re_file_source_tarball.match(basename)
+        if match is not None:
+            kind = match.group('kind')
+            tarball = (filename, match.group('compression'))
+            if kind is None:
+                native = tarball
+            elif kind == 'debian':
+                debian = tarball
+            elif match.group('component') is not None:
+                components.append((match.group('component'), tarball))
+            else:
+                orig = tarball
+        elif re_file_source_diff.match(basename):
+            diff = filename
+        elif not basename.endswith('.asc') and not basename.endswith('.dsc'):
+            raise DebFileError("unsupported file in source package: {0}".format(basename))
+
+    tree = _Tree()
+    if native is not None and orig is None and debian is None and diff is None and not components:
+        tree.add(_strip_top_directory(_read_tarball(*native)[0]))
+    elif orig is not None and diff is not None and native is None and debian is None and not components:
+        tree.add(_strip_top_directory(_read_tarball(*orig)[0]))
+        with closing(gzip.GzipFile(diff, 'rb')) as fh:
+            tree.patch(fh.read())
+    elif orig is not None and debian is not None and native is None and diff is None:
+        tree.add(_strip_top_directory(_read_tarball(*orig)[0]))
+        for component, tarball in components:
+            tree.remove_tree(component)
+            tree.add(_strip_top_directory(_read_tarball(*tarball)[0]), component)
+        tree.remove_tree('debian')
+        entries, contents = _read_tarball(*debian, wanted=lambda name: name.startswith('debian/patches/'))
+        tree.add(entries)
+        series = contents.get('debian/patches/debian.series', contents.get('debian/patches/series'))
+        for name in ('.quilt_patches', '.quilt_series', '.version', 'applied-patches'):
+            tree.files[os.path.join('.pc', name)] = None
+        for patch, strip in _series(series or ''):
+            name = os.path.normpath(os.path.join('debian/patches', patch))
+            if name not in contents:
+                raise DebFileError("missing patch: {0}".format(name))
+            # quilt keeps a backup of each changed file
+            for changed in tree.patch(contents[name], strip):
+                tree.files[os.path.join('.pc', patch, changed)] = None
+    else:
+        raise DebFileError("unsupported source format")
+    return tree.names()
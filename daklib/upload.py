@@ -30,6 +30,21 @@ from daklib.gpg import SignedFile
 from daklib.regexes import *
 import daklib.packagelist
 
+#: hashes of files checked by L{HashedFile.check}, by path
+_checked_files = {}
+
+def _stat_key(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+
+def forget_checked_files(directory):
+    """forget the hashes of checked files in C{directory}
+
+    Should be called when the files are removed.
+    """
+    prefix = os.path.join(directory, '')
+    for path in [ path for path in _checked_files if path.startswith(prefix) ]:
+        del _checked_files[path]
+
 class UploadException(Exception):
     pass
 
@@ -149,6 +164,10 @@ class HashedFile(object):
 
         Check if size and hashes match the expected value.
 
+        The hashes of a file are only computed once: files are checked again
+        against the remembered hashes as long as their inode, size, mtime
+        and ctime did not change.
+
         @type  directory: str
         @param directory: directory the file is located in
 
@@ -157,28 +176,59 @@ class HashedFile(object):
         path = os.path.join(directory, self.input_filename)
         try:
             with open(path) as fh:
-                self.check_fh(fh)
+                key = _stat_key(os.fstat(fh.fileno()))
+                checked = _checked_files.get(path)
+                if checked is not None and checked[0] == key:
+                    self._compare(*checked[1])
+                else:
+                    hashes = self._hashes_fh(fh)
+                    _checked_files[path] = (key, hashes)
+                    self._compare(*hashes)
         except IOError as e:
             if e.errno == errno.ENOENT:
                 raise FileDoesNotExist(self.input_filename)
             raise
 
+    def changed_since_check(self, directory):
+        """Check if the file changed after its hashes were checked
+
+        @type  directory: str
+        @param directory: directory the file is located in
+
+        @rtype:  bool
+        @return: C{True} if the file was checked by L{check} and changed
+                 since, C{False} otherwise
+        """
+        path = os.path.join(directory, self.input_filename)
+        checked = _checked_files.get(path)
+        if checked is None:
+            return False
+        try:
+            return _stat_key(os.stat(path)) != checked[0]
+        except OSError:
+            return True
+
     def check_fh(self, fh):
+        self._compare(*self._hashes_fh(fh))
+
+    def _hashes_fh(self, fh):
         size = os.fstat(fh.fileno()).st_size
         fh.seek(0)
         hashes = apt_pkg.Hashes(fh)
+        return (size, hashes.md5, hashes.sha1, hashes.sha256)
 
+    def _compare(self, size, md5sum, sha1sum, sha256sum):
         if size != self.size:
             raise InvalidHashException(self.filename, 'size', self.size, size)
 
-        if hashes.md5 != self.md5sum:
-            raise InvalidHashException(self.filename, 'md5sum', self.md5sum, hashes.md5)
+        if md5sum != self.md5sum:
+            raise InvalidHashException(self.filename, 'md5sum', self.md5sum, md5sum)
 
-        if hashes.sha1 != self.sha1sum:
-            raise InvalidHashException(self.filename, 'sha1sum', self.sha1sum, hashes.sha1)
+        if sha1sum != self.sha1sum:
+            raise InvalidHashException(self.filename, 'sha1sum', self.sha1sum, sha1sum)
 
-        if hashes.sha256 != self.sha256sum:
-            raise InvalidHashException(self.filename, 'sha256sum', self.sha256sum, hashes.sha256)
+        if sha256sum != self.sha256sum:
+            raise InvalidHashException(self.filename, 'sha256sum', self.sha256sum, sha256sum)
 
 def parse_file_list(control, has_priority_and_section, safe_file_regexp = re_file_safe, fields = ('Files', 'Checksums-Sha1', 'Checksums-Sha256')):
     """Parse Files and Checksums-* fields
@@ -32,7 +32,6 @@ import grp
 import select
 import socket
 import shutil
-import sqlalchemy.sql as sql
 import sys
 import tempfile
 import traceback
@@ -55,6 +54,7 @@ from dbconn import DBConn, get_architecture, get_component, get_suite, \
                    Component, Override, OverrideType
 from sqlalchemy import desc
 from dak_exceptions import *
+from depgraph import get_dependency_snapshot
 from gpg import SignedFile
 from textutils import fix_maintainer
 from regexes import re_html_escaping, html_escaping, re_single_line_field, \
@@ -1136,13 +1136,7 @@ def check_reverse_depends(removals, suite, arches=None, session=None, cruft=Fals
         all_arches = set(x.arch_string for x in get_suite_architectures(suite))
     all_arches -= set(["source", "all"])
     removal_set = set(removals)
-    metakey_d = get_or_set_metadatakey("Depends", session)
-    metakey_p = get_or_set_metadatakey("Provides", session)
-    params = {
-        'suite_id':     dbsuite.suite_id,
-        'metakey_d_id': metakey_d.key_id,
-        'metakey_p_id': metakey_p.key_id,
-    }
+    snapshot = get_dependency_snapshot(session, dbsuite)
     if include_arch_all:
         rdep_architectures = all_arches | set(['all'])
     else:
@@ -1151,42 +1145,22 @@ def check_reverse_depends(removals, suite, arches=None, session=None, cruft=Fals
         deps = {}
         sources = {}
         virtual_packages = {}
-        try:
-            params['arch_id'] = get_architecture(architecture, session).arch_id
-        except AttributeError:
-            continue
-
-        statement = sql.text('''
-            SELECT b.package, s.source, c.name as component,
-                (SELECT bmd.value FROM binaries_metadata bmd WHERE bmd.bin_id = b.id AND bmd.key_id = :metakey_d_id) AS depends,
-                (SELECT bmp.value FROM binaries_metadata bmp WHERE bmp.bin_id = b.id AND bmp.key_id = :metakey_p_id) AS provides
-                FROM binaries b
-                JOIN bin_associations ba ON b.id = ba.bin AND ba.suite = :suite_id
-                JOIN source s ON b.source = s.id
-                JOIN files_archive_map af ON b.file = af.file_id
-                JOIN component c ON af.component_id = c.id
-                WHERE b.architecture = :arch_id''')
-        query = session.query('package', 'source', 'component', 'depends', 'provides'). \
-            from_statement(statement).params(params)
-        for package, source, component, depends, provides in query:
+        for package, source, component, depends, provides, error in snapshot.binaries_by_architecture(architecture):
             sources[package] = source
             p2c[package] = component
-            if depends is not None:
-                deps[package] = depends
+            if depends is not None or error is not None:
+                deps[package] = (depends, error)
             # Maintain a counter for each virtual package.  If a
             # Provides: exists, set the counter to 0 and count all
             # provides by a package not in the list for removal.
             # If the counter stays 0 at the end, we know that only
             # the to-be-removed packages provided this virtual
             # package.
-            if provides is not None:
-                for virtual_pkg in provides.split(","):
-                    virtual_pkg = virtual_pkg.strip()
-                    if virtual_pkg == package: continue
-                    if virtual_pkg not in virtual_packages:
-                        virtual_packages[virtual_pkg] = 0
-                    if package not in removals:
-                        virtual_packages[virtual_pkg] += 1
+            for virtual_pkg in provides:
+                if virtual_pkg not in virtual_packages:
+                    virtual_packages[virtual_pkg] = 0
+                if package not in removals:
+                    virtual_packages[virtual_pkg] += 1
 
         # If a virtual package is only provided by the to-be-removed
         # packages, treat the virtual package as to-be-removed too.
@@ -1195,17 +1169,16 @@ def check_reverse_depends(removals, suite, arches=None, session=None, cruft=Fals
         # Check binary dependencies (Depends)
         for package in deps:
             if package in removals: continue
-            try:
-                parsed_dep = apt_pkg.parse_depends(deps[package])
-            except ValueError as e:
-                print "Error for package %s: %s" % (package, e)
+            parsed_dep, error = deps[package]
+            if error is not None:
+                print "Error for package %s: %s" % (package, error)
                 parsed_dep = []
             for dep in parsed_dep:
                 # Check for partial breakage.  If a package has a ORed
                 # dependency, there is only a dependency problem if all
                 # packages in the ORed depends will be removed.
                 unsat = 0
-                for dep_package, _, _ in dep:
+                for dep_package in dep:
                     if dep_package in removals:
                         unsat += 1
                 if unsat == len(dep):
@@ -1242,38 +1215,10 @@ def check_reverse_depends(removals, suite, arches=None, session=None, cruft=Fals
 
     # Check source dependencies (Build-Depends and Build-Depends-Indep)
     all_broken = defaultdict(set)
-    metakey_bd = get_or_set_metadatakey("Build-Depends", session)
-    metakey_bdi = get_or_set_metadatakey("Build-Depends-Indep", session)
-    if include_arch_all:
-        metakey_ids = (metakey_bd.key_id, metakey_bdi.key_id)
-    else:
-        metakey_ids = (metakey_bd.key_id,)
-
-    params = {
-        'suite_id':    dbsuite.suite_id,
-        'metakey_ids': metakey_ids,
-    }
-    statement = sql.text('''
-        SELECT s.source, string_agg(sm.value, ', ') as build_dep
-           FROM source s
-           JOIN source_metadata sm ON s.id = sm.src_id
-           WHERE s.id in
-               (SELECT src FROM newest_src_association
-                   WHERE suite = :suite_id)
-               AND sm.key_id in :metakey_ids
-           GROUP BY s.id, s.source''')
-    query = session.query('source', 'build_dep').from_statement(statement). \
-        params(params)
-    for source, build_dep in query:
+    for source, parsed_dep, error in snapshot.source_build_depends(newest_only=True, include_indep=include_arch_all):
         if source in removals: continue
-        parsed_dep = []
-        if build_dep is not None:
-            # Remove [arch] information since we want to see breakage on all arches
-            build_dep = re_build_dep_arch.sub("", build_dep)
-            try:
-                parsed_dep = apt_pkg.parse_src_depends(build_dep)
-            except ValueError as e:
-                print "Error for source %s: %s" % (source, e)
+        if error is not None:
+            print "Error for source %s: %s" % (source, error)
         for dep in parsed_dep:
             unsat = 0
             for dep_package, _, _ in dep:
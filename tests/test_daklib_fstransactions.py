@@ -88,6 +88,20 @@ class FilesystemTransactionTestCase(DakTestCase):
             self.assert_(os.path.exists(t.filename('a')))
             self.assert_(not os.path.exists(t.filename('b')))
 
+    def test_reflink_and_commit(self):
+        with TemporaryDirectory() as t:
+            self._write_to_a(t)
+            os.chmod(t.filename('a'), 0o600)
+
+            with FilesystemTransaction() as fs:
+                self._copy_a_b(t, fs, reflink=True, mode=0o644)
+
+            with open(t.filename('b')) as fh:
+                self.assertEqual(fh.read(), 'a\n')
+            self.assertEqual(os.stat(t.filename('a')).st_mode & 0o777, 0o600)
+            self.assertEqual(os.stat(t.filename('b')).st_mode & 0o777, 0o644)
+            self.assertNotEqual(os.stat(t.filename('a')).st_ino, os.stat(t.filename('b')).st_ino)
+
     def test_unlink_and_commit(self):
         with TemporaryDirectory() as t:
             self._write_to_a(t)
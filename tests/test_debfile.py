@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+from daklib import debfile
+
+from distutils.spawn import find_executable
+from StringIO import StringIO
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import unittest
+
+def ar_member(name, data):
+    header = "%-16s%-12s%-6s%-6s%-8s%-10s`\n" % (name + '/', 0, 0, 0, 100644, len(data))
+    return header + data + ('\n' if len(data) % 2 else '')
+
+def tarball(names, compression=''):
+    buf = StringIO()
+    mode = 'w:' + compression.lstrip('.') if compression in ('.gz', '.bz2') else 'w'
+    tar = tarfile.open(fileobj=buf, mode=mode)
+    for name in names:
+        info = tarfile.TarInfo(name)
+        if name.endswith('/'):
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+        else:
+            content = "content of %s\n" % name
+            info.size = len(content)
+            tar.addfile(info, StringIO(content))
+    tar.close()
+    data = buf.getvalue()
+    if compression in debfile.pipe_decompressors:
+        command = {'.xz': ['xz'], '.zst': ['zstd', '-q']}[compression]
+        process = subprocess.Popen(command + ['--stdout'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        data = process.communicate(data)[0]
+    return data
+
+NAMES = ['./', './usr/', './usr/bin/', './usr/bin/hello', './usr/share/doc/hello/copyright', 'caf\xe9']
+
+class DebFileTestCase(DakTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_deb(self, compression, names=NAMES):
+        filename = os.path.join(self.tmpdir, 'test.deb')
+        with open(filename, 'w') as fh:
+            fh.write(debfile.AR_MAGIC)
+            fh.write(ar_member('debian-binary', '2.0\n'))
+            fh.write(ar_member('control.tar.gz', tarball(['./control'], '.gz')))
+            fh.write(ar_member('data.tar' + compression, tarball(names, compression)))
+        return filename
+
+    def assertNames(self, compression):
+        filename = self.write_deb(compression)
+        self.assertEqual(list(debfile.data_names(filename)),
+            ['usr/bin/hello', 'usr/share/doc/hello/copyright', 'caf\xc3\xa9'])
+
+    def test_uncompressed(self):
+        self.assertNames('')
+
+    def test_gz(self):
+        self.assertNames('.gz')
+
+    def test_bz2(self):
+        self.assertNames('.bz2')
+
+    @unittest.skipUnless(find_executable('xz'), 'xz not installed')
+    def test_xz(self):
+        self.assertNames('.xz')
+
+    @unittest.skipUnless(find_executable('zstd'), 'zstd not installed')
+    def test_zst(self):
+        self.assertNames('.zst')
+
+    def test_empty(self):
+        filename = self.write_deb('.gz', ['./', './usr/'])
+        self.assertEqual(list(debfile.data_names(filename)), [])
+
+    def test_ar_members(self):
+        filename = self.write_deb('.gz')
+        with open(filename) as fh:
+            members = [name for name, size in debfile.ar_members(fh)]
+        self.assertEqual(members, ['debian-binary', 'control.tar.gz', 'data.tar.gz'])
+
+    def test_invalid(self):
+        filename = os.path.join(self.tmpdir, 'invalid.deb')
+        with open(filename, 'w') as fh:
+            fh.write("not an ar archive")
+        self.assertRaises(debfile.DebFileError, list, debfile.data_names(filename))
+
+if __name__ == '__main__':
+    unittest.main()
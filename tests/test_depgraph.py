@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+from daklib.depgraph import DependencySnapshot, parse_build_depends, parse_depends
+
+import os
+import shutil
+import tempfile
+import unittest
+
+class FakeSuite(object):
+    suite_id = 1
+    archive_id = 1
+    suite_name = 'unstable'
+
+class DependencySnapshotTestCase(DakTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_depends(self):
+        self.assertEqual(parse_depends('a', 'b (>= 1) | c, d', 'a, va, vb'),
+            ((('b', 'c'), ('d', )), ('va', 'vb'), None))
+        self.assertEqual(parse_depends('a', None, None), (None, (), None))
+        depends, provides, error = parse_depends('a', 'b (>>', None)
+        self.assertEqual(depends, None)
+        self.assertNotEqual(error, None)
+
+    def test_parse_build_depends(self):
+        self.assertEqual(parse_build_depends('b [amd64], c (>= 1)'),
+            (((('b', '', ''), ), (('c', '1', '>='), )), None))
+        self.assertEqual(parse_build_depends(None), ((), None))
+
+    def test_save_load(self):
+        filename = os.path.join(self.tmpdir, 'dependency-snapshot', 'unstable')
+        snapshot = DependencySnapshot(FakeSuite(), filename)
+        snapshot.fingerprint = ('1:1:1', '1:2:2')
+        snapshot.binaries = {1: ('a', 'all', 'a', 'main', (('b', ), ), (), None)}
+        snapshot.sources = {2: ('a', '1.0', ((('b', '', ''), ), ), None, (), None)}
+        snapshot.save()
+
+        loaded = DependencySnapshot(FakeSuite(), filename)
+        self.assertEqual(loaded.fingerprint, snapshot.fingerprint)
+        self.assertEqual(loaded.binaries, snapshot.binaries)
+        self.assertEqual(loaded.binaries_by_architecture('all'),
+            [('a', 'a', 'main', (('b', ), ), (), None)])
+        self.assertEqual(loaded.source_build_depends(), [('a', ((('b', '', ''), ), ), None)])
+
+    def test_invalid_file(self):
+        filename = os.path.join(self.tmpdir, 'unstable')
+        with open(filename, 'w') as fh:
+            fh.write('garbage')
+        snapshot = DependencySnapshot(FakeSuite(), filename)
+        self.assertEqual(snapshot.fingerprint, None)
+        self.assertEqual(snapshot.binaries, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,10 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import bz2
+import gzip
+import hashlib
+import os
 import tempfile
 import shutil
 from base_test import DakTestCase
@@ -84,3 +88,48 @@ class FileWriterTest(DakTestCase):
                 # (currently we just test it does not crash).
         finally:
             shutil.rmtree(tmpdir)
+
+    def test_output_files(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            writer = PackagesFileWriter(archive=tmpdir,
+                                        suite=SUITE,
+                                        component=COMPONENT,
+                                        architecture=ARCH,
+                                        debtype='deb')
+            fd = writer.open()
+            fd.write('hallo world')
+            writer.close()
+            output_files = writer.output_files()
+            self.assertEqual(sorted(output_files), [writer.path + '.gz', writer.path + '.xz'])
+            for filename in output_files:
+                self.assertTrue(os.path.exists(filename))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_compressed_output(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            writer = PackagesFileWriter(archive=tmpdir,
+                                        suite=SUITE,
+                                        component=COMPONENT,
+                                        architecture=ARCH,
+                                        debtype='deb',
+                                        compression=['bzip2', 'gzip', 'none'])
+            output = writer.open()
+            for i in range(1000):
+                print >>output, "Package: package-{0}".format(i)
+                print >>output, ""
+            writer.close()
+            with open(writer.path) as fh:
+                expected = fh.read()
+            self.assertEqual(expected.count("Package: "), 1000)
+            self.assertEqual(writer.uncompressed_hashes['size'], len(expected))
+            self.assertEqual(writer.uncompressed_hashes['sha256'], hashlib.sha256(expected).hexdigest())
+            self.assertEqual(bz2.BZ2File(writer.path + '.bz2').read(), expected)
+            self.assertEqual(gzip.GzipFile(writer.path + '.gz').read(), expected)
+            self.assertFalse(os.path.exists(writer.path + '.xz'))
+            self.assertEqual(sorted(os.listdir(os.path.dirname(writer.path))),
+                             ['Packages', 'Packages.bz2', 'Packages.gz'])
+        finally:
+            shutil.rmtree(tmpdir)
@@ -19,6 +19,7 @@
 import datetime
 import unittest
 from base_test import DakTestCase, fixture
+import daklib.gpg
 from daklib.gpg import GpgException, SignedFile
 
 keyring = fixture('gpg/gnupghome/pubring.gpg')
@@ -90,5 +91,84 @@ class GpgTest(DakTestCase):
         with self.assertRaises(GpgException):
             verify('gpg/md5.asc')
 
+class GpgCacheTest(DakTestCase):
+    def setUp(self):
+        daklib.gpg._verification_cache.clear()
+        self.run_gpg = SignedFile._run_gpg
+        self.cache_size = daklib.gpg.CACHE_SIZE
+
+    def tearDown(self):
+        SignedFile._run_gpg = self.run_gpg
+        daklib.gpg.CACHE_SIZE = self.cache_size
+        daklib.gpg._batch_size = 0
+        daklib.gpg._verification_cache.clear()
+
+    def no_gpg(self):
+        def fail(self, data):
+            raise Exception('gpg should not be run')
+        SignedFile._run_gpg = fail
+
+    def test_cached(self):
+        first = verify('gpg/valid.asc')
+        self.no_gpg()
+        second = verify('gpg/valid.asc')
+        self.assertEqual(second.cache_key, first.cache_key)
+        self.assertEqual(second.primary_fingerprint, fpr_valid)
+        self.assertEqual(second.contents, "Valid: yes\n")
+
+    def test_cached_failure(self):
+        for filename in ('gpg/expired.asc', 'gpg/md5.asc'):
+            with self.assertRaises(GpgException):
+                verify(filename)
+        self.no_gpg()
+        for filename in ('gpg/expired.asc', 'gpg/md5.asc'):
+            with self.assertRaises(GpgException):
+                verify(filename)
+
+    def test_verify_signed_files(self):
+        datas = []
+        for filename in ('gpg/valid.asc', 'gpg/expired.asc', 'gpg/plaintext.txt'):
+            with open(fixture(filename)) as fh:
+                datas.append(fh.read())
+        daklib.gpg.verify_signed_files(datas, [keyring], threads=2)
+        self.no_gpg()
+        self.assertEqual(verify('gpg/valid.asc').primary_fingerprint, fpr_valid)
+        self.assertFalse(verify('gpg/expired.asc', False).valid)
+        with self.assertRaises(GpgException):
+            verify('gpg/plaintext.txt')
+
+    def test_verify_signed_files_larger_than_cache(self):
+        daklib.gpg.CACHE_SIZE = 1
+        datas = []
+        for filename in ('gpg/valid.asc', 'gpg/expired.asc', 'gpg/plaintext.txt'):
+            with open(fixture(filename)) as fh:
+                datas.append(fh.read())
+        daklib.gpg.verify_signed_files(datas, [keyring], threads=2)
+        self.no_gpg()
+        self.assertEqual(verify('gpg/valid.asc').primary_fingerprint, fpr_valid)
+        self.assertFalse(verify('gpg/expired.asc', False).valid)
+        with self.assertRaises(GpgException):
+            verify('gpg/plaintext.txt')
+
+    def test_evict_least_recently_used(self):
+        daklib.gpg.CACHE_SIZE = 2
+        verify('gpg/valid.asc')
+        verify('gpg/expired.asc', False)
+        verify('gpg/valid.asc')
+        verify('gpg/expired-subkey.asc', False)
+        self.no_gpg()
+        self.assertEqual(verify('gpg/valid.asc').primary_fingerprint, fpr_valid)
+        self.assertFalse(verify('gpg/expired-subkey.asc', False).valid)
+        with self.assertRaisesRegexp(Exception, 'gpg should not be run'):
+            verify('gpg/expired.asc', False)
+
+    def test_export_import(self):
+        key = verify('gpg/valid.asc').cache_key
+        verifications = daklib.gpg.export_verifications([key])
+        daklib.gpg._verification_cache.clear()
+        daklib.gpg.import_verifications(verifications)
+        self.no_gpg()
+        self.assertEqual(verify('gpg/valid.asc').primary_fingerprint, fpr_valid)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+from daklib.hashcache import HashCache, MultiHash, hash_fileobj
+
+from StringIO import StringIO
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+class MultiHashTestCase(DakTestCase):
+    data = "Package: hello\nVersion: 2.2-1\n\n" * 1000
+
+    def assertHashes(self, result, data):
+        self.assertEqual(result['size'], len(data))
+        self.assertEqual(result['md5sum'], hashlib.md5(data).hexdigest())
+        self.assertEqual(result['sha1'], hashlib.sha1(data).hexdigest())
+        self.assertEqual(result['sha256'], hashlib.sha256(data).hexdigest())
+
+    def test_update(self):
+        multihash = MultiHash()
+        for i in range(0, len(self.data), 7):
+            multihash.write(self.data[i:i+7])
+        self.assertHashes(multihash.result(), self.data)
+
+    def test_hash_fileobj(self):
+        self.assertHashes(hash_fileobj(StringIO(self.data), blocksize=100), self.data)
+
+    def test_empty(self):
+        self.assertHashes(hash_fileobj(StringIO("")), "")
+
+def float8(value):
+    """value as returned by PostgreSQL < 12 for a DOUBLE PRECISION column"""
+    if isinstance(value, float):
+        return float('%.15g' % value)
+    return value
+
+class FakeResult(object):
+    def __init__(self, row):
+        self.row = row
+
+    def fetchone(self):
+        return self.row
+
+class FakeSession(object):
+    """stores file_hash_cache rows, rounding floats like PostgreSQL"""
+    columns = ('stat_path', 'inode', 'stat_size', 'mtime', 'size', 'md5sum', 'sha1', 'sha256')
+
+    def __init__(self):
+        self.rows = {}
+
+    def execute(self, query, params):
+        if query.strip().startswith('INSERT'):
+            for row in params:
+                self.rows[row['path']] = tuple(float8(row[c]) for c in self.columns)
+        elif query.strip().startswith('SELECT'):
+            return FakeResult(self.rows.get(params['path']))
+
+class HashCacheTestCase(DakTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'Packages')
+        with open(self.path, 'w') as fh:
+            fh.write("Package: hello\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_subsecond_mtime(self):
+        mtime = 1500000000.123456
+        os.utime(self.path, (mtime, mtime))
+        with open(self.path, 'rb') as fh:
+            result = hash_fileobj(fh)
+
+        session = FakeSession()
+        cache = HashCache(session)
+        cache.set(self.path, result)
+        cache.flush()
+
+        self.assertEqual(HashCache(session).get(self.path), result)
+
+    def test_changed_file(self):
+        session = FakeSession()
+        cache = HashCache(session)
+        with open(self.path, 'rb') as fh:
+            cache.set(self.path, hash_fileobj(fh))
+        cache.flush()
+
+        with open(self.path, 'a') as fh:
+            fh.write("Version: 2.2-1\n")
+        self.assertEqual(HashCache(session).get(self.path), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,14 @@
 
 from base_test import DakTestCase
 
+import os
+import shutil
+import tempfile
+import time
 import unittest
 
-from daklib.lintian import parse_lintian_output, generate_reject_messages
+from daklib.lintian import parse_lintian_output, generate_reject_messages, \
+    lintian_cache_key, LintianCache
 
 class ParseLintianTestCase(DakTestCase):
     def assertParse(self, output, expected):
@@ -144,5 +149,45 @@ class GenerateRejectMessages(DakTestCase):
             1,
         )
 
+class LintianCacheTestCase(DakTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testKey(self):
+        files = [('a.changes', '1'), ('a.dsc', '2')]
+        key = lintian_cache_key(files, ['tag-a', 'tag-b'])
+        self.assertEqual(key, lintian_cache_key(reversed(files), ['tag-b', 'tag-a']))
+        self.assertNotEqual(key, lintian_cache_key([('a.changes', '1'), ('a.dsc', '3')], ['tag-a', 'tag-b']))
+        self.assertNotEqual(key, lintian_cache_key(files, ['tag-a']))
+
+    def testMemory(self):
+        cache = LintianCache()
+        self.assertEqual(cache.get('key'), None)
+        cache.put('key', 1, 'E: pkgname: some-tag\n')
+        self.assertEqual(cache.get('key'), (1, 'E: pkgname: some-tag\n'))
+
+    def testDirectory(self):
+        directory = os.path.join(self.tmpdir, 'lintian')
+        LintianCache(directory).put('key', 1, 'E: pkgname: some-tag\nW: pkgname: other-tag\n')
+        self.assertEqual(LintianCache(directory).get('key'),
+                         (1, 'E: pkgname: some-tag\nW: pkgname: other-tag\n'))
+        self.assertEqual(LintianCache(directory).get('other'), None)
+
+    def testExpire(self):
+        directory = os.path.join(self.tmpdir, 'lintian')
+        LintianCache(directory).put('old', 0, '')
+        LintianCache(directory).put('new', 0, '')
+        past = time.time() - 8 * 86400
+        os.utime(os.path.join(directory, 'old'), (past, past))
+
+        cache = LintianCache(directory)
+        self.assertEqual(cache.get('old'), None)
+        self.assertEqual(cache.get('new'), (0, ''))
+        cache.expire()
+        self.assertEqual(os.listdir(directory), ['new'])
+
 if __name__ == '__main__':
     unittest.main()
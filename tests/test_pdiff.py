@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+from daklib import pdiff
+
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+def apply_ed_script(lines, script):
+    """apply the subset of ed commands generated by daklib.pdiff"""
+    lines = list(lines)
+    commands = iter(script.splitlines(True))
+    for command in commands:
+        m = re.match(r'^(\d+)(?:,(\d+))?([acd])\n$', command)
+        first = int(m.group(1))
+        last = int(m.group(2) or first)
+        text = []
+        if m.group(3) in 'ac':
+            for line in commands:
+                if line == '.\n':
+                    break
+                text.append(line)
+        if m.group(3) == 'a':
+            lines[first:first] = text
+        elif m.group(3) == 'c':
+            lines[first - 1:last] = text
+        else:
+            del lines[first - 1:last]
+    return lines
+
+def stanza(package, version=1):
+    return "Package: {0}\nVersion: {1}\n\n".format(package, version)
+
+class PDiffTestCase(DakTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        filename = os.path.join(self.tmpdir, name)
+        if name.endswith('.gz'):
+            fh = gzip.GzipFile(filename, 'w')
+        else:
+            fh = open(filename, 'w')
+        fh.write(content)
+        fh.close()
+        return filename
+
+    def assertPatch(self, old, new, by_stanza=True, **kwargs):
+        oldunits = pdiff.IndexUnits(self.write('old.gz', old), by_stanza)
+        newunits = pdiff.IndexUnits(self.write('new', new), by_stanza)
+        blocks = pdiff.matching_blocks(oldunits.keys, newunits.keys, **kwargs)
+        script = pdiff.ed_script(oldunits, newunits, blocks)
+        result = apply_ed_script(old.splitlines(True), script)
+        self.assertEqual("".join(result), new)
+        return script
+
+    def test_unchanged(self):
+        content = stanza('a') + stanza('b')
+        self.assertEqual(self.assertPatch(content, content), "")
+
+    def test_stanzas(self):
+        old = "".join(stanza(p) for p in 'abcdefgh')
+        new = stanza('0') + "".join(stanza(p, 2 if p == 'd' else 1) for p in 'abcdfgh') + stanza('z')
+        script = self.assertPatch(old, new)
+        # changes are emitted from the end of the file to the start
+        self.assertEqual(script.splitlines()[0], "24a")
+
+    def test_lines(self):
+        old = "".join("file{0} pkg{0}\n".format(i) for i in range(1000))
+        new = old.replace("file500 ", "file500a ").replace("file7 pkg7\n", "")
+        self.assertPatch(old, new, by_stanza=False, anchor_density=10)
+
+    def test_max_edits(self):
+        old = "".join(stanza(p) for p in 'abcdefgh')
+        new = "".join(stanza(p) for p in 'hgfedcba')
+        self.assertPatch(old, new)
+        self.assertPatch(old, new, max_edits=1)
+
+    def test_empty(self):
+        self.assertPatch("", stanza('a'))
+        self.assertPatch(stanza('a'), "")
+
+    def test_hashes(self):
+        content = stanza('a')
+        units = pdiff.IndexUnits(self.write('Packages.gz', content))
+        self.assertEqual(units.hashes['size'], len(content))
+        self.assertEqual(len(units), 1)
+
+    def test_single_dot(self):
+        oldunits = pdiff.IndexUnits(self.write('old', "a\n"), False)
+        newunits = pdiff.IndexUnits(self.write('new', "a\n.\n"), False)
+        self.assertRaises(pdiff.PDiffError, pdiff.ed_script, oldunits, newunits)
+
+    def test_write_patch(self):
+        filename = os.path.join(self.tmpdir, 'patch.gz')
+        uncompressed, compressed = pdiff.write_patch("1d\n", filename)
+        self.assertEqual(uncompressed['size'], 3)
+        self.assertEqual(compressed['size'], os.stat(filename).st_size)
+        self.assertEqual(gzip.GzipFile(filename).read(), "1d\n")
+        self.assertEqual(pdiff.read_patch(filename), "1d\n")
+
+    def test_parse_ed_script(self):
+        old = "".join("line{0}\n".format(i) for i in range(20))
+        new = old.replace("line3\n", "").replace("line10\n", "new\nline10\n")
+        script = self.assertPatch(old, new, by_stanza=False)
+        hunks = pdiff.parse_ed_script(script)
+        self.assertEqual(pdiff.format_ed_script(hunks), script)
+        self.assertRaises(pdiff.PDiffError, pdiff.parse_ed_script, "1a\nx\n")
+        self.assertRaises(pdiff.PDiffError, pdiff.parse_ed_script, "1d\n3d\n")
+
+    def test_compose_hunks(self):
+        versions = ["".join(stanza(p) for p in 'abcdefgh')]
+        versions.append(versions[-1].replace(stanza('c'), stanza('c', 2)) + stanza('i'))
+        versions.append(versions[-1].replace(stanza('a'), "").replace(stanza('i'), stanza('i', 2)))
+        versions.append(stanza('0') + versions[-1].replace(stanza('e'), ""))
+        merged = []
+        for old, new in zip(versions, versions[1:]):
+            hunks = pdiff.parse_ed_script(self.assertPatch(old, new))
+            merged = pdiff.compose_hunks(merged, hunks)
+        result = apply_ed_script(versions[0].splitlines(True), pdiff.format_ed_script(merged))
+        self.assertEqual("".join(result), versions[-1])
+
+if __name__ == '__main__':
+    unittest.main()
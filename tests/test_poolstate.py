@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+from daklib import poolstate
+
+import os
+import shutil
+import tempfile
+import unittest
+
+def float8(value):
+    """value as returned by PostgreSQL < 12 for a DOUBLE PRECISION column"""
+    if isinstance(value, float):
+        return float('%.15g' % value)
+    return value
+
+class FakeSession(object):
+    """stores pool_directory_state rows, rounding floats like PostgreSQL"""
+    columns = ('path', 'mtime', 'inode', 'files', 'directories')
+
+    def __init__(self):
+        self.rows = {}
+
+    def execute(self, query, params):
+        query = query.strip()
+        if query.startswith('SELECT'):
+            return [row for path, row in sorted(self.rows.iteritems())]
+        elif query.startswith('DELETE'):
+            for path in params['paths']:
+                self.rows.pop(path, None)
+        elif query.startswith('INSERT'):
+            for row in params:
+                self.rows[row['path']] = tuple(float8(row[c]) for c in self.columns)
+
+class PoolStateTestCase(DakTestCase):
+    mtime = 1500000000.123456
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.top = os.path.join(self.directory, 'pool')
+        os.makedirs(os.path.join(self.top, 'main', 'h', 'hello'))
+        self.filename = os.path.join(self.top, 'main', 'h', 'hello', 'hello_2.2-1.dsc')
+        with open(self.filename, 'w') as fh:
+            fh.write("Source: hello\n")
+        for dirpath, directories, files in os.walk(self.directory):
+            for name in files:
+                os.utime(os.path.join(dirpath, name), (self.mtime, self.mtime))
+            os.utime(dirpath, (self.mtime, self.mtime))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_stat_key(self):
+        key = poolstate.stat_key(os.stat(self.filename))
+        self.assertEqual(tuple(float8(value) for value in key), key)
+
+    def test_list_pool(self):
+        session = FakeSession()
+        self.assertEqual(poolstate.list_pool(session, self.top), set([self.filename]))
+        self.assertEqual(len(session.rows), 4)
+
+        # remembered listings must be used, sub-second mtimes included
+        def fail(dirpath):
+            self.fail("{0} was listed again".format(dirpath))
+        list_directory = poolstate._list_directory
+        poolstate._list_directory = fail
+        try:
+            self.assertEqual(poolstate.list_pool(session, self.top), set([self.filename]))
+        finally:
+            poolstate._list_directory = list_directory
+
+if __name__ == '__main__':
+    unittest.main()
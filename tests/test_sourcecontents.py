@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase, fixture
+
+from daklib.debfile import DebFileError
+from daklib.sourcecontents import patched_files, source_names
+
+from StringIO import StringIO
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+NEW_PATCH = """Description: add new.c
+--- /dev/null
++++ b/src/new.c
+@@ -0,0 +1 @@
++new
+--- a/src/a.c
++++ b/src/a.c
+@@ -1,2 +1,2 @@
+--- not a header
++a
+ context
+"""
+
+DELETE_PATCH = """--- a/src/b.c\t2020-01-01 00:00:00
++++ /dev/null
+@@ -1 +0,0 @@
+-b
+"""
+
+class SourceContentsTestCase(DakTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_tarball(self, name, files, symlinks={}):
+        filename = os.path.join(self.tmpdir, name)
+        tar = tarfile.open(filename, 'w:gz')
+        for path, content in files.iteritems():
+            info = tarfile.TarInfo(path)
+            info.size = len(content)
+            tar.addfile(info, StringIO(content))
+        for path, target in symlinks.iteritems():
+            info = tarfile.TarInfo(path)
+            info.type = tarfile.SYMTYPE
+            info.linkname = target
+            tar.addfile(info)
+        tar.close()
+        return filename
+
+    def test_patched_files(self):
+        self.assertEqual(list(patched_files(NEW_PATCH)),
+            [('src/new.c', False), ('src/a.c', False)])
+        self.assertEqual(list(patched_files(DELETE_PATCH)), [('src/b.c', True)])
+        self.assertRaises(DebFileError, list, patched_files("@@ -1,3 +1,3 @@\n a\n"))
+
+    def test_fixture(self):
+        directory = fixture('ftp/pool/main/h/hello')
+        filenames = [os.path.join(directory, name) for name in
+            ('hello_2.2-1.dsc', 'hello_2.2.orig.tar.gz', 'hello_2.2-1.debian.tar.gz')]
+        self.assertEqual(source_names(filenames), set([
+            'README', 'debian/changelog', 'debian/control', 'debian/rules',
+            'debian/source/format', '.pc/.quilt_patches', '.pc/.quilt_series',
+            '.pc/.version', '.pc/applied-patches',
+        ]))
+
+    def test_quilt(self):
+        orig = self.write_tarball('hello_1.0.orig.tar.gz', {
+            'hello-1.0/src/a.c': "a\ncontext\n",
+            'hello-1.0/src/b.c': "b\n",
+            'hello-1.0/debian/rules': "upstream\n",
+        }, {'hello-1.0/src-link': 'src', 'hello-1.0/file-link': 'src/a.c'})
+        component = self.write_tarball('hello_1.0.orig-doc.tar.gz', {'doc/index.html': ""})
+        debian = self.write_tarball('hello_1.0-1.debian.tar.gz', {
+            'debian/control': "",
+            'debian/patches/series': "# comment\n01-new.patch\n02-delete.patch -p1\n",
+            'debian/patches/01-new.patch': NEW_PATCH,
+            'debian/patches/02-delete.patch': DELETE_PATCH,
+        })
+        self.assertEqual(source_names([orig, component, debian]), set([
+            'src/a.c', 'src/new.c', 'file-link', 'doc/index.html',
+            'debian/control', 'debian/patches/series',
+            'debian/patches/01-new.patch', 'debian/patches/02-delete.patch',
+            '.pc/.quilt_patches', '.pc/.quilt_series', '.pc/.version', '.pc/applied-patches',
+            '.pc/01-new.patch/src/new.c', '.pc/01-new.patch/src/a.c',
+            '.pc/02-delete.patch/src/b.c',
+        ]))
+
+    def test_native(self):
+        native = self.write_tarball('hello_1.0.tar.gz', {'hello/a': "", 'hello/b/c': ""})
+        self.assertEqual(source_names([native]), set(['a', 'b/c']))
+
+    def test_unsupported(self):
+        self.assertRaises(DebFileError, source_names, ['hello_1.0.git'])
+        self.assertRaises(DebFileError, source_names, ['hello_1.0-1.debian.tar.gz'])
+
+if __name__ == '__main__':
+    unittest.main()